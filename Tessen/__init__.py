@@ -5,6 +5,24 @@ __author__ = 'Nigel Cleland'
 __email__ = 'nigel.cleland@gmail.com'
 __version__ = '0.2.0'
 
-from generate import create_fan
-from visualise import plot_fan
-from bulk_operation import bulk_run
+from generate import create_fan, iter_fans
+from fan_index import FanIndex
+from aggregate import aggregate_fans, AggregateCurves
+from query import DispatchQuery
+from export import export_tiles
+
+
+# The plotting modules import matplotlib, which is slow and not needed to
+# generate fans, so they are only imported once a plot is asked for.
+def plot_fan(*args, **kargs):
+    """ Plot a fan curve, see Tessen.visualise.plot_fan """
+    from visualise import plot_fan
+    return plot_fan(*args, **kargs)
+
+
+def bulk_run(*args, **kargs):
+    """ Generate and plot the fans for a number of dates, see
+    Tessen.bulk_operation.bulk_run
+    """
+    from bulk_operation import bulk_run
+    return bulk_run(*args, **kargs)
@@ -0,0 +1,636 @@
+""" Aggregation of station fans into energy and reserve tradeoff curves.
+
+The reserve contours of a fan are built here independently of any plotting,
+either for a single filtered slice of a fan, see reserve_contours, or for
+every trading period, reserve type and island of a fan in one go, see
+aggregate_fans. The latter are held as a few flat arrays so that thousands
+of curves may be analysed without creating a figure for each.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+from fan_index import FanIndex
+from store import date_name, select_rows, _as_list, _date_names
+
+
+# Name of the market wide (NI + SI) aggregate curves
+MARKET_NAME = "NZ"
+
+CURVE_COLUMNS = ["Trading_Date", "Trading_Period", "Reserve_Type",
+                 "Island_Name", "Reserve Price"]
+
+# The fan columns used to build the reserve contours
+CONTOUR_COLUMNS = ["Node", "Product_Type", "Cumulative Energy Quantity",
+                   "Incremental Energy Quantity", "Energy Price",
+                   "Reserve Price", "Incremental Reserve Quantity"]
+
+
+def aggregate_fans(fan, price_increments=None, market=True, compact=True):
+    """ Aggregate the station fans of every trading period, reserve type and
+    island into their reserve contours.
+
+    Every slice of the fan is swept in a single pass, see
+    reserve_contour_deltas, so the cost does not grow with the number of
+    trading periods in the fan beyond the contours themselves.
+
+    Parameters:
+    -----------
+    fan: DataFrame of generated fan data or a FanIndex of one
+    price_increments: Optional, the reserve prices to build contours at,
+                      defaults to every reserve price offered in each
+                      trading period.
+    market: Optional, also build the market wide contours of both islands
+            combined, with an Island_Name of MARKET_NAME.
+    compact: Optional, drop the points which lie on a straight line between
+             their neighbours at the same energy price, see breakpoints.
+             The curves are unchanged but much smaller.
+
+    Returns:
+    --------
+    AggregateCurves: The contours of every trading period, the trading dates
+                     are named as in the fan store, e.g. "20131212"
+
+    """
+    if isinstance(fan, FanIndex):
+        fan = fan.fan
+
+    columns = [_date_names(fan["Trading_Date"]),
+               np.asarray(fan["Trading_Period"]).astype(int),
+               np.asarray(fan["Reserve_Type"]), np.asarray(fan["Island_Name"])]
+    codes, names = zip(*[pd.factorize(x, sort=True) for x in columns])
+    names = [list(x) for x in names]
+
+    # The market slices repeat the rows of both islands after them
+    rows = np.arange(len(fan))
+    keys = list(codes)
+    if market:
+        rows = np.concatenate((rows, rows))
+        keys = [x[rows] for x in keys]
+        keys[3][len(fan):] = len(names[3])
+        names[3].append(MARKET_NAME)
+
+    # Number the slices in (date, period, reserve type, island) order
+    slices = np.zeros(len(rows), dtype=np.int64)
+    for key, uniques in zip(keys, names):
+        slices = slices * len(uniques) + key
+    slices, numbers = pd.factorize(slices, sort=True)
+
+    first = np.unique(slices, return_index=True)[1]
+    table = pd.DataFrame(dict((column, np.array(uniques)[key[first]]) for
+                              column, key, uniques in
+                              zip(CURVE_COLUMNS, keys, names)),
+                         columns=CURVE_COLUMNS[:-1])
+
+    # Nodes are only compared with each other, their codes sort as they do
+    data = pd.DataFrame(dict((x, np.asarray(fan[x])[rows]) for x in
+                             CONTOUR_COLUMNS[1:] if x in fan.columns))
+    data["Node"] = pd.factorize(np.asarray(fan["Node"]), sort=True)[0][rows]
+    prices = data["Reserve Price"].values.astype(float)
+    if price_increments is None:
+        thresholds = np.unique(prices)
+        wanted = np.zeros((len(numbers), len(thresholds)), dtype=bool)
+        wanted[slices, np.searchsorted(thresholds, prices)] = True
+    else:
+        thresholds = np.unique(np.asarray(price_increments, dtype=float))
+        wanted = np.ones((len(numbers), len(thresholds)), dtype=bool)
+
+    deltas = reserve_contour_deltas(data, thresholds, slices=slices)
+    numbers, levels, offsets, energy_price, energy, reserve = deltas.curves(
+        wanted, compact=compact)
+
+    curves = table.iloc[numbers].reset_index(drop=True)
+    curves["Reserve Price"] = thresholds[levels]
+
+    return AggregateCurves(curves, offsets, energy_price, energy, reserve)
+
+
+class AggregateCurves(object):
+    """ Many energy and reserve tradeoff curves held as flat arrays.
+
+    The points of curve i are energy_price[offsets[i]:offsets[i + 1]] etc,
+    curve i is described by row i of the curves table.
+
+    Parameters:
+    -----------
+    curves: DataFrame of CURVE_COLUMNS, one row per curve
+    offsets: Array of the start of each curve, one longer than curves
+    energy_price: The energy price of each point
+    energy: The cumulative energy of each point
+    reserve: The cumulative reserve of each point
+
+    Usage:
+    ------
+    >>> curves = aggregate_fans(fan)
+    >>> curves.select(Island_Name="NZ", Reserve_Type="FIR")
+    >>> energy_price, energy, reserve = curves.curve(0)
+
+    """
+
+    def __init__(self, curves, offsets, energy_price, energy, reserve):
+        self.curves = curves.reset_index(drop=True)
+        self.offsets = offsets
+        self.energy_price = energy_price
+        self.energy = energy
+        self.reserve = reserve
+
+    def __len__(self):
+        return len(self.curves)
+
+    def curve(self, i):
+        """ The (energy price, energy, reserve) arrays of curve i, these are
+        views onto the flat arrays.
+        """
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return (self.energy_price[start:stop], self.energy[start:stop],
+                self.reserve[start:stop])
+
+    def select(self, **filters):
+        """ The rows of the curves table matching the filters, e.g.
+        Island_Name="NI", the index of each row is its curve number. Trading
+        dates may be given in any form date_name accepts.
+        """
+        if "Trading_Date" in filters:
+            filters["Trading_Date"] = [date_name(x) for x in
+                                       _as_list(filters["Trading_Date"])]
+        return select_rows(self.curves, filters)
+
+    def contours(self, date, period, reserve_type, island):
+        """ The reserve contours of a single trading period, reserve type
+        and island in the same form as reserve_contours, e.g. "20131212" or
+        "12/12/2013" and 1.
+        """
+        rows = self.select(Trading_Date=date, Trading_Period=period,
+                           Reserve_Type=reserve_type, Island_Name=island)
+        return {price: self.curve(i) for i, price in
+                zip(rows.index, rows["Reserve Price"].values)}
+
+    def save(self, fName):
+        """ Save the curves to a compressed numpy .npz file """
+        columns = {"column_%s" % i: self.curves[column].values.astype(str)
+                   for i, column in enumerate(CURVE_COLUMNS)}
+        np.savez_compressed(fName, offsets=self.offsets,
+                            energy_price=self.energy_price,
+                            energy=self.energy, reserve=self.reserve,
+                            **columns)
+
+    @classmethod
+    def load(cls, fName):
+        """ Load curves saved with AggregateCurves.save """
+        data = np.load(fName)
+        curves = pd.DataFrame({column: data["column_%s" % i] for i, column
+                               in enumerate(CURVE_COLUMNS)},
+                              columns=CURVE_COLUMNS)
+        curves["Trading_Period"] = curves["Trading_Period"].astype(int)
+        curves["Reserve Price"] = curves["Reserve Price"].astype(float)
+        return cls(curves, data["offsets"], data["energy_price"],
+                   data["energy"], data["reserve"])
+
+
+def breakpoints(energy_price, energy, reserve, offsets=None):
+    """ Boolean mask of the points of a curve which must be kept to draw it.
+    A point is dropped when it repeats the point before it, or when the
+    segments either side of it have the same energy price and direction so
+    the curve is a straight line through it. The first and last points are
+    always kept.
+
+    Parameters:
+    -----------
+    energy_price: The energy price of each point
+    energy: The cumulative energy of each point
+    reserve: The cumulative reserve of each point
+    offsets: Optional, many curves held end to end, the points of curve i
+             are offsets[i]:offsets[i + 1], see AggregateCurves
+
+    Returns:
+    --------
+    keep: Boolean array
+
+    """
+    keep = np.ones(len(energy), dtype=bool)
+    if len(energy) == 0:
+        return keep
+
+    if offsets is None:
+        offsets = [0, len(energy)]
+    offsets = np.asarray(offsets)
+    filled = np.diff(offsets) > 0
+    ends = np.zeros(len(energy), dtype=bool)
+    ends[offsets[:-1][filled]] = True
+    ends[offsets[1:][filled] - 1] = True
+
+    # Repeated points draw nothing, the remaining points are then checked
+    # against their distinct neighbours
+    keep[1:] = (np.diff(energy) != 0) | (np.diff(reserve) != 0)
+    keep |= ends
+    points = np.flatnonzero(keep)
+    if len(points) < 3:
+        return keep
+
+    denergy = np.diff(energy[points])
+    dreserve = np.diff(reserve[points])
+    prices = energy_price[points]
+
+    # Segment i joins point i to point i + 1, point i + 1 sits between
+    # segments i and i + 1. The ends of each curve are kept, so the other
+    # points lie between two segments of the same curve.
+    length = np.hypot(denergy, dreserve)
+    cross = denergy[:-1] * dreserve[1:] - dreserve[:-1] * denergy[1:]
+    same_direction = denergy[:-1] * denergy[1:] + dreserve[:-1] * dreserve[1:]
+    collinear = ((np.abs(cross) <= 1e-9 * length[:-1] * length[1:]) &
+                 (same_direction > 0))
+    same_price = prices[1:-1] == prices[2:]
+
+    keep[points[1:-1]] = ends[points[1:-1]] | ~(collinear & same_price)
+    return keep
+
+
+def _concatenate(arrays):
+    if not arrays:
+        return np.zeros(0)
+    return np.concatenate(arrays).astype(np.float64)
+
+
+def _ranges(starts, lengths):
+    """ The concatenated ranges starts[i]:starts[i] + lengths[i] """
+    lengths = np.asarray(lengths)
+    return (np.repeat(np.asarray(starts) - np.cumsum(lengths) + lengths,
+                      lengths) + np.arange(lengths.sum()))
+
+
+def reserve_contours(data, price_increments=None, il_data=None):
+    """ Sweeps through either all of the reserve prices or a subset there
+    of for custom views to generate the ascending reserve price contours.
+    Each contour joins the (Node, Cumulative Energy Quantity) increments
+    offered at or below that reserve price, ascending in energy price and
+    then descending in reserve per MW of energy.
+
+    The contours are built from the changes between them, see
+    reserve_contour_deltas.
+
+    Interruptible load does not depend upon the energy dispatched, the IL
+    offered at or below each reserve price is added to the whole contour.
+
+    Parameters
+    ----------
+    data: The fan data
+    price_increments: Optional, array of floats representing prices of
+                       interest, use to specify fewer contours.
+    il_data: Optional, dictionary of IL prices to the cumulative IL
+             available, in addition to the IL offers in the data.
+
+    Returns:
+    --------
+    reserve_accumulations: Dictionary of reserve_price: x, y pairs for plots.
+
+    """
+    if not price_increments:
+        price_increments = data["Reserve Price"].unique()
+        if il_data:
+            price_increments = np.union1d(price_increments, il_data.keys())
+
+    deltas = reserve_contour_deltas(data, price_increments, il_data=il_data)
+    contours = list(deltas.contours())
+
+    reserve_accumulations = {}
+    for rp in price_increments:
+        reserve_accumulations[rp] = contours[np.searchsorted(
+            deltas.thresholds, float(rp))]
+
+    return reserve_accumulations
+
+
+def reserve_contour_deltas(data, price_increments, il_data=None,
+                           slices=None):
+    """ The changes from each reserve price contour to the next.
+
+    The increments of a contour are held in blocks of equal energy price.
+    Raising the reserve price only adds reserve to the increments offering
+    it at that price, so only the blocks holding those increments change.
+    The sweep keeps a single running total of the reserve of every
+    increment and the ranking of each block between reserve prices, merging
+    the increments gaining reserve back into their blocks. Only the changed
+    blocks are emitted for each contour rather than every contour in full.
+
+    Parameters:
+    -----------
+    data: The fan data
+    price_increments: Array of the reserve prices to build contours at
+    il_data: Optional, dictionary of IL prices to the cumulative IL
+             available, in addition to the IL offers in the data.
+    slices: Optional, array numbering the slice, e.g. the trading period,
+            reserve type and island, of each row from 0. Every slice has
+            its own contours, all of them are swept together.
+
+    Returns:
+    --------
+    ContourDeltas: The changes to each contour, see ContourDeltas.contours
+                   for the contours themselves
+
+    """
+    if slices is None:
+        slices = np.zeros(len(data), dtype=np.int64)
+    slices = np.asarray(slices, dtype=np.int64)
+    count = slices.max() + 1 if len(slices) else 1
+    thresholds = np.unique(np.asarray(price_increments, dtype=float))
+
+    # The cumulative IL offered at or below each contour of each slice
+    il = (np.asarray(data["Product_Type"]) == "IL" if "Product_Type" in
+          data.columns else np.zeros(len(data), dtype=bool))
+    il_levels = np.searchsorted(thresholds, data["Reserve Price"].values[
+                                il].astype(float))
+    il_totals = np.bincount(slices[il] * (len(thresholds) + 1) + il_levels,
+                            data["Incremental Reserve Quantity"].values[il],
+                            minlength=count * (len(thresholds) + 1))
+    il_totals = il_totals.reshape(count, -1)[:, :-1].cumsum(axis=1)
+    if il_data:
+        il_prices, il_stacked = il_stack(data.iloc[:0], il_data)
+        il_totals += np.concatenate(([0.], il_stacked))[
+                        np.searchsorted(il_prices, thresholds, side="right")]
+
+    data, slices = data[~il], slices[~il]
+
+    # Number the increments in (slice, Node, Cumulative Energy Quantity)
+    # order
+    groups = slices.copy()
+    for key in (np.asarray(data["Node"]),
+                data["Cumulative Energy Quantity"].values):
+        codes, uniques = pd.factorize(key, sort=True)
+        groups = groups * len(uniques) + codes
+    groups, keys = pd.factorize(groups, sort=True)
+    increments = len(keys)
+
+    # The energy of an increment is the same on each of its rows, the
+    # rows of each increment are rows_by_group[first[g]:first[g + 1]]
+    rows_by_group = np.argsort(groups, kind="mergesort")
+    first = np.searchsorted(groups[rows_by_group], np.arange(increments))
+    energy = data["Incremental Energy Quantity"].values[rows_by_group][first]
+    prices = np.maximum.reduceat(
+        data["Energy Price"].values[rows_by_group], first) if increments \
+        else np.zeros(0)
+
+    # The reserve each increment gains at each contour, summed once, the
+    # changes at contour i are changes[starts[i]:starts[i + 1]]
+    levels = np.searchsorted(thresholds,
+                             data["Reserve Price"].values.astype(float))
+    changes, change_index = np.unique(levels * increments + groups,
+                                      return_inverse=True)
+    gained = np.bincount(change_index,
+                         data["Incremental Reserve Quantity"].values)
+    starts = np.searchsorted(changes // max(increments, 1),
+                             np.arange(len(thresholds) + 1))
+    changes = changes % max(increments, 1)
+
+    # The blocks of equal energy price of each slice, complex numbers sort
+    # by their real and then imaginary parts. The increments of block b are
+    # members[bounds[b]:bounds[b + 1]]
+    blocks, block = np.unique(slices[rows_by_group][first] + 1j * prices,
+                              return_inverse=True)
+    members = np.argsort(block, kind="mergesort")
+    bounds = np.searchsorted(block[members], np.arange(len(blocks) + 1))
+
+    # Each block ranked by descending reserve per MW, ties in increment
+    # order, increments yet to be offered have none and rank last
+    ranked = members.copy()
+    running = np.zeros(increments)
+    present = np.zeros(increments, dtype=bool)
+    moved = np.zeros(increments, dtype=bool)
+    deltas = []
+    for i in xrange(len(thresholds)):
+        touched = changes[starts[i]:starts[i + 1]]
+        running[touched] += gained[starts[i]:starts[i + 1]]
+        present[touched] = True
+
+        # The changed blocks as they were ranked, less the touched
+        # increments which have moved up within them
+        changed = np.unique(block[touched])
+        slots = _ranges(bounds[changed], bounds[changed + 1] - bounds[changed])
+        moved[touched] = True
+        kept = ranked[slots]
+        kept = kept[~moved[kept]]
+        moved[touched] = False
+
+        # Merge the touched increments back in
+        kept_keys = block[kept] - 1j * _slopes(running, energy, kept)
+        touched_keys = block[touched] - 1j * _slopes(running, energy,
+                                                     touched)
+        order = np.argsort(touched_keys, kind="mergesort")
+        touched, touched_keys = touched[order], touched_keys[order]
+        position = np.searchsorted(kept_keys, touched_keys)
+        ties = position != np.searchsorted(kept_keys, touched_keys, "right")
+        if ties.any():
+            # Equal reserve per MW within a block, keep increment order
+            runs = np.cumsum(np.concatenate(([0], kept_keys[1:] !=
+                                             kept_keys[:-1])))
+            position[ties] = np.searchsorted(
+                runs * increments + kept, runs[position[ties]] * increments +
+                touched[ties])
+        ranked[slots] = np.insert(kept, position, touched)
+
+        candidates = ranked[slots]
+        candidates = candidates[present[candidates]]
+        deltas.append(_block_lines(candidates, block[candidates], changed,
+                                   energy, running))
+
+    return ContourDeltas(thresholds, blocks.imag, blocks.real.astype(int),
+                         bounds, deltas, il_totals)
+
+
+def _slopes(running, energy, increments):
+    """ The reserve per MW of energy of the increments """
+    quantity = energy[increments]
+    return np.where(quantity > 0, running[increments] /
+                    np.where(quantity > 0, quantity, 1), 0)
+
+
+def _block_lines(increments, blocks, changed, energy, reserve):
+    """ The cumulative energy and reserve along each changed block, starting
+    from zero at the start of each block.
+
+    Returns:
+    --------
+    changed: The changed blocks
+    offsets: The points of block changed[j] are offsets[j]:offsets[j + 1]
+    energy_line: The cumulative energy within each block
+    reserve_line: The cumulative reserve within each block
+
+    """
+    offsets = np.searchsorted(blocks, np.concatenate((changed,
+                                                      [np.inf])))
+    offsets[-1] = len(blocks)
+
+    energy_line = np.cumsum(energy[increments])
+    reserve_line = np.cumsum(reserve[increments])
+    first = offsets[:-1]
+    lengths = np.diff(offsets)
+    for line in (energy_line, reserve_line):
+        before = np.concatenate(([0.], line))[first]
+        line -= np.repeat(before, lengths)
+
+    return changed, offsets, energy_line, reserve_line
+
+
+class ContourDeltas(object):
+    """ The reserve price contours of one or more fan slices held as the
+    blocks of equal energy price which change from one contour to the next,
+    see reserve_contour_deltas.
+
+    Parameters:
+    -----------
+    thresholds: Sorted array of the reserve price of each contour
+    block_prices: The energy price of each block
+    block_slices: The slice of each block, the blocks are sorted by slice
+                  and then energy price
+    bounds: Block b holds at most bounds[b + 1] - bounds[b] points
+    deltas: List of (changed blocks, offsets, energy line, reserve line)
+            for each contour, see _block_lines
+    il_totals: Array of the IL added to each contour of each slice
+
+    """
+
+    def __init__(self, thresholds, block_prices, block_slices, bounds,
+                 deltas, il_totals):
+        self.thresholds = thresholds
+        self.block_prices = block_prices
+        self.block_slices = block_slices
+        self.bounds = bounds
+        self.deltas = deltas
+        self.il_totals = il_totals
+
+    def __len__(self):
+        return len(self.thresholds)
+
+    def contours(self, number=0):
+        """ The (energy price, energy, reserve) arrays of each contour of a
+        slice in ascending order of reserve price.
+        """
+        wanted = np.zeros(self.il_totals.shape, dtype=bool)
+        wanted[number] = True
+        offsets, energy_price, energy, reserve = self.curves(wanted)[2:]
+        return [(energy_price[start:stop], energy[start:stop],
+                 reserve[start:stop]) for start, stop in zip(offsets[:-1],
+                                                             offsets[1:])]
+
+    def curves(self, wanted, compact=False):
+        """ The contours of many slices at once, applying the changes of each
+        contour to the one before it.
+
+        Parameters:
+        -----------
+        wanted: Boolean array of the contours to build, of shape (slices,
+                thresholds)
+        compact: Optional, only keep the breakpoints of each contour, see
+                 breakpoints
+
+        Returns:
+        --------
+        slices, levels: The slice and threshold of each contour, in order
+        offsets: The points of contour i are offsets[i]:offsets[i + 1]
+        energy_price, energy, reserve: The points of every contour
+
+        """
+        # The lines of block b are kept from bounds[b] onwards
+        slice_blocks = np.searchsorted(self.block_slices,
+                                       np.arange(len(wanted) + 1))
+        energy_lines = np.zeros(self.bounds[-1])
+        reserve_lines = np.zeros(self.bounds[-1])
+        sizes = np.zeros(len(self.block_prices), dtype=int)
+        energy_totals = np.zeros(len(self.block_prices))
+        reserve_totals = np.zeros(len(self.block_prices))
+
+        numbers, levels, lengths, points = [], [], [], []
+        for level, (changed, offsets, energy_line, reserve_line) in enumerate(
+                self.deltas):
+            slots = _ranges(self.bounds[changed], np.diff(offsets))
+            energy_lines[slots] = energy_line
+            reserve_lines[slots] = reserve_line
+            sizes[changed] = np.diff(offsets)
+            energy_totals[changed] = energy_line[offsets[1:] - 1]
+            reserve_totals[changed] = reserve_line[offsets[1:] - 1]
+
+            slices = np.flatnonzero(wanted[:, level])
+            if len(slices) == 0:
+                continue
+
+            # Each block starts from the totals of the blocks before it in
+            # its slice
+            counts = slice_blocks[slices + 1] - slice_blocks[slices]
+            blocks = _ranges(slice_blocks[slices], counts)
+            within = np.repeat(np.arange(len(slices)), counts)
+            starts = []
+            for totals in (energy_totals, reserve_totals):
+                before = np.cumsum(totals[blocks]) - totals[blocks]
+                first = np.concatenate(([0], np.cumsum(counts)))[:-1]
+                starts.append(before - np.repeat(
+                    np.concatenate((before, [0.]))[first], counts))
+
+            slots = _ranges(self.bounds[blocks], sizes[blocks])
+            slot_blocks = np.repeat(np.arange(len(blocks)), sizes[blocks])
+            line = (self.block_prices[blocks][slot_blocks],
+                    energy_lines[slots] + starts[0][slot_blocks],
+                    reserve_lines[slots] + starts[1][slot_blocks] +
+                    self.il_totals[slices, level][within][slot_blocks])
+            contour = within[slot_blocks]
+            if compact:
+                keep = breakpoints(*line, offsets=np.searchsorted(
+                    contour, np.arange(len(slices) + 1)))
+                line = [x[keep] for x in line]
+                contour = contour[keep]
+
+            numbers.append(slices)
+            levels.append(np.repeat(level, len(slices)))
+            lengths.append(np.bincount(contour, minlength=len(slices)))
+            points.append(line)
+
+        if not numbers:
+            empty = np.zeros(0)
+            return (np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                    np.zeros(1, dtype=int), empty, empty, empty)
+
+        # Produced contour by contour, returned slice by slice
+        numbers = np.concatenate(numbers)
+        levels = np.concatenate(levels)
+        lengths = np.concatenate(lengths)
+        order = np.lexsort((levels, numbers))
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        take = _ranges(offsets[:-1][order], lengths[order])
+
+        return (numbers[order], levels[order],
+                np.concatenate(([0], np.cumsum(lengths[order]))),
+                _concatenate([x[0] for x in points])[take],
+                _concatenate([x[1] for x in points])[take],
+                _concatenate([x[2] for x in points])[take])
+
+
+def il_stack(data, il_data=None):
+    """ The cumulative interruptible load stack of the IL offers in the fan
+    data combined with an optional dictionary of prices to cumulative IL.
+
+    Returns:
+    --------
+    prices: Sorted array of the IL prices
+    cumulative: The IL available at or below each price
+
+    """
+    prices, increments = [np.zeros(0)], [np.zeros(0)]
+
+    if "Product_Type" in data.columns:
+        il = data[np.asarray(data["Product_Type"]) == "IL"]
+        prices.append(il["Reserve Price"].values.astype(float))
+        increments.append(il["Incremental Reserve Quantity"].values)
+
+    if il_data:
+        keys = np.sort(np.array(il_data.keys(), dtype=float))
+        cumulative = np.array([il_data[k] for k in keys], dtype=float)
+        prices.append(keys)
+        increments.append(np.diff(np.concatenate(([0.], cumulative))))
+
+    prices = np.concatenate(prices)
+    increments = np.concatenate(increments)
+    order = np.argsort(prices, kind="mergesort")
+    prices, cumulative = prices[order], increments[order].cumsum()
+
+    # Keep the total at the last offer of each price
+    last = np.concatenate((prices[1:] != prices[:-1], [True]))[:len(prices)]
+    return prices[last], cumulative[last]
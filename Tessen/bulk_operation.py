@@ -11,6 +11,9 @@ from dateutil.parser import parse
 import itertools
 import calendar
 import datetime
+import multiprocessing
+from cStringIO import StringIO
+import simplejson as json
 
 # C Library
 import pandas as pd
@@ -23,6 +26,8 @@ from OfferPandas import Frame, load_offerframe
 # Tessen extenions
 import generate
 import visualise
+import store
+from fan_index import FanIndex
 
 
 # This is hacky......
@@ -31,14 +36,32 @@ energy_headers = ["Company","Grid_Injection_Point","Station","Unit","Trading_Dat
 reserve_headers = ["Company","Grid_Point","Trading_Date","Trading_Period","Station","Unit","Band1_PLSR_6s_price","Band1_PLSR_6s_max","Band1_PLSR_6s_percent","Band1_PLSR_60s_price","Band1_PLSR_60s_max","Band1_PLSR_60s_percent","Band1_TWDSR_6s_price","Band1_TWDSR_6s_max","Band1_TWDSR_60s_price","Band1_TWDSR_60s_max","  Band2_PLSR_6s_price","Band2_PLSR_6s_max","Band2_PLSR_6s_percent","Band2_PLSR_60s_price","Band2_PLSR_60s_max","Band2_PLSR_60s_percent","Band2_TWDSR_6s_price","Band2_TWDSR_6s_max","Band2_TWDSR_60s_price","Band2_TWDSR_60s_max","Band3_PLSR_6s_price","Band3_PLSR_6s_max","Band3_PLSR_6s_percent","Band3_PLSR_60s_price","Band3_PLSR_60s_max","Band3_PLSR_60s_percent","Band3_TWDSR_6s_price","Band3_TWDSR_6s_max","Band3_TWDSR_60s_price","Band3_TWDSR_60s_max","Created_Date","Last_Amended_Date"
 ]
 
+il_headers = ["Company","Grid_Exit_Point","Trading_Date","Trading_Period","int_load_6s","int_load_60s","Band1_6s_price","Band1_6s_max","Band1_60s_price","Band1_60s_max","Band2_6s_price","Band2_6s_max","Band2_60s_price","Band2_60s_max","Band3_6s_price","Band3_6s_max","Band3_60s_price","Band3_60s_max","Created_Date","Last_Amended_Date"]
+
 def bulk_run(dates, save_location, temporary_location, energy_data,
-             plsr_data, reserve_mode="FIR", *args, **kargs):
+             plsr_data, reserve_mode="FIR", fan_store=None,
+             file_format="parquet", workers=1, index_offers=False,
+             incremental=False, il_data=None, *args, **kargs):
     """ Iterate through date_periods creating an Offer Fan for each one
     which will be saved in the save_location. Will also generate the fan
     curve data for each of the instances to be saved in the temporary_location.
+    Each island is plotted separately, e.g. fancurve2013121201NI.png.
 
     Parameters:
     -----------
+    fan_store: Optional, directory to write a binary fan store to instead of
+               the temporary csv file, each plot then only reads its own
+               trading period back from the store.
+    file_format: Optional, the format of the fan store, parquet or feather
+    workers: Optional, the number of processes used to generate the fans
+             and to render the plots, defaults to 1.
+    index_offers: Optional, keep a byte offset index of the dates in each
+                  offer file alongside it, see build_offer_index, so later
+                  runs only read the requested days.
+    incremental: Optional, with a fan_store only regenerate the fans of the
+                 stations whose offers have changed since the last run.
+    il_data: Optional, directory of the interruptible load offer files, e.g.
+             ilreserves20131212.csv, to add to the fans.
 
     Returns:
     --------
@@ -55,40 +78,298 @@ def bulk_run(dates, save_location, temporary_location, energy_data,
     unique_energy = set([energy_maps[x] for x in unique_dates])
     unique_reserve = set([plsr_maps[x] for x in unique_dates])
 
-    eframe = Frame(pd.concat((pd.read_csv(x, names=energy_headers) for x in unique_energy), ignore_index=True))
-    rframe = Frame(pd.concat((pd.read_csv(x, names=reserve_headers) for x in unique_reserve), ignore_index=True))
+    # Only the requested days are kept from (monthly) files
+    eframe = load_offers(unique_energy, energy_headers, dates=dates,
+                         index=index_offers)
+    rframe = load_offers(unique_reserve, reserve_headers, dates=dates,
+                         index=index_offers)
 
+    edates = eframe.efilter(Trading_Date=dates)
+    rdates = rframe.efilter(Trading_Date=dates)
 
-    # Do some rough hacky filtering
-    eframe = Frame(eframe[eframe["Company"] != "COMPANY"])
-    rframe = Frame(rframe[rframe["Company"] != "COMPANY"])
+    idates = None
+    if il_data:
+        il_maps = build_file_maps(il_data, "ilreserves")
+        unique_il = set([il_maps[x] for x in unique_dates if x in il_maps])
+        iframe = load_offers(unique_il, il_headers, dates=dates,
+                             index=index_offers)
+        idates = iframe.efilter(Trading_Date=dates)
+
+    if fan_store:
+        generate.create_fan(edates, rdates, fName=fan_store,
+                            return_fan=False, file_format=file_format,
+                            workers=workers, incremental=incremental,
+                            il=idates, *args, **kargs)
+    else:
+        fan = generate.create_fan(edates, rdates, fName=temporary_location,
+                                  workers=workers, il=idates, *args, **kargs)
 
-    # Drop to a csv file then reload. Fucking Hacky but I'm feeling lazy
-    # This gets around the header and object type problems I've been having
-    eframe.to_csv(temporary_location, header=True)
-    eframe = load_offerframe(temporary_location)
+        # Index the fan once, each plot is then only handed its own slice
+        # rather than filtering the whole fan again.
+        index = FanIndex(fan)
 
-    rframe.to_csv(temporary_location, header=True)
-    rframe = load_offerframe(temporary_location)
+    jobs = []
+    for date in dates:
+        # Allow for the 46 and 50 period days at daylight savings
+        for period in xrange(1, 51):
+            filters = {"Trading_Date": date, "Trading_Period": period,
+                       "Reserve_Type": reserve_mode}
+
+            if fan_store:
+                if not store.partition_files(fan_store, dates=date,
+                                             periods=period):
+                    continue
+                islands = store.read_fan_store(fan_store, filters, columns=[
+                    "Reserve_Type", "Island_Name"])["Island_Name"]
+            else:
+                islands = index.select(filters)["Island_Name"]
+
+            # A fan is plotted for a single island
+            for island in sorted(set(islands.astype(str))):
+                island_filters = dict(filters, Island_Name=island)
+                fName = os.path.join(save_location, "fancurve%s%02d%s.png" % (
+                                     store.date_name(date), int(period),
+                                     island))
+                if fan_store:
+                    data = fan_store
+                else:
+                    data = index.select(island_filters)
+
+                jobs.append((data, island_filters, fName))
+
+    render_fans(jobs, workers=workers)
+
+
+def render_fans(jobs, workers=1):
+    """ Render and save a number of fan curves, optionally spread across a
+    pool of processes. Every figure is closed once it has been saved so
+    memory does not grow with the number of plots.
 
-    #print eframe.dtypes, rframe.dtypes
-    #print unique_dates, dates
+    Parameters:
+    -----------
+    jobs: List of (data, filters, fName) tuples to pass to plot_fan, the data
+          should already be sliced down to the period being plotted (or be
+          the location of a fan store).
+    workers: Optional, the number of processes to render with. Figures are
+             always rendered with the non interactive Agg backend, in
+             process the backend in use is restored afterwards.
 
-    edates = eframe.efilter(Trading_Date=dates)
-    rdates = rframe.efilter(Trading_Date=dates)
+    Returns:
+    --------
+    files: List of the saved figures
 
-    #print edates, rdates
+    """
+    if workers <= 1:
+        import matplotlib.pyplot as plt
+        backend = plt.get_backend()
+        _render_initializer()
+        try:
+            return [_render_fan(job) for job in jobs]
+        finally:
+            if backend.lower() != "agg":
+                plt.switch_backend(backend)
+
+    pool = multiprocessing.Pool(workers, initializer=_render_initializer)
+    try:
+        return pool.map(_render_fan, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _render_initializer():
+    """ Render pool workers never display a figure, use the Agg backend.
+    """
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
 
-    fan = generate.create_fan(edates, rdates, fName=temporary_location, *args, **kargs)
 
-    for date in dates:
-        for period in xrange(1,49):
-            fName = os.path.join(save_location, "fancurve%s%02d.png" % (parse(date,dayfirst=True).strftime("%Y%m%d"), int(period)))
-            filters = {"Trading_Date": date, "Trading_Period": period, "Reserve_Type": reserve_mode}
-            visualise.plot_fan(fan, filters=filters, fName=fName)
+def _render_fan(job):
+    """ Pool entry point, plots a single fan and releases the figure.
+    """
+    import matplotlib.pyplot as plt
+
+    data, filters, fName = job
+    # Each period is only plotted once, there is nothing to gain by caching
+    fig, axes = visualise.plot_fan(data, filters=filters, fName=fName,
+                                   cache=None)
+    plt.close(fig)
+    return fName
+
+
+def load_offers(files, headers, dates=None, index=False):
+    """ Load raw offer files into a single OfferFrame.
+
+    The files are streamed into an in memory buffer with a single header
+    row, any header rows within the files are dropped as they are read. The
+    buffer is then parsed once by load_offerframe, no intermediate file is
+    written to disk.
+
+    Parameters:
+    -----------
+    files: Iterable of the raw csv files to load
+    headers: The column names of the files, e.g. energy_headers
+    dates: Optional, only keep the offers of these trading dates, the rest
+           of each file is skipped line by line as it is read.
+    index: Optional, use (building it if necessary) a sidecar index of the
+           byte offsets of each date in the files, see build_offer_index,
+           so only the requested dates are read.
+
+    Returns:
+    --------
+    OfferFrame: The offers contained in all of the files
+
+    """
+    if dates is not None:
+        dates = set(store.date_name(d) for d in store._as_list(dates))
+
+    column = headers.index("Trading_Date")
+
+    buffer = StringIO()
+    buffer.write(",".join(headers) + "\n")
+    for fName in sorted(files):
+        for line in offer_lines(fName, column, dates=dates, index=index):
+            buffer.write(line)
+
+    # Parsed once, by OfferPandas, which reshapes the band columns of the
+    # raw files into offers and sets their dtypes as it does so. It takes
+    # no dtypes of its own, parsing the buffer here to pass them would
+    # mean parsing every offer twice.
+    buffer.seek(0)
+    return load_offerframe(buffer)
+
+
+def offer_lines(fName, column, dates=None, index=False):
+    """ Yield the data rows of a raw offer file, optionally only those of
+    particular trading dates.
+
+    Parameters:
+    -----------
+    fName: The raw csv file
+    column: The position of the Trading_Date in each row
+    dates: Optional, set of trading dates to keep, named as in the fan store
+           e.g. 20131212
+    index: Optional, seek to the dates using the sidecar index instead of
+           reading the whole file
+
+    Returns:
+    --------
+    generator: The lines of the file which were kept
+
+    """
+    if dates is None:
+        with open(fName, "rb") as f:
+            for line in _offer_lines(f):
+                yield line
+        return
+
+    if index:
+        offsets = build_offer_index(fName, column)
+        with open(fName, "rb") as f:
+            for date in sorted(dates):
+                for start, stop in offsets.get(date, []):
+                    f.seek(start)
+                    lines = f.read(stop - start).splitlines(True)
+                    for line in _offer_lines(lines):
+                        yield line
+        return
+
+    names = {}
+    with open(fName, "rb") as f:
+        for line in _offer_lines(f):
+            if _line_date(line, column, names) in dates:
+                yield line
+
+
+def build_offer_index(fName, column):
+    """ The byte ranges of each trading date within a raw offer file. The
+    index is kept next to the file, e.g. offers201312.csv.index.json, and is
+    rebuilt whenever the size or modification time of the file changes.
+
+    Parameters:
+    -----------
+    fName: The raw csv file
+    column: The position of the Trading_Date in each row
+
+    Returns:
+    --------
+    offsets: Dictionary of trading date, e.g. 20131212, to a list of
+             [start, stop) byte ranges holding its rows
+
+    """
+    status = os.stat(fName)
+    index_name = fName + ".index.json"
+
+    if os.path.exists(index_name):
+        try:
+            with open(index_name) as f:
+                existing = json.load(f)
+            if (existing["size"] == status.st_size and
+                    existing["mtime"] == status.st_mtime):
+                return existing["dates"]
+        except (IOError, ValueError, KeyError):
+            pass
+
+    offsets = {}
+    names = {}
+    position = 0
+    with open(fName, "rb") as f:
+        for line in f:
+            start, position = position, position + len(line)
+            date = _line_date(line, column, names)
+            if date is None:
+                continue
+
+            ranges = offsets.setdefault(date, [])
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = position
+            else:
+                ranges.append([start, position])
+
+    try:
+        with open(index_name, "w") as f:
+            json.dump({"size": status.st_size, "mtime": status.st_mtime,
+                       "dates": offsets}, f)
+    except IOError:
+        # A read only data directory only loses the cached index
+        pass
+
+    return offsets
+
+
+def _line_date(line, column, names):
+    """ The trading date of a raw offer row named as in the fan store, or
+    None for header and blank rows. Parsed dates are cached in names.
+    """
+    fields = line.split(",", column + 1)
+    if len(fields) <= column:
+        return None
+
+    field = fields[column].strip()
+    if field not in names:
+        try:
+            names[field] = store.date_name(field)
+        except (ValueError, OverflowError):
+            names[field] = None
+    return names[field]
+
+
+def _offer_lines(lines):
+    """ Yield the data rows of a raw offer file, skipping blank lines and
+    header rows. Every row is terminated by a newline so files may be
+    joined together.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
 
+        if line.split(",", 1)[0].strip().upper() == "COMPANY":
+            continue
 
+        if not line.endswith("\n"):
+            line += "\n"
 
+        yield line
 
 
 def build_file_maps(file_location, pattern):
@@ -97,7 +378,8 @@ def build_file_maps(file_location, pattern):
     # Maps a single day to the file which holds it.
     mapping = {}
     for f in all_files:
-        for d in parse_daily_dates(f, pattern, '.csv'):
+        # Files which aren't named by date, e.g. ilreserves, are ignored
+        for d in parse_daily_dates(f, pattern, '.csv') or []:
             mapping[d] = f
 
     return mapping
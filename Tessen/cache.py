@@ -0,0 +1,139 @@
+""" Memoisation of aggregated fan data.
+
+Aggregating a trading period into its reserve contours is the expensive
+part of plotting a fan, re-plotting the same period with different colours
+or limits does not need to repeat it. An AggregateCache holds the most
+recently used aggregations in memory and optionally also keeps them on disk
+so they survive between sessions.
+
+The cache is keyed by a hash of the contents of the fan slice and the
+price increments, so a changed fan never returns a stale aggregation.
+
+"""
+
+import os
+import hashlib
+import cPickle as pickle
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+
+# The fan columns used by the aggregation
+AGGREGATE_COLUMNS = ["Cumulative Energy Quantity",
+                     "Incremental Energy Quantity", "Energy Price",
+                     "Reserve Price", "Incremental Reserve Quantity"]
+
+
+class AggregateCache(object):
+    """ Least recently used cache of aggregated fan data.
+
+    Parameters:
+    -----------
+    maxsize: Optional, the number of aggregations to hold in memory
+    directory: Optional, directory to also store the aggregations in, these
+               are read back when not held in memory.
+
+    Usage:
+    ------
+    >>> cache = AggregateCache(maxsize=64, directory="fan_cache")
+    >>> plot_fan(fan, filters=filters, cache=cache)
+
+    """
+
+    def __init__(self, maxsize=32, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries or (self.directory is not None and
+                                       os.path.exists(self._path(key)))
+
+    def get(self, key, default=None):
+        """ Return the aggregation stored under key, or default """
+        if key in self.entries:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as f:
+                value = pickle.load(f)
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """ Store an aggregation under key """
+        self._remember(key, value)
+
+        if self.directory is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(self._path(key), "wb") as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+
+    def clear(self):
+        """ Empty the in memory cache, any on disk entries are kept """
+        self.entries.clear()
+
+    def _remember(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, "%s.pkl" % key)
+
+
+def aggregate_key(data, price_increments=None, il_data=None):
+    """ A content hash of the parts of a fan slice used by the aggregation,
+    together with the price increments and any additional IL stack.
+
+    Parameters:
+    -----------
+    data: DataFrame of filtered fan data
+    price_increments: Optional, the reserve prices to aggregate at
+    il_data: Optional, dictionary of IL prices to cumulative IL
+
+    Returns:
+    --------
+    key: Hexadecimal string
+
+    """
+    digest = hashlib.sha1()
+
+    codes, nodes = pd.factorize(np.asarray(data["Node"]))
+    digest.update("\x00".join(str(x) for x in nodes))
+    digest.update(np.ascontiguousarray(codes, dtype=np.int64).tostring())
+
+    # Interruptible load rows are aggregated differently to the stations
+    if "Product_Type" in data.columns:
+        digest.update((np.asarray(data["Product_Type"]) == "IL").tostring())
+
+    for column in AGGREGATE_COLUMNS:
+        digest.update(column)
+        digest.update(np.ascontiguousarray(data[column].values,
+                                           dtype=np.float64).tostring())
+
+    if price_increments is None:
+        digest.update("None")
+    else:
+        digest.update(np.asarray(price_increments, dtype=np.float64).tostring())
+
+    if il_data:
+        digest.update(repr(sorted(il_data.items())))
+
+    return digest.hexdigest()
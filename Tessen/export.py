@@ -0,0 +1,223 @@
+""" Export of aggregated fans for an interactive viewer.
+
+The reserve contours and energy shading of every trading period are written
+as precomputed JSON tiles, one per trading date, alongside a manifest
+listing the tiles, e.g.
+
+    export/manifest.json
+    export/tiles/20131212.json
+
+A browser may then read the manifest and page through the periods of as
+many days as it likes without any recomputation. Prices and quantities are
+stored as integers of the value times SCALE, each line delta encoded so the
+tiles stay small, see encode_line.
+
+The shading of a trading period is drawn under its most expensive reserve
+contour. Each segment of that contour is shaded by the energy price of the
+point closing it, as in visualise._plot_energy_shading, consecutive
+segments of the same price are stored as a single [start, stop, price] run
+of point indices.
+
+"""
+
+import os
+
+import numpy as np
+import simplejson as json
+
+from aggregate import aggregate_fans, AggregateCurves
+from fan_index import FanIndex
+
+
+MANIFEST_NAME = "manifest.json"
+TILE_DIRECTORY = "tiles"
+EXPORT_VERSION = 1
+
+# Prices and quantities are held to the nearest cent and 0.01 MW
+SCALE = 100
+
+
+def export_tiles(fan, path, price_increments=None, market=True):
+    """ Export the reserve contours and energy shading of every trading
+    period of a fan as one JSON tile per trading date. Any tiles already
+    exported to the path for the same dates are replaced and the manifest
+    is updated to list every tile.
+
+    Parameters:
+    -----------
+    fan: DataFrame of generated fan data, a FanIndex of one or the
+         AggregateCurves of one, see aggregate.aggregate_fans
+    path: Directory to export to, created if necessary
+    price_increments: Optional, the reserve prices to build contours at,
+                      defaults to every reserve price offered.
+    market: Optional, also export the market wide contours of both islands.
+
+    Returns:
+    --------
+    files: List of the tiles written
+
+    """
+    if isinstance(fan, AggregateCurves):
+        curves = fan
+    else:
+        if not isinstance(fan, FanIndex):
+            fan = FanIndex(fan)
+        curves = aggregate_fans(fan, price_increments=price_increments,
+                                market=market, compact=True)
+
+    directory = os.path.join(path, TILE_DIRECTORY)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tiles = {}
+    files = []
+    table = curves.curves
+    for date, rows in sorted(table.groupby("Trading_Date").groups.items()):
+        tile = _tile(curves, date, sorted(rows))
+        fName = os.path.join(TILE_DIRECTORY, "%s.json" % date)
+        with open(os.path.join(path, fName), "w") as f:
+            json.dump(tile, f, separators=(",", ":"))
+
+        files.append(os.path.join(path, fName))
+        tiles[str(date)] = _manifest_entry(tile, fName)
+
+    manifest = read_manifest(path)
+    manifest["tiles"].update(tiles)
+    with open(os.path.join(path, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    return files
+
+
+def read_manifest(path):
+    """ The manifest of an export, an empty one if nothing has been exported
+    to the path yet.
+    """
+    fName = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(fName):
+        return {"version": EXPORT_VERSION, "scale": SCALE, "tiles": {}}
+
+    with open(fName) as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != EXPORT_VERSION:
+        raise ValueError("%s is version %s of the export, expected %s" % (
+            fName, manifest.get("version"), EXPORT_VERSION))
+    return manifest
+
+
+def read_tile(fName):
+    """ Decode a tile back into the contours and shading of each trading
+    period.
+
+    Returns:
+    --------
+    periods: Dictionary of (Trading_Period, Reserve_Type, Island_Name) to a
+             dictionary of "contours", reserve price: (energy price, energy,
+             reserve) arrays as in aggregate.reserve_contours, and
+             "shading", a list of (start, stop, energy price) runs.
+
+    """
+    with open(fName) as f:
+        tile = json.load(f)
+
+    scale = float(tile["scale"])
+    periods = {}
+    for each in tile["periods"]:
+        contours = {}
+        for contour in each["contours"]:
+            contours[contour["price"] / scale] = tuple(
+                decode_line(contour[x], scale) for x in
+                ("energy_price", "energy", "reserve"))
+
+        shading = [(start, stop, price / scale) for start, stop, price in
+                   each["shading"]]
+        key = (each["period"], each["reserve_type"], each["island"])
+        periods[key] = {"contours": contours, "shading": shading}
+
+    return periods
+
+
+def encode_line(values, scale=SCALE):
+    """ Delta encode a line as integers of the values times the scale, the
+    first value is kept as is and each after it is the change from the one
+    before. Decoding the integers exactly avoids any drift along the line.
+    """
+    quantised = np.round(np.asarray(values, dtype=float) * scale).astype(
+        np.int64)
+    return np.diff(np.concatenate(([0], quantised))).tolist()
+
+
+def decode_line(deltas, scale=SCALE):
+    """ The values of a line delta encoded with encode_line """
+    return np.cumsum(np.asarray(deltas, dtype=np.int64)) / float(scale)
+
+
+def shading_runs(energy_price):
+    """ The runs of segments of a contour shaded by the same energy price.
+    Each segment takes the price of the point closing it.
+
+    Returns:
+    --------
+    runs: List of [start, stop, price] where the run joins the points from
+          start to stop inclusive
+    """
+    segments = np.asarray(energy_price, dtype=float)[1:]
+    if len(segments) == 0:
+        return []
+
+    starts = np.flatnonzero(np.concatenate(([True],
+                                            segments[1:] != segments[:-1])))
+    stops = np.concatenate((starts[1:], [len(segments)]))
+    return [[int(start), int(stop), price] for start, stop, price in
+            zip(starts, stops, segments[starts])]
+
+
+def _tile(curves, date, rows):
+    """ The tile of a single trading date from the rows of its curves """
+    table = curves.curves
+    groups = {}
+    for i in rows:
+        key = (int(table["Trading_Period"].iat[i]),
+               str(table["Reserve_Type"].iat[i]),
+               str(table["Island_Name"].iat[i]))
+        groups.setdefault(key, []).append(i)
+
+    periods = []
+    for (period, reserve_type, island), indices in sorted(groups.items()):
+        indices = sorted(indices, key=lambda i: table["Reserve Price"].iat[i])
+        contours = []
+        for i in indices:
+            energy_price, energy, reserve = curves.curve(i)
+            contours.append({
+                "price": _scaled(table["Reserve Price"].iat[i]),
+                "energy_price": encode_line(energy_price),
+                "energy": encode_line(energy),
+                "reserve": encode_line(reserve)})
+
+        # Shaded under the most expensive contour
+        top = curves.curve(indices[-1])[0]
+        shading = [[start, stop, _scaled(price)] for start, stop, price in
+                   shading_runs(top)]
+
+        periods.append({"period": period, "reserve_type": reserve_type,
+                        "island": island, "contours": contours,
+                        "shading": shading})
+
+    return {"version": EXPORT_VERSION, "date": str(date), "scale": SCALE,
+            "periods": periods}
+
+
+def _manifest_entry(tile, fName):
+    """ The manifest listing of a tile, enough for a viewer to page to a
+    trading period without opening every tile.
+    """
+    periods = tile["periods"]
+    return {"file": fName.replace(os.sep, "/"),
+            "periods": sorted(set(x["period"] for x in periods)),
+            "reserve_types": sorted(set(x["reserve_type"] for x in periods)),
+            "islands": sorted(set(x["island"] for x in periods))}
+
+
+def _scaled(value):
+    return int(round(float(value) * SCALE))
@@ -0,0 +1,138 @@
+""" An index over generated fan data.
+
+Plotting a single trading period from a large fan otherwise means wrapping
+and filtering the whole fan every time. A FanIndex sorts the fan once by
+trading date, trading period, reserve type and island so each combination
+is a contiguous block of rows which can be sliced out directly.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+from store import date_name, select_rows, _as_list
+
+
+INDEX_COLUMNS = ["Trading_Date", "Trading_Period", "Reserve_Type",
+                 "Island_Name"]
+
+
+class FanIndex(object):
+    """ Fan data sorted and indexed by INDEX_COLUMNS.
+
+    Parameters:
+    -----------
+    fan: DataFrame of generated fan data, see generate.create_fan
+
+    Usage:
+    ------
+    >>> index = FanIndex(fan)
+    >>> index.select({"Trading_Date": "12/12/2013", "Trading_Period": 1,
+    ...               "Reserve_Type": "FIR", "Island_Name": "NI"})
+
+    """
+
+    def __init__(self, fan):
+        groups = fan.groupby(INDEX_COLUMNS, sort=False).indices
+
+        keys = []
+        for key, locations in groups.iteritems():
+            # Categorical columns may report unobserved combinations
+            if len(locations) == 0:
+                continue
+            keys.append((_index_key(*key), locations))
+        keys.sort(key=lambda x: x[0])
+
+        self.slices = {}
+        start = 0
+        for key, locations in keys:
+            self.slices[key] = slice(start, start + len(locations))
+            start += len(locations)
+
+        if keys:
+            order = np.concatenate([locations for key, locations in keys])
+            self.fan = fan.iloc[order].reset_index(drop=True)
+        else:
+            self.fan = fan.iloc[:0]
+
+    def __len__(self):
+        return len(self.fan)
+
+    def __contains__(self, key):
+        return _index_key(*key) in self.slices
+
+    def keys(self):
+        """ The sorted (date, period, reserve type, island) combinations """
+        return sorted(self.slices.keys())
+
+    def get(self, date, period, reserve_type, island):
+        """ The fan data of a single combination, sliced straight from the
+        sorted fan without copying. An empty frame is returned if the
+        combination is not present.
+        """
+        index = self.slices.get(_index_key(date, period, reserve_type,
+                                           island))
+        if index is None:
+            return self.fan.iloc[:0]
+        return self.fan.iloc[index]
+
+    def select(self, filters=None):
+        """ Select fan data using a dictionary of filters as used by
+        plot_fan. Filters on the index columns are resolved with the index,
+        any index column without a filter matches everything and any other
+        filters are applied to the selected rows afterwards.
+
+        Parameters:
+        -----------
+        filters: Optional, dictionary of column to value (or list of values)
+
+        Returns:
+        --------
+        DataFrame: The fan data matching the filters
+
+        """
+        filters = dict(filters) if filters else {}
+        wanted = [_as_set(filters.pop(column, None), normalise) for
+                  column, normalise in zip(INDEX_COLUMNS, _NORMALISERS)]
+
+        if all(values is not None and len(values) == 1 for values in wanted):
+            data = self.get(*[list(values)[0] for values in wanted])
+        else:
+            blocks = [self.slices[key] for key in self.keys() if
+                      all(values is None or part in values for part, values
+                          in zip(key, wanted))]
+            data = _take_slices(self.fan, blocks)
+
+        return select_rows(data, filters)
+
+
+_NORMALISERS = (date_name, int, str, str)
+
+
+def _index_key(date, period, reserve_type, island):
+    return (date_name(date), int(period), str(reserve_type), str(island))
+
+
+def _as_set(value, normalise):
+    if value is None:
+        return None
+    return set(normalise(x) for x in _as_list(value))
+
+
+def _take_slices(fan, blocks):
+    """ Take a number of blocks of rows, adjacent blocks are merged so a
+    contiguous selection is still a single slice.
+    """
+    if not blocks:
+        return fan.iloc[:0]
+
+    merged = [blocks[0]]
+    for block in blocks[1:]:
+        if block.start == merged[-1].stop:
+            merged[-1] = slice(merged[-1].start, block.stop)
+        else:
+            merged.append(block)
+
+    if len(merged) == 1:
+        return fan.iloc[merged[0]]
+    return pd.concat([fan.iloc[block] for block in merged])
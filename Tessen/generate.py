@@ -4,18 +4,58 @@
 
 import pandas as pd
 import numpy as np
-from OfferPandas import Frame, load_offerframe
+
+from sinks import fan_sink
+from incremental import update_fan_store
 
 import sys
 import os
+import hashlib
 import datetime
 import time
+import multiprocessing
+from collections import deque, OrderedDict
+
+
+FAN_COLUMNS = ["Energy Price", "Energy Quantity",
+               "Incremental Energy Quantity", "Cumulative Energy Quantity",
+               "Reserve Price", "Reserve Quantity",
+               "Incremental Reserve Quantity", "Cumulative Reserve Quantity"]
+
+# The columns of the reserve offers used to build a fan, see
+# reserve_fan_arrays
+RESERVE_OFFER_COLUMNS = ["Price", "Quantity", "Percent", "Product_Type",
+                         "Reserve_Type"]
 
+# Offer columns which are not carried through to the fan as metadata
+EXCLUDED_METADATA = ("Band", "Price", "Quantity", "Product_Type",
+                     "Reserve_Type", "Is_Injection", "Is_Hvdc",
+                     "Created_Date", "Last_Amended_Date")
 
+# The columns describing the band of each fan row, see assemble_fan
+BAND_COLUMNS = ["Reserve_Type", "Product_Type", "Reserve_Percent"]
+
+# Breakpoints closer than this many MW to a row of an energy stack are not
+# added to it, see refine_stack
+REFINE_TOLERANCE = 1e-9
+
+# The number of trading periods each worker may be given ahead of the
+# consumer of iter_fans
+SHARDS_PER_WORKER = 2
+
+# Cumulative energy quantities are summed in units of 1 / QUANTITY_SCALE MW,
+# see energy_stacks
+QUANTITY_SCALE = 10 ** 9
+
+# The number of distinct station offers whose fans are remembered, see
+# station_fan_key
+FAN_MEMO_SIZE = 4096
 
 
 def create_fan(energy, reserve, fName=None, return_fan=True, break_tp=False,
-               force_plsr_only=True, verbose=False, *args, **kargs):
+               force_plsr_only=True, verbose=False, resolution=1.,
+               compact=False, workers=1, file_format="csv", stream=False,
+               incremental=False, il=None, *args, **kargs):
     """ A wrapper which implements some optional filtering arguments
     to speed up the process, otherwise iterating can take a very large time.
 
@@ -25,17 +65,39 @@ def create_fan(energy, reserve, fName=None, return_fan=True, break_tp=False,
     -----------
     energy: OfferFrame of the energy values
     reserve: OfferFrame of the reserve values
-    fName: Optional, file to save the resulting fan data to
+    il: Optional, OfferFrame of the interruptible load offers, these are
+        added to the fan with a Product_Type of "IL", see il_fan_arrays.
+    fName: Optional, file to save the resulting fan data to, or the
+           directory of the fan store for binary formats. The fans are
+           merged into an existing store by station and reserve type, see
+           store.write_fan_store.
     break_tp: Optional, if a save location is specified will break the files
-              into smaller trading period pieces
+              into smaller trading period pieces, binary stores are always
+              broken into trading date and period partitions
     return_fan: Whether to return the Pandas DataFrame containing the Fan.
     force_plsr_only: Set to True to exclude TWDSR offers
+    resolution: Optional, the size in MW of the energy increments used to
+                build the fans, see station_fan for the error bounds.
+    compact: Optional, only evaluate the fans at their breakpoints instead
+             of in 1 MW increments, see station_fan.
+    workers: Optional, the number of processes to spread the trading periods
+             across, defaults to 1 which calculates everything in process.
+    file_format: Optional, "csv" (the default), "parquet" or "feather", see
+                 store.write_fan_store for the layout of the binary stores.
+    stream: Optional, generate the fan one trading period at a time, see
+            iter_fans. Each period is saved as soon as it is complete and
+            only one period is held in memory at once.
+    incremental: Optional, only regenerate the fans of stations whose offers
+                 have changed since the last run and merge them into the
+                 fan store at fName, see incremental.update_fan_store. The
+                 regenerated fans are returned.
     *args: Filter arguments, e.g. {"Company": "MRPL"} etc (A dictionary)
     **kargs: Keyword filter arguments, e.g. Company="MRPL"
 
     Returns:
     --------
-    fan: The Fan Data as a pandas DataFrame.
+    fan: The Fan Data as a pandas DataFrame, or when streaming a generator of
+         the fan of each trading period.
     """
 
     # Set up a time reporting function:
@@ -52,6 +114,37 @@ def create_fan(energy, reserve, fName=None, return_fan=True, break_tp=False,
         dispatched\n"""
         filtered_reserve = reserve.efilter(*args, **kargs)
 
+    filtered_il = None
+    if il is not None:
+        filtered_il = il.efilter(*args, **kargs)
+
+    if incremental:
+        if not fName or file_format == "csv":
+            raise ValueError("""Incremental updates require a parquet or
+                feather fan store, please pass fName and file_format""")
+
+        fan = update_fan_store(filtered_energy, filtered_reserve, fName,
+                               il=filtered_il, file_format=file_format,
+                               resolution=resolution, compact=compact,
+                               workers=workers, verbose=verbose)
+        if return_fan:
+            return fan
+        return None
+
+    sink = None
+    if fName:
+        sink = fan_sink(fName, file_format=file_format, break_tp=break_tp)
+
+    if stream:
+        fans = _write_fans(iter_fans(filtered_energy, filtered_reserve,
+                                     resolution=resolution, compact=compact,
+                                     workers=workers, il=filtered_il), sink)
+        if return_fan:
+            return fans
+
+        for fan in fans:
+            pass
+        return None
 
     estimate_number = len(filtered_energy[["Node",
                             "Trading_Period_ID"]].drop_duplicates()) * 2
@@ -61,7 +154,9 @@ def create_fan(energy, reserve, fName=None, return_fan=True, break_tp=False,
             estimate_number, estimate_number * 0.008)
 
 
-    fan = _create_fan(filtered_energy, filtered_reserve)
+    fan = _create_fan(filtered_energy, filtered_reserve,
+                      resolution=resolution, compact=compact, workers=workers,
+                      il=filtered_il)
 
     elapsed_time = datetime.datetime.now() - begin_time
     number_fans = len(fan[["Node", "Trading_Period_ID", "Reserve_Type",
@@ -70,20 +165,16 @@ def create_fan(energy, reserve, fName=None, return_fan=True, break_tp=False,
         print "I successfully calculated %s fans in %s seconds" % (number_fans,
                  elapsed_time.seconds)
 
-    if fName:
-        if break_tp:
-            if verbose:
+    if sink:
+        if verbose:
+            if file_format != "csv":
+                print "I'll now begin saving these to a %s store" % file_format
+            elif break_tp:
                 print "I'll now begin saving these to individual trading period files"
-            for each in fan["Trading_Period_ID"].unique():
-                single = fan[fan["Trading_Period_ID"] == each]
-                new_ext = '_' + str(each) + '.csv'
-                single_name = fName.replace('.csv', new_ext)
-                single.to_csv(single_name, header=True, index=False)
-
-        else:
-            if verbose:
+            else:
                 print "I'll now begin saving these to a single file"
-            fan.to_csv(fName, header=True, index=False)
+        sink.write(fan)
+        sink.close()
 
     if return_fan:
         return fan
@@ -91,7 +182,84 @@ def create_fan(energy, reserve, fName=None, return_fan=True, break_tp=False,
     return None
 
 
-def _create_fan(energy, reserve):
+def iter_fans(energy, reserve, resolution=1., compact=False, workers=1,
+              il=None):
+    """ Generate the fan one trading period at a time, in the same order as
+    _create_fan. Only the periods being calculated are held in memory, so
+    arbitrarily long date ranges may be processed, e.g. by writing each
+    period to a sink as it is produced.
+
+    Parameters:
+    -----------
+    energy: An energy offer frame, fans will be created for every permutation
+            in this frame.
+    reserve: The corresponding reserve offer frame.
+    resolution: Optional, the size in MW of the energy increments.
+    compact: Optional, only evaluate the fans at their breakpoints.
+    workers: Optional, the number of processes to use, periods are yielded
+             in order as they are completed.
+    il: Optional, the corresponding interruptible load offer frame.
+
+    Returns
+    -------
+    generator: The fan DataFrame of each trading period, every one with the
+               same columns, see fan_columns
+    """
+    shards = _period_shards(energy, reserve, il)
+    columns = fan_columns(energy, il)
+
+    if workers <= 1:
+        memo = FanMemo()
+        for tpid, period_energy, period_reserve, period_il in shards:
+            parts = _fan_parts(period_energy, period_reserve,
+                               resolution=resolution, compact=compact,
+                               il=period_il, memo=memo)
+            if parts[0]:
+                yield assemble_fan(*parts).reindex(columns=columns)
+        return
+
+    # Only a few shards per worker are submitted ahead of the consumer, the
+    # next is submitted once a result has been yielded, so a slow consumer
+    # does not leave finished periods piling up in memory.
+    window = SHARDS_PER_WORKER * workers
+    pending = deque()
+    pool = multiprocessing.Pool(workers)
+    try:
+        for tpid, period_energy, period_reserve, period_il in shards:
+            pending.append(pool.apply_async(_fan_shard, ((
+                period_energy, period_reserve, period_il, resolution,
+                compact),)))
+            if len(pending) < window:
+                continue
+
+            parts = pending.popleft().get()
+            if parts[0]:
+                yield assemble_fan(*parts).reindex(columns=columns)
+
+        while pending:
+            parts = pending.popleft().get()
+            if parts[0]:
+                yield assemble_fan(*parts).reindex(columns=columns)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _write_fans(fans, sink=None):
+    """ Pass each fan through to an optional sink, closing it at the end.
+    """
+    try:
+        for fan in fans:
+            if sink:
+                sink.write(fan)
+            yield fan
+    finally:
+        if sink:
+            sink.close()
+
+
+def _create_fan(energy, reserve, resolution=1., compact=False, workers=1,
+                il=None):
     """Given an energy and reserve offer frame, PLSR, will construct the
     full fan curve for these on a station by station, band by band and by
     reserve type.
@@ -104,29 +272,289 @@ def _create_fan(energy, reserve):
     energy: An energy offer frame, fans will be created for every permutation
             in this frame.
     reserve: The corresponding reserve offer frame.
+    resolution: Optional, the size in MW of the energy increments.
+    compact: Optional, only evaluate the fans at their breakpoints.
+    workers: Optional, the number of processes to use.
+    il: Optional, the corresponding interruptible load offer frame.
 
     Returns
     -------
     DataFrame: A DataFrame containing the fan object
     """
 
-    station_dates = energy[["Node", "Trading_Period_ID"]].drop_duplicates()
-    fan_assembly = []
+    if workers > 1:
+        parts = _parallel_fan_parts(energy, reserve, workers,
+                                    resolution=resolution, compact=compact,
+                                    il=il)
+    else:
+        parts = _fan_parts(energy, reserve, resolution=resolution,
+                           compact=compact, il=il)
+
+    return assemble_fan(*parts)
+
+
+def _parallel_fan_parts(energy, reserve, workers, resolution=1.,
+                        compact=False, il=None):
+    """ Spread the fan calculations across a pool of processes, one task per
+    trading period. Each task is only sent the offers of its own trading
+    period and the results are merged back in the order of the trading
+    periods, so the fan is identical to one calculated in a single process.
+
+    Returns:
+    --------
+    parts: The station metadata, stacks and bands, see _fan_parts
+    """
+    shards = [(period_energy, period_reserve, period_il, resolution,
+               compact) for tpid, period_energy, period_reserve, period_il
+              in _period_shards(energy, reserve, il)]
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_fan_shard, shards, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    station_metadata, stacks, bands = [], [], []
+    for shard_metadata, shard_stacks, shard_bands in results:
+        station_metadata.extend(shard_metadata)
+        stacks.extend(shard_stacks)
+        bands.extend(shard_bands)
+
+    return station_metadata, stacks, bands
+
+
+def _period_shards(energy, reserve, il=None):
+    """ Split the offers into trading periods, yields the Trading_Period_ID
+    with the energy, reserve and interruptible load (None if il is None)
+    offers of that period.
+    """
+    reserve_periods = reserve.groupby("Trading_Period_ID", sort=False).indices
+    empty_reserve = reserve.iloc[:0]
+
+    if il is not None:
+        il_periods = il.groupby("Trading_Period_ID", sort=False).indices
+        empty_il = il.iloc[:0]
+
+    for tpid, period_energy in energy.groupby("Trading_Period_ID",
+                                              sort=False):
+        locations = reserve_periods.get(tpid)
+        if locations is None:
+            period_reserve = empty_reserve
+        else:
+            period_reserve = reserve.iloc[locations]
+
+        period_il = None
+        if il is not None:
+            locations = il_periods.get(tpid)
+            period_il = empty_il if locations is None else il.iloc[locations]
+
+        yield tpid, period_energy, period_reserve, period_il
+
+
+class FanMemo(object):
+    """ Least recently used memo of the fans of station offers, keyed by
+    station_fan_key. The key holds the resolution and compact settings, so
+    one memo may be shared by fans built with different settings.
+
+    Parameters:
+    -----------
+    maxsize: Optional, the number of station fans to remember
+
+    """
+
+    def __init__(self, maxsize=FAN_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """ The (stack, bands) of the fan stored under key, or None """
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.entries[key] = value
+        self.hits += 1
+        return value
 
-    for index, station, tpid in station_dates.itertuples():
-        single_energy = energy.efilter(Trading_Period_ID=tpid,
-                               Node=station)
-        for reserve_type in ("FIR", "SIR"):
-            single_reserve = reserve.efilter(Trading_Period_ID=tpid,
-                        Node=station, Reserve_Type=reserve_type)
+    def set(self, key, value):
+        """ Remember the (stack, bands) of a fan under key """
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
 
-            fan_assembly.append(station_fan(single_energy, single_reserve,
-                                            assumed_reserve=reserve_type))
 
-    return pd.concat(fan_assembly, ignore_index=True)
+# The station fans remembered by each pool process, kept between the shards
+# it calculates as consecutive trading periods mostly repeat their offers
+_shard_memo = FanMemo()
+
+
+def _fan_shard(shard):
+    """ Pool entry point, unpacks a shard created by _parallel_fan_parts
+    """
+    energy, reserve, il, resolution, compact = shard
+    return _fan_parts(energy, reserve, resolution=resolution, compact=compact,
+                      il=il, memo=_shard_memo)
 
 
-def station_fan(energy, reserve, assumed_reserve=None):
+def _fan_parts(energy, reserve, resolution=1., compact=False, il=None,
+               memo=None):
+    """ Calculate the numeric fan of every station in the offer frames,
+    without assembling them into a DataFrame. Interruptible load offers are
+    added alongside the stations of each trading period.
+
+    Stations usually repeat the same offers for many trading periods, the
+    fan of each distinct set of offers is only calculated once and shared
+    by every period it occurs in, see station_fan_key.
+
+    Parameters:
+    -----------
+    memo: Optional, FanMemo of the station fans already calculated, by
+          default the fans are only shared within this call.
+
+    Returns:
+    --------
+    station_metadata: List of metadata dictionaries, one per station fan
+    stacks: List of reserve stacks, see station_fan_arrays
+    bands: List of band information, see station_fan_arrays
+    """
+
+    # Partition the offers a single time rather than scanning the full
+    # frames for every station and trading period combination.
+    reserve_groups = reserve.groupby(["Node", "Trading_Period_ID",
+                                      "Reserve_Type"], sort=False).indices
+    reserve_offers = [np.asarray(reserve[x].values) for x in
+                      RESERVE_OFFER_COLUMNS]
+
+    if memo is None:
+        memo = FanMemo()
+
+    il_groups = {}
+    if il is not None:
+        il = il[il["Quantity"] > 0]
+        groups = il.groupby(["Trading_Period_ID", "Node", "Reserve_Type"],
+                            sort=True).indices
+        for key, locations in sorted(groups.iteritems()):
+            if len(locations):
+                il_groups.setdefault(key[0], []).append(locations)
+
+    station_metadata, stacks, bands = [], [], []
+    for tpid, period_energy in energy.groupby("Trading_Period_ID",
+                                              sort=False):
+        for locations in il_groups.get(tpid, []):
+            single_il = il.iloc[locations]
+            il_stack, il_bands = il_fan_arrays(single_il)
+            station_metadata.append(get_station_metadata(single_il))
+            stacks.append(il_stack)
+            bands.append(il_bands)
+
+        period_energy = period_energy[period_energy["Quantity"] > 0]
+        if len(period_energy) == 0:
+            continue
+
+        # Order the offers by station and then price so that the energy
+        # stacks for every station in the period can be built in one go.
+        codes, stations = pd.factorize(period_energy["Node"].values)
+        order = np.lexsort((period_energy["Price"].values, codes))
+        period_energy = period_energy.iloc[order]
+        station_bands = np.bincount(codes, minlength=len(stations))
+
+        period_stacks, offsets = energy_stacks(
+                        period_energy[["Price", "Quantity"]].values,
+                        station_bands, resolution=resolution, compact=compact)
+        band_offsets = np.concatenate(([0], np.cumsum(station_bands)))
+        energy_offers = [period_energy[x].values for x in ("Price",
+                                                           "Quantity",
+                                                           "Max_Output")]
+        period_metadata = stations_metadata(period_energy, band_offsets[:-1])
+
+        # The energy only fan of every station, the FIR and SIR fans of a
+        # station share both its energy stack and this view of it
+        period_energy_only = energy_only(None, energy_stack=period_stacks)
+
+        for i, station in enumerate(stations):
+            single_offers = [x[band_offsets[i]:band_offsets[i + 1]] for x in
+                             energy_offers]
+            energy_stack = period_stacks[offsets[i]:offsets[i + 1]]
+            energy_version = period_energy_only[offsets[i]:offsets[i + 1]]
+            metadata = period_metadata[i]
+
+            for reserve_type in ("FIR", "SIR"):
+                locations = reserve_groups.get((station, tpid, reserve_type))
+                if locations is None:
+                    locations = np.zeros(0, dtype=int)
+                single_reserve = [x[locations] for x in reserve_offers]
+
+                key = station_fan_key(single_offers, single_reserve,
+                                      reserve_type, resolution, compact)
+                parts = memo.get(key)
+                if parts is None:
+                    parts = reserve_fan_arrays(energy_stack,
+                                               single_offers[2][0],
+                                               single_reserve,
+                                               assumed_reserve=reserve_type,
+                                               compact=compact,
+                                               energy_version=energy_version)
+                    memo.set(key, parts)
+
+                station_metadata.append(metadata)
+                stacks.append(parts[0])
+                bands.append(parts[1])
+
+    return station_metadata, stacks, bands
+
+
+def station_fan_key(energy_offers, reserve_offers, reserve_type,
+                    resolution=1., compact=False):
+    """ A content hash of everything the fan of a station depends upon, two
+    stations or trading periods with the same key have identical fans.
+
+    Parameters:
+    -----------
+    energy_offers: List of the price, quantity and Max_Output arrays of the
+                   positive energy offers of the station, sorted by price.
+    reserve_offers: List of the RESERVE_OFFER_COLUMNS arrays of the reserve
+                    offers of a single reserve type.
+    reserve_type: The reserve type of the fan
+    resolution: The size in MW of the energy increments
+    compact: Whether the fan is only evaluated at its breakpoints
+
+    Returns:
+    --------
+    key: Hexadecimal string
+
+    """
+    prices, quantities, max_output = energy_offers
+    digest = hashlib.sha1("%s/%s/%r/%r" % (reserve_type, compact, resolution,
+                                           float(max_output[0])))
+    digest.update(np.ascontiguousarray(prices, dtype=np.float64).tostring())
+    digest.update(np.ascontiguousarray(quantities,
+                                       dtype=np.float64).tostring())
+
+    # Only the reserve offers with a positive quantity make up the fan,
+    # their order is kept as it determines the order of the bands
+    prices, quantities, percents, product_types, reserve_types = (
+                                                            reserve_offers)
+    offered = np.asarray(quantities, dtype=np.float64) > 0
+    for values in (prices, quantities, percents):
+        digest.update(np.ascontiguousarray(np.asarray(values)[offered],
+                                           dtype=np.float64).tostring())
+    for values in (product_types, reserve_types):
+        digest.update("\x00".join(str(x) for x in
+                                  np.asarray(values)[offered]))
+
+    return digest.hexdigest()
+
+
+def station_fan(energy, reserve, assumed_reserve=None, resolution=1.,
+                compact=False, energy_stack=None):
     """ Create the fan information for a given station and single reserve type.
     If multiple reserve types are passed this will fail miserably.
 
@@ -138,6 +566,22 @@ def station_fan(energy, reserve, assumed_reserve=None):
     reserve: PLSR OfferFrame containing the informaiton about a single
             station, trading period and reserve type, note TWDSR should work.
 
+    resolution: Optional, the size in MW of the energy increments, defaults
+                to 1 MW. Energy quantities and the band edges are exact at
+                any resolution. The reserve is exact at every increment but
+                the fan may bend between two increments, drawing a straight
+                line between them understates the reserve of a band by at
+                most resolution * (1 + percent / 100) / 4 MW.
+
+    compact: Optional, if True the fan is only evaluated at its breakpoints,
+             the band edges plus the points where the capacity,
+             proportionality and maximum quantity lines intersect, instead
+             of in fixed increments. The fan is piecewise linear between
+             these points so no information is lost.
+
+    energy_stack: Optional, the energy stack of the station if it has
+                  already been calculated, e.g. by energy_stacks.
+
     Returns:
     --------
     DataFrame: A stacked DataFrame object containing the fan data for a
@@ -150,100 +594,202 @@ def station_fan(energy, reserve, assumed_reserve=None):
         return None
 
     station_metadata = get_station_metadata(energy)
+    reserve_stack, bands = station_fan_arrays(energy, reserve,
+                                              assumed_reserve=assumed_reserve,
+                                              resolution=resolution,
+                                              compact=compact,
+                                              energy_stack=energy_stack)
+
+    return assemble_fan([station_metadata], [reserve_stack], [bands])
+
+
+def station_fan_arrays(energy, reserve, assumed_reserve=None, resolution=1.,
+                       compact=False, energy_stack=None):
+    """ Create the numeric fan data for a given station and single reserve
+    type, without any of the station metadata attached, see station_fan.
+
+    Parameters:
+    -----------
+    energy: Energy offers of a single station and trading period, only
+            offers with a positive quantity are used.
+    reserve: Reserve offers of the same station for a single reserve type.
+    assumed_reserve: The reserve type to record for the energy only band.
+    resolution: Optional, the size in MW of the energy increments.
+    compact: Optional, only evaluate the fan at its breakpoints.
+    energy_stack: Optional, the energy stack of the station if it has
+                  already been calculated.
+
+    Returns:
+    --------
+    reserve_stack: numpy array of the feasible reserve regions of each band
+                   stacked one after the other, FAN_COLUMNS wide.
+    bands: Tuple of (reserve types, product types, percents) arrays with
+           one entry for each band in the reserve stack.
+
+    """
+    energy = energy[energy["Quantity"] > 0]
 
     # Do an check just in case the reserve is equal to zero.
     # Will return an energy only version, all reserve set to zero.
     # Don't need to concat there should only be a single version.
     if len(reserve) == 0:
-        return create_energy_stack(energy, station_metadata,
-                            assumed_reserve=assumed_reserve)
+        return _energy_only_arrays(energy, assumed_reserve=assumed_reserve,
+                                   resolution=resolution, compact=compact,
+                                   energy_stack=energy_stack)
 
     if len(reserve["Reserve_Type"].unique()) > 1:
         raise ValueError("Must only pass a single Reserve Type, you passed\
             more than 1")
 
     # Create the Energy Stack
-    sorted_energy = energy.sort("Price")
-    energy_stack = incremental_energy_stack(
-                sorted_energy[["Price", "Quantity"]].values)
+    if energy_stack is None:
+        sorted_energy = energy.sort_values("Price")
+        energy_stack = incremental_energy_stack(
+                    sorted_energy[["Price", "Quantity"]].values,
+                    resolution=resolution, compact=compact)
 
     # Get the nameplate capacity of the station, all values are duplicates
-    # so we just take the first one. Set initial remaining capacity equal to
-    # the nameplate capacity
-    nameplate_capacity = remaining_capacity = energy["Max_Output"].values[0]
+    # so we just take the first one.
+    nameplate_capacity = energy["Max_Output"].values[0]
+
+    reserve_offers = [np.asarray(reserve[x].values) for x in
+                      RESERVE_OFFER_COLUMNS]
+    return reserve_fan_arrays(energy_stack, nameplate_capacity,
+                              reserve_offers, assumed_reserve=assumed_reserve,
+                              compact=compact)
+
+
+def reserve_fan_arrays(energy_stack, nameplate_capacity, reserve_offers,
+                       assumed_reserve=None, compact=False,
+                       energy_version=None):
+    """ Create the numeric fan data of a station for a single reserve type
+    from its energy stack. The stack is only read, so the fans of each
+    reserve type of a station may all be built from the same one.
+
+    Parameters:
+    -----------
+    energy_stack: The energy stack of the station, see energy_stacks
+    nameplate_capacity: The Max_Output of the station
+    reserve_offers: List of the RESERVE_OFFER_COLUMNS arrays of the reserve
+                    offers of the station for a single reserve type.
+    assumed_reserve: The reserve type to record for the energy only band.
+    compact: Optional, only evaluate the fan at its breakpoints.
+    energy_version: Optional, the energy only fan of the station, see
+                    energy_only, used when no reserve is offered.
+
+    Returns:
+    --------
+    reserve_stack, bands: See station_fan_arrays
 
+    """
     # Filter Reserve Offers, create a band stack for each pairing
-    nonzero_reserve = reserve[reserve["Quantity"] > 0]
-    if len(nonzero_reserve) == 0:
-        return create_energy_stack(energy, station_metadata,
-                            assumed_reserve=assumed_reserve)
+    prices, quantities, percents, product_types, reserve_types = [
+                                        np.asarray(x) for x in reserve_offers]
+    offered = quantities.astype(float) > 0
+    if not offered.any():
+        return _energy_only_arrays(None, assumed_reserve=assumed_reserve,
+                                   energy_stack=energy_stack,
+                                   energy_version=energy_version)
+
+    prices = prices[offered].astype(float)
+    quantities = quantities[offered].astype(float)
+    percents = percents[offered].astype(float)
+    reserve_types = reserve_types[offered]
+    product_types = product_types[offered]
+
+    # Check for TWDSR, set percent to essentially infinity.
+    percents = np.where(product_types == "TWDSR", 1000000, percents)
 
     # Do a check for zero priced reserve offers here,
-    # If there aren't any then add one to the band stacks call.
-    # Add a zero reserve stack array as it will have no impact upon
+    # If there aren't any then add an energy only band, with no reserve,
+    # to the band stacks call. It will have no impact upon
     # The actual fan created, note this may create additional fans
     # But the tradeoff is a small one.
-    band_stacks = []
-    if 0. not in nonzero_reserve["Price"]:
-        band_stacks.append(create_energy_stack(energy, station_metadata,
-                                 assumed_reserve=assumed_reserve))
-
-    for (index, percent, price, quantity, reserve_type, product_type
-        ) in nonzero_reserve[["Percent", "Price", "Quantity", "Reserve_Type",
-                             "Product_Type"]].itertuples():
+    if 0. not in prices:
+        prices = np.concatenate(([0.], prices))
+        quantities = np.concatenate(([0.], quantities))
+        percents = np.concatenate(([0.], percents))
+        reserve_types = np.concatenate(([assumed_reserve], reserve_types))
+        product_types = np.concatenate((["PLSR"], product_types))
+
+    # In compact mode every band must be evaluated at the breakpoints of
+    # all of the bands, otherwise the bands can't be summed together at a
+    # common cumulative energy quantity during the aggregation.
+    if compact:
+        remaining_capacities = nameplate_capacity - (np.cumsum(quantities)
+                                                     - quantities)
+        energy_stack = refine_stack(energy_stack, reserve_breakpoints(
+                            quantities, percents, remaining_capacities))
+
+    reserve_stack = feasible_reserve_regions(energy_stack, prices, quantities,
+                                             percents, nameplate_capacity)
+
+    return (reserve_stack.reshape(-1, len(FAN_COLUMNS)),
+            (reserve_types, product_types, percents))
+
+
+def il_fan_arrays(il):
+    """ Create the numeric fan data for the interruptible load offers of a
+    single grid exit point, trading period and reserve type. Interruptible
+    load does not depend upon the energy dispatched so each offer is a
+    single row with no energy, the reserve is added to every point of the
+    reserve contours at or above its price when the fan is aggregated.
 
-        # Check for TWDSR, set percent to essentially infinity.
-        if product_type == "TWDSR":
-            percent = 1000000
-
-        reserve_stack = feasible_reserve_region(energy_stack, price, quantity,
-                                                percent, nameplate_capacity,
-                                                remaining_capacity,
-                                                product_type)
+    Parameters:
+    -----------
+    il: Interruptible load offers with a positive quantity
 
-        # Update the remaining capacity
-        remaining_capacity -= quantity
+    Returns:
+    --------
+    il_stack: numpy array, a FAN_COLUMNS wide row for each offer
+    bands: Tuple of (reserve types, product types, percents) arrays with
+           one entry for each offer, the product type is "IL".
 
-        # Create a Band DataFrame
-        full_metadata = update_metadata(station_metadata, reserve_type,
-                                 product_type, percent)
+    """
+    il = il.sort_values("Price")
+    quantities = il["Quantity"].values.astype(float)
 
-        band_stacks.append(band_dataframe(reserve_stack, full_metadata))
+    il_stack = np.zeros((len(il), len(FAN_COLUMNS)))
+    il_stack[:, 4] = il["Price"].values
+    il_stack[:, 5] = quantities
+    il_stack[:, 6] = quantities
+    il_stack[:, 7] = quantities
 
-    return pd.concat(band_stacks)
+    bands = (il["Reserve_Type"].values.astype(object),
+             np.array(["IL"] * len(il), dtype=object), np.zeros(len(il)))
+    return il_stack, bands
 
 
-def create_energy_stack(energy, station_metadata, assumed_reserve=None):
+def _energy_only_arrays(energy, assumed_reserve=None, resolution=1.,
+                        compact=False, energy_stack=None, energy_version=None):
     """ Creates an energy version of the stack with zero reserve offers
     and zero prices. Due to the way the aggregations work this step is
     required or units which offer reserve at high prices have their energy
     offers excluded from the low priced ones
 
-    Parameters:
-    -----------
-    energy: Energy offers for that station in question.
-    station_metadata: Information about the station
-    assumed_reserve: FIR or SIR, is repeated more than once.
-
-    Returns:
-    --------
-    DataFrame: A DataFrame containing an energy only incremental DF with
-               asscociated metadata
+    Returns the same arrays as station_fan_arrays for a single band, an
+    energy_version which has already been built is used as it is.
     """
-    energy_version = energy_only(energy)
-    full_metadata = update_metadata(station_metadata, assumed_reserve,
-                                        "PLSR", 0)
-    return band_dataframe(energy_version, full_metadata)
-
+    if energy_version is None:
+        energy_version = energy_only(energy, resolution=resolution,
+                                     compact=compact,
+                                     energy_stack=energy_stack)
+    bands = (np.array([assumed_reserve], dtype=object),
+             np.array(["PLSR"], dtype=object), np.array([0.]))
+    return energy_version, bands
 
 
-def energy_only(energy):
+def energy_only(energy, resolution=1., compact=False, energy_stack=None):
     """ Mimics the fan curve for an energy only station by setting all
     reserve poritons of the stack to zero.
 
     Parameters:
     -----------
     energy: DataFrame of the energy offers
+    resolution: Optional, the size in MW of the energy increments.
+    compact: Optional, build a breakpoint only stack, see station_fan.
+    energy_stack: Optional, a previously calculated energy stack to use
+                  instead of building a new one.
 
     Returns:
     --------
@@ -251,9 +797,11 @@ def energy_only(energy):
                     but the full energy information.
 
     """
-    sorted_energy = energy.sort("Price")
-    energy_stack = incremental_energy_stack(
-                sorted_energy[["Price", "Quantity"]].values)
+    if energy_stack is None:
+        sorted_energy = energy.sort_values("Price")
+        energy_stack = incremental_energy_stack(
+                sorted_energy[["Price", "Quantity"]].values,
+                resolution=resolution, compact=compact)
 
     length = energy_stack.shape[0]
     energy_version = np.zeros((length, 8))
@@ -262,39 +810,81 @@ def energy_only(energy):
     return energy_version
 
 
-def update_metadata(station_metadata, reserve_type, product_type, percent):
-    """ Takes the metadata dictionary and appends some new key value
-    pairs to it.
-    """
-    full_metadata = station_metadata.copy()
-    full_metadata["Reserve_Type"] = reserve_type
-    full_metadata["Product_Type"] = product_type
-    full_metadata["Reserve_Percent"] = percent
+def assemble_fan(station_metadata, stacks, bands):
+    """ Assemble the fans of many stations into a single DataFrame.
 
-    return full_metadata
+    The fans are held column wise until this point, the numeric stacks of
+    every station are joined into a single array while the metadata stays
+    in a small table with a row per station. The metadata is only broadcast
+    along the fan on the way out, as categoricals, so each row holds an
+    integer code instead of a copy of every string.
 
+    Parameters:
+    -----------
+    station_metadata: List of metadata dictionaries, one per station fan.
+    stacks: List of the reserve stacks of each station fan.
+    bands: List of the (reserve types, product types, percents) arrays
+           describing the bands in each of the reserve stacks.
 
-def band_dataframe(full_stack, full_metadata):
-    """ Creates a DataFrame for a single band taking into account the full
-    stack along with the metadata for it.
-    Returns this DataFrame which may then be added together to create the
-    station frame.
+    Returns:
+    --------
+    DataFrame: A DataFrame containing the fan object
 
     """
+    if len(stacks) == 0:
+        return pd.DataFrame(columns=FAN_COLUMNS + BAND_COLUMNS)
 
-    columns = ["Energy Price", "Energy Quantity",
-               "Incremental Energy Quantity", "Cumulative Energy Quantity",
-               "Reserve Price", "Reserve Quantity",
-               "Incremental Reserve Quantity", "Cumulative Reserve Quantity"]
+    # Each station fan is made up of bands of equal length
+    rows = np.array([len(stack) for stack in stacks])
+    band_counts = np.array([len(band[0]) for band in bands])
+    station_key = np.repeat(np.arange(len(stacks)), rows)
+    band_key = np.repeat(np.arange(band_counts.sum()),
+                         np.repeat(rows // band_counts, band_counts))
+
+    fan = pd.DataFrame(np.concatenate(stacks), columns=FAN_COLUMNS)
+
+    metadata = pd.DataFrame(list(station_metadata))
+    for column in metadata.columns:
+        fan[column] = _expand_column(metadata[column].values, station_key)
+
+    for column, values in zip(BAND_COLUMNS, zip(*bands)):
+        fan[column] = _expand_column(np.concatenate(values), band_key)
+
+    return fan
 
-    # Create the DataFrame for a single band
-    df = pd.DataFrame(full_stack, columns=columns)
 
-    # Add the metadata
-    for key, value in full_metadata.iteritems():
-        df[key] = value
+def fan_columns(energy, il=None):
+    """ The columns of the fans generated from the offers. The metadata of
+    the interruptible load offers may have other columns than the energy
+    offers, so a trading period without any IL has fewer columns when it is
+    assembled on its own, e.g. by iter_fans. Sinks such as a csv file need
+    the same columns for every period.
 
-    return df
+    Parameters:
+    -----------
+    energy: Energy OfferFrame
+    il: Optional, interruptible load OfferFrame
+
+    Returns:
+    --------
+    columns: List of the fan columns, in the order of assemble_fan
+
+    """
+    metadata = set(x for x in energy.columns if x not in EXCLUDED_METADATA)
+    if il is not None:
+        metadata.update(x for x in il.columns if x not in EXCLUDED_METADATA)
+    return FAN_COLUMNS + sorted(metadata) + BAND_COLUMNS
+
+
+def _expand_column(values, key):
+    """ Broadcast a column of the station or band table along the fan, text
+    columns are returned as categoricals.
+    """
+    if values.dtype != object:
+        return values[key]
+
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(codes[key], categories)
 
 
 def get_station_metadata(offer_data):
@@ -312,52 +902,221 @@ def get_station_metadata(offer_data):
     meta_data: Dictionary, contains metadata information about the station.
 
     """
-    excluded_columns = ("Band", "Price", "Quantity", "Product_Type",
-                        "Reserve_Type", "Is_Injection", "Is_Hvdc",
-                        "Created_Date", "Last_Amended_Date")
-
     meta_data = {item: offer_data[item][offer_data.index[0]] for item in
-                    offer_data.columns if item not in excluded_columns}
+                    offer_data.columns if item not in EXCLUDED_METADATA}
 
     return meta_data
 
 
-def incremental_energy_stack(pairs):
+def stations_metadata(offer_data, starts):
+    """ The metadata of many stations at once, see get_station_metadata.
+
+    Parameters:
+    -----------
+    offer_data: Energy offer frame with the offers of each station held
+                contiguously
+    starts: The position of the first offer of each station
+
+    Returns:
+    --------
+    metadata: List of metadata dictionaries, one per station
+
+    """
+    columns = [x for x in offer_data.columns if x not in EXCLUDED_METADATA]
+    values = [offer_data[x].values[starts] for x in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def incremental_energy_stack(pairs, resolution=1., compact=False):
     """ Takes an array of price quantity pairs and returns a numpy array
-    of this transformed into a single increment version (using step size 1)
+    of this transformed into a single increment version (using step size
+    resolution, 1 MW by default)
+
+    Each band is broken into increments of the resolution with the final
+    increment of the band holding whatever fraction remains, the band edges
+    are therefore always exact irrespective of the resolution.
 
     Inputs:
     -------
     pairs: numpy array of Nx2 dimension containing price and quantity pairs.
+    resolution: Optional, the size of the increments in MW, defaults to 1.
+    compact: Optional, if True each band is kept as a single increment
+             instead of being broken into steps, resolution is ignored.
 
     Returns:
     --------
-    stack: a (M+1x4) array where M is the sum of the quantities offered in
-           the pairs input. Columns are (Price, Quantity, Incremental Quantity,
-            Cumulative Quantity)
+    stack: a (M+1x4) array where M is the number of increments required to
+           cover the quantities offered in the pairs input (or the number
+           of bands if compact).
+           Columns are (Price, Quantity, Incremental Quantity,
+           Cumulative Quantity)
 
     """
 
+    stack, offsets = energy_stacks(pairs, [len(pairs)], resolution=resolution,
+                                   compact=compact)
+    return stack
+
+
+def energy_stacks(pairs, bands, resolution=1., compact=False):
+    """ Build the incremental energy stacks of many stations at once, see
+    incremental_energy_stack for the layout of a single stack.
+
+    Inputs:
+    -------
+    pairs: numpy array of Nx2 dimension containing price and quantity pairs,
+           the pairs of each station must be contiguous and sorted by price.
+    bands: Array containing the number of pairs belonging to each station.
+    resolution: Optional, the size of the increments in MW, defaults to 1.
+    compact: Optional, if True each band is kept as a single increment.
+
+    Returns:
+    --------
+    stack: A flat array of the stacks of every station, each one beginning
+           with a row of zeros.
+    offsets: Array of length stations + 1, the stack of station i is
+             stack[offsets[i]:offsets[i + 1]]
+
+    """
+
+    pairs = np.asarray(pairs, dtype=float).reshape(-1, np.shape(pairs)[-1])
     if pairs.shape[1] != 2:
         raise ValueError("Shape of the array passed to the function must\
 be a Nx2 array, current size is %sx%s" % pairs.shape)
 
-    partial_arrays = [np.zeros((1,4))]
-    for p, q in pairs:
-        # Incremental Capacity
-        partial = np.zeros((np.ceil(q), 4))
-        partial[:,2] = np.ones(np.ceil(q))
-        if np.ceil(q) != q:
-            partial[-1, 2] = q % 1
+    if resolution <= 0:
+        raise ValueError("The resolution must be a positive number of MW,\
+you passed %s" % resolution)
 
-        # Price and Quantity
-        partial[:,0] = p
-        partial[:,1] = q
-        partial_arrays.append(partial)
+    bands = np.asarray(bands, dtype=int)
+    prices, quantities = pairs[:, 0], pairs[:, 1]
 
-    full_array = np.concatenate(partial_arrays)
-    full_array[:,3] = np.cumsum(full_array[:,2])
-    return full_array
+    # Number of increments for each band, rounding guards against floating
+    # point noise when the resolution divides the quantity.
+    if compact:
+        steps = (quantities > 0).astype(int)
+    else:
+        steps = np.ceil(np.round(quantities / resolution, 9)).astype(int)
+        steps[steps < 0] = 0
+
+    station_of_band = np.repeat(np.arange(len(bands)), bands)
+    rows = np.bincount(station_of_band, weights=steps,
+                       minlength=len(bands)).astype(int) + 1
+    offsets = np.zeros(len(bands) + 1, dtype=int)
+    offsets[1:] = np.cumsum(rows)
+
+    # Expand every band into its increments, the last increment of each band
+    # takes whatever quantity remains.
+    band_of_row = np.repeat(np.arange(len(pairs)), steps)
+    if compact:
+        increments = quantities[band_of_row]
+    else:
+        increments = np.empty(len(band_of_row))
+        increments.fill(resolution)
+        last = np.cumsum(steps)[steps > 0] - 1
+        increments[last] = (quantities - (steps - 1) * resolution)[steps > 0]
+
+    # Leave a row of zeros at the start of every station
+    positions = (np.arange(len(band_of_row)) +
+                 station_of_band[band_of_row] + 1)
+
+    stack = np.zeros((offsets[-1], 4))
+    stack[positions, 0] = prices[band_of_row]
+    stack[positions, 1] = quantities[band_of_row]
+    stack[positions, 2] = increments
+
+    # The cumulative quantities are summed as integer numbers of units of
+    # 1 / QUANTITY_SCALE MW, which is exact. A running total over every
+    # station less the total at the start of each station then leaves no
+    # rounding noise depending on the position of the station, identical
+    # offers must give identical stacks.
+    units = np.zeros(offsets[-1], dtype=np.int64)
+    units[positions] = np.round(increments * QUANTITY_SCALE).astype(np.int64)
+    running = np.cumsum(units)
+    stack[:, 3] = ((running - np.repeat(running[offsets[:-1]], rows)) /
+                   float(QUANTITY_SCALE))
+
+    return stack, offsets
+
+
+def reserve_breakpoints(res_quantity, res_percent, remaining_capacity):
+    """ Calculate the cumulative energy quantities at which the reserve line
+    of a single band changes slope. Between these points, and the band edges
+    of the energy stack, the feasible reserve region is linear.
+
+    Parameters:
+    -----------
+    res_quantity: Maximum band reserve quantity, or an array of these for
+                  several bands
+    res_percent: The percentage for the reserve band(s)
+    remaining_capacity: The residual capacity after the reserve bands at
+                        lower prices have been removed from the nameplate
+
+    Returns:
+    --------
+    breakpoints: numpy array of cumulative energy quantities, these may lie
+                 outside of the energy stack in which case they are ignored.
+
+    """
+    res_quantity, res_percent, remaining_capacity = [np.atleast_1d(
+                np.asarray(x, dtype=float)) for x in np.broadcast_arrays(
+                res_quantity, res_percent, remaining_capacity)]
+    proportion = res_percent / 100.
+    proportional = proportion > 0
+
+    # Capacity line reaching zero and the maximum quantity meeting the
+    # capacity line
+    breakpoints = [remaining_capacity, remaining_capacity - res_quantity]
+
+    # Proportionality line meeting the maximum quantity and the capacity line
+    breakpoints.append(res_quantity[proportional] / proportion[proportional])
+    breakpoints.append(remaining_capacity[proportional] /
+                       (1. + proportion[proportional]))
+
+    return np.concatenate(breakpoints)
+
+
+def refine_stack(stack, breakpoints):
+    """ Insert additional increments into an energy stack so that it contains
+    a row at each of the breakpoints. Bands which contain a breakpoint are
+    split in two, keeping their price and quantity.
+
+    Parameters:
+    -----------
+    stack: The energy stack as calculated by incremental_energy_stack
+    breakpoints: Array of cumulative energy quantities to add to the stack
+
+    Returns:
+    --------
+    stack: The refined energy stack
+
+    """
+    cumulative = stack[:, 3]
+    breakpoints = np.asarray(breakpoints, dtype=float)
+    breakpoints = breakpoints[(breakpoints > 0) &
+                              (breakpoints < cumulative[-1])]
+
+    # Breakpoints within rounding noise of a row, or of one another, would
+    # add empty increments
+    breakpoints = np.unique(breakpoints)
+    distinct = np.ones(len(breakpoints), dtype=bool)
+    distinct[1:] = np.diff(breakpoints) > REFINE_TOLERANCE
+    breakpoints = breakpoints[distinct]
+    after = np.searchsorted(cumulative, breakpoints)
+    gap = np.minimum(cumulative[after] - breakpoints,
+                     breakpoints - cumulative[np.maximum(after - 1, 0)])
+    breakpoints = breakpoints[np.abs(gap) > REFINE_TOLERANCE]
+
+    points = np.union1d(cumulative, breakpoints)
+    if len(points) == len(cumulative):
+        return stack
+
+    # Each new point belongs to the band which finishes at or after it.
+    refined = stack[np.searchsorted(cumulative, points, side="left")]
+    refined[:, 3] = points
+    refined[1:, 2] = np.diff(points)
+
+    return refined
 
 
 def feasible_reserve_region(stack, res_price, res_quantity, res_percent,
@@ -370,6 +1129,9 @@ def feasible_reserve_region(stack, res_price, res_quantity, res_percent,
     fashion regarding the energy and reserve tradeoff. Ideally should keep
     all of the data together in one place:
 
+    The region is evaluated at each increment of the stack, so its accuracy
+    is set by the resolution the stack was built with, see station_fan.
+
     Parameters:
     -----------
     stack: The full energy stack as previously calculated.
@@ -391,39 +1153,71 @@ def feasible_reserve_region(stack, res_price, res_quantity, res_percent,
 
     """
 
-    length = stack.shape[0]
+    return feasible_reserve_regions(stack, res_price, res_quantity,
+                                    res_percent, nameplate_capacity,
+                                    remaining_capacity=remaining_capacity)[0]
+
+
+def feasible_reserve_regions(stack, res_prices, res_quantities, res_percents,
+                             nameplate_capacity, remaining_capacity=None):
+    """
+    Create the feasible region arrays for all of the reserve bands of a
+    station at once, see feasible_reserve_region. The bands must be passed
+    in the order in which they use up the capacity of the station, each band
+    may only use the capacity which the bands before it have left behind.
+
+    Parameters:
+    -----------
+    stack: The full energy stack as previously calculated.
+    res_prices: Array of the band reserve prices
+    res_quantities: Array of the maximum band reserve quantities
+    res_percents: Array of the percentages for the reserve bands, note TWDSR
+                  will be arbitrarily high
+    nameplate_capacity: The original capacity (nameplate) of the unit
+    remaining_capacity: Optional, the capacity left over for the first band,
+                        defaults to the nameplate capacity.
+
+    Returns:
+    --------
+    reserve_coupling: numpy array of shape (bands, length of stack, 8) of
+                      energy and reserve values.
+
+    """
+    res_prices = np.atleast_1d(np.asarray(res_prices, dtype=float))
+    res_quantities = np.atleast_1d(np.asarray(res_quantities, dtype=float))
+    res_percents = np.atleast_1d(np.asarray(res_percents, dtype=float))
+
+    if remaining_capacity is None:
+        remaining_capacity = nameplate_capacity
 
     # Update the capacity line to be of the size of the full capacity but
     # shifted to reflect what capacity has already been used by cheaper reserve
     # offers.
-    utilised_capacity = nameplate_capacity - remaining_capacity
-    capacity_line = nameplate_capacity - stack[:,3]
-    capacity_line = np.where(capacity_line - utilised_capacity <= 0,
-                             0, capacity_line - utilised_capacity)
+    utilised_capacity = (nameplate_capacity - remaining_capacity +
+                         np.cumsum(res_quantities) - res_quantities)
+    capacity_line = (nameplate_capacity - stack[:,3])[np.newaxis, :]
+    capacity_line = capacity_line - utilised_capacity[:, np.newaxis]
+    capacity_line = np.where(capacity_line <= 0, 0, capacity_line)
 
     # Create a line due to the proportionality constraint.
     # Note percentages are reported as is...
-    # Still need to figure out how to do TWD here...
-    reserve_line = stack[:,3] * res_percent /100.
+    reserve_line = (stack[:,3][np.newaxis, :] *
+                    res_percents[:, np.newaxis] / 100.)
 
-    reserve_line = np.where(reserve_line <= res_quantity, reserve_line,
-                            res_quantity)
+    quantity_line = res_quantities[:, np.newaxis]
+    reserve_line = np.where(reserve_line <= quantity_line, reserve_line,
+                            quantity_line)
     # Adjust for the modified capacity line
     reserve_line = np.where(reserve_line <= capacity_line, reserve_line,
                             capacity_line)
 
-    # Create an incremental reserve line as well
-    incremental_reserve_line = np.zeros(len(reserve_line))
-    incremental_reserve_line[1:] = reserve_line[1:] - reserve_line[:-1]
-
-
     # Create a new array and add the values
-    reserve_coupling = np.zeros((length, 8))
-    reserve_coupling[:, :4] = stack
-    reserve_coupling[:, 4] = res_price
-    reserve_coupling[:, 5] = res_quantity
-    reserve_coupling[:, 6] = incremental_reserve_line
-    reserve_coupling[:, 7] = reserve_line
+    reserve_coupling = np.zeros((len(res_prices), stack.shape[0], 8))
+    reserve_coupling[:, :, :4] = stack
+    reserve_coupling[:, :, 4] = res_prices[:, np.newaxis]
+    reserve_coupling[:, :, 5] = quantity_line
+    reserve_coupling[:, 1:, 6] = reserve_line[:, 1:] - reserve_line[:, :-1]
+    reserve_coupling[:, :, 7] = reserve_line
 
     return reserve_coupling
 
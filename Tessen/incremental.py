@@ -0,0 +1,249 @@
+""" Incremental updates of a fan store.
+
+Re-bids during the day only change the offers of a few stations, so
+regenerating every fan for each run repeats a lot of work. The offers of
+each station, trading period and reserve type are fingerprinted by their
+latest Last_Amended_Date and a hash of their contents. The fingerprints of
+the last run are kept in the store, e.g.
+
+    store/fingerprints.json
+
+and only the stations whose fingerprints have changed are regenerated and
+merged into the existing partitions.
+
+"""
+
+import os
+import hashlib
+
+import pandas as pd
+import numpy as np
+import simplejson as json
+
+from store import (write_fan_store, partition_files, _read_partition,
+                   _check_format)
+
+
+FINGERPRINT_FILE = "fingerprints.json"
+
+# Columns which do not change the fan and are left out of the content hash
+UNHASHED_COLUMNS = ("Created_Date", "Last_Amended_Date")
+
+
+def update_fan_store(energy, reserve, path, file_format="parquet",
+                     resolution=1., compact=False, workers=1, verbose=False,
+                     il=None):
+    """ Regenerate the fans of the stations whose offers have changed since
+    the last run and merge them into a fan store. A station of the last run
+    which no longer offers in one of the trading periods of the offers has
+    been withdrawn and its fans are removed, so the offers should hold every
+    station of their trading periods. Trading periods which are not in the
+    offers at all, e.g. other days, are left untouched.
+
+    Parameters:
+    -----------
+    energy: Energy OfferFrame, already filtered as in create_fan
+    reserve: Reserve OfferFrame, already filtered as in create_fan
+    path: Directory of the fan store, created if necessary
+    file_format: Optional, "parquet" (the default) or "feather"
+    resolution: Optional, see generate.station_fan
+    compact: Optional, see generate.station_fan
+    workers: Optional, the number of processes to generate the fans with
+    verbose: Optional, report how many stations were regenerated
+    il: Optional, interruptible load OfferFrame, already filtered
+
+    Returns:
+    --------
+    fan: DataFrame of the regenerated fans
+
+    """
+    # Imported here as generate imports this module
+    from generate import _create_fan, assemble_fan
+
+    _check_format(file_format)
+
+    fingerprints = fan_fingerprints(energy, reserve, il=il,
+                                    resolution=resolution, compact=compact)
+    previous = read_fingerprints(path)
+    partitions = _period_partitions(energy)
+
+    stale = {}
+    for tpid, stations in fingerprints.iteritems():
+        # Reserve offers without any energy offers have no fan
+        if tpid not in partitions:
+            continue
+
+        date, period = partitions[tpid]
+        before = previous.get(tpid, {})
+        if not partition_files(path, dates=date, periods=period):
+            before = {}
+
+        changed = [node for node, parts in stations.iteritems() if
+                   before.get(node) != parts]
+        # Stations which have withdrawn every offer of the period
+        changed.extend(node for node in before if node not in stations)
+        if changed:
+            stale[tpid] = set(changed)
+
+    if verbose:
+        total = sum(len(x) for x in fingerprints.itervalues())
+        print "%s of %s station periods have changed offers" % (
+            sum(len(x) for x in stale.itervalues()), total)
+
+    if not stale:
+        return assemble_fan([], [], [])
+
+    energy = energy[_station_mask(energy, stale)]
+    reserve = reserve[_station_mask(reserve, stale)]
+    if il is not None:
+        il = il[_station_mask(il, stale)]
+    fan = _create_fan(energy, reserve, resolution=resolution,
+                      compact=compact, workers=workers, il=il)
+
+    # Every changed station may have withdrawn its offers, leaving no fan
+    periods = {}
+    if len(fan):
+        periods = fan.groupby("Trading_Period_ID", sort=False).indices
+
+    for tpid, nodes in stale.iteritems():
+        date, period = partitions[tpid]
+        files = partition_files(path, dates=date, periods=period)
+
+        parts = []
+        for fName in files:
+            existing = _read_partition(fName)
+            parts.append(existing[~existing["Node"].astype(str).isin(nodes)])
+        locations = periods.get(tpid, [])
+        if len(locations):
+            parts.append(fan.iloc[locations])
+
+        updated = pd.concat(parts, ignore_index=True) if parts else None
+        if updated is not None and len(updated):
+            write_fan_store(updated, path, file_format=file_format,
+                            merge=False)
+        else:
+            # No station of the period has a fan left
+            for fName in files:
+                os.remove(fName)
+
+        previous[tpid] = fingerprints[tpid]
+
+    write_fingerprints(path, previous)
+
+    return fan
+
+
+def fan_fingerprints(energy, reserve, il=None, resolution=1., compact=False):
+    """ Fingerprint the offers of every station and trading period, the
+    energy offers and the offers of each reserve type separately. The fan
+    settings are part of every fingerprint, so changing them regenerates
+    every station rather than mixing fans of different settings in a store.
+
+    Parameters:
+    -----------
+    energy: Energy OfferFrame
+    reserve: Reserve OfferFrame
+    il: Optional, interruptible load OfferFrame
+    resolution: Optional, see generate.station_fan
+    compact: Optional, see generate.station_fan
+
+    Returns:
+    --------
+    fingerprints: Nested dictionary, Trading_Period_ID to Node to the
+                  "Energy" or Reserve_Type ("IL " prefixed for interruptible
+                  load) to a "latest amendment/sha1 of the offers" string
+
+    """
+    reserve_columns = ["Trading_Period_ID", "Node", "Reserve_Type"]
+    frames = [(energy, ["Trading_Period_ID", "Node"], ""),
+              (reserve, reserve_columns, "")]
+    if il is not None:
+        frames.append((il, reserve_columns, "IL "))
+
+    settings = "resolution=%r/compact=%r" % (float(resolution), bool(compact))
+
+    fingerprints = {}
+    for frame, columns, prefix in frames:
+        if len(frame) == 0:
+            continue
+
+        rows = _row_strings(frame)
+        amended = _amendments(frame)
+
+        groups = frame.groupby(columns, sort=False).indices
+        for key, locations in groups.iteritems():
+            if len(locations) == 0:
+                continue
+
+            part = key[2] if len(key) > 2 else "Energy"
+            digest = hashlib.sha1(settings)
+            digest.update("\n".join(sorted(rows[locations])))
+            latest = amended[locations].max() if amended is not None else ""
+
+            station = fingerprints.setdefault(str(key[0]), {}).setdefault(
+                str(key[1]), {})
+            station[prefix + str(part)] = "%s/%s" % (latest,
+                                                     digest.hexdigest())
+
+    return fingerprints
+
+
+def read_fingerprints(path):
+    """ The fingerprints of the last run saved in a fan store, empty if
+    there are none.
+    """
+    fName = os.path.join(path, FINGERPRINT_FILE)
+    if not os.path.exists(fName):
+        return {}
+
+    with open(fName) as f:
+        return json.load(f)
+
+
+def write_fingerprints(path, fingerprints):
+    """ Save the fingerprints of a run in a fan store """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    with open(os.path.join(path, FINGERPRINT_FILE), "w") as f:
+        json.dump(fingerprints, f, sort_keys=True)
+
+
+def _row_strings(frame):
+    """ Every row of the frame as a string, leaving out UNHASHED_COLUMNS """
+    columns = sorted(x for x in frame.columns if x not in UNHASHED_COLUMNS)
+    values = frame[columns].astype(str).values.tolist()
+    return np.array([",".join(row) for row in values], dtype=object)
+
+
+def _amendments(frame):
+    """ The Last_Amended_Date of every row as a sortable string """
+    if "Last_Amended_Date" not in frame.columns:
+        return None
+
+    # Only the distinct timestamps are parsed, there are few of them
+    codes, stamps = pd.factorize(frame["Last_Amended_Date"].values)
+    if len(stamps) == 0:
+        return np.array([""] * len(frame), dtype=object)
+
+    stamps = pd.to_datetime(pd.Series(stamps), dayfirst=True)
+    stamps = np.array(stamps.dt.strftime("%Y%m%d%H%M%S").fillna(""),
+                      dtype=object)
+    return np.where(codes >= 0, stamps[codes], "").astype(object)
+
+
+def _period_partitions(energy):
+    """ The Trading_Date and Trading_Period of each Trading_Period_ID """
+    periods = energy[["Trading_Period_ID", "Trading_Date",
+                      "Trading_Period"]].drop_duplicates("Trading_Period_ID")
+    return {str(tpid): (date, period) for tpid, date, period in
+            periods.values.tolist()}
+
+
+def _station_mask(frame, stale):
+    """ Boolean mask of the offers of the stale stations """
+    keys = [(tpid, node) for tpid, nodes in stale.iteritems() for node in
+            nodes]
+    pairs = pd.MultiIndex.from_arrays([frame["Trading_Period_ID"].astype(str),
+                                       frame["Node"].astype(str)])
+    return pairs.isin(keys)
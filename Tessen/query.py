@@ -0,0 +1,292 @@
+""" Dispatch feasibility queries over generated fans.
+
+For an energy price e and a reserve price r the energy which may be
+dispatched is everything offered at or below e, and the reserve which may
+be dispatched alongside it is the reserve offered at or below r by the
+stations at that level of energy, i.e. the same point the reserve contour
+of price r in aggregate.reserve_contours reaches at energy price e.
+Interruptible load is available whatever the energy price.
+
+Both quantities are step functions of the prices, so they are tabulated
+once for each group of the fan (e.g. each trading period, reserve type and
+island) on the grid of prices offered in that group. Any number of queries
+are then answered with a searchsorted on each price and a single lookup.
+
+"""
+
+import pandas as pd
+import numpy as np
+
+from fan_index import FanIndex
+from store import date_name, select_rows, _as_list, _date_names
+
+
+QUERY_COLUMNS = ["Trading_Date", "Trading_Period", "Reserve_Type",
+                 "Island_Name"]
+
+# The columns identifying the fan of a single station
+STATION_COLUMNS = ["Node", "Trading_Period_ID", "Reserve_Type"]
+
+
+class DispatchQuery(object):
+    """ Energy and reserve which may be jointly dispatched below given
+    energy and reserve prices, for every group of a fan.
+
+    Parameters:
+    -----------
+    fan: DataFrame of generated fan data or a FanIndex of one, each station
+         fan must be in the order generated, see generate.create_fan
+    by: Optional, the columns to group the fan by, defaults to
+        QUERY_COLUMNS. Add "Node" for station level answers, Reserve_Type
+        must be included as reserve types may not be added together.
+
+    Usage:
+    ------
+    >>> query = DispatchQuery(fan)
+    >>> groups = query.select(Island_Name="NI", Reserve_Type="FIR")
+    >>> energy, reserve = query.dispatch([50., 100.], [5., 5.],
+    ...                                  groups=groups.index)
+
+    """
+
+    def __init__(self, fan, by=None):
+        if isinstance(fan, FanIndex):
+            fan = fan.fan
+
+        by = list(by or QUERY_COLUMNS)
+        if "Reserve_Type" not in by:
+            raise ValueError("by must include Reserve_Type, the reserve of "
+                             "different reserve types can't be added")
+        self.by = by
+
+        codes, groups = _factorize(fan, by)
+        self.groups = groups
+
+        il = (np.asarray(fan["Product_Type"]) == "IL" if "Product_Type" in
+              fan.columns else np.zeros(len(fan), dtype=bool))
+
+        runs = _price_runs(fan, ~il)
+        energy_price, reserve_price, energy_delta, reserve_delta = runs[1:]
+        rows = runs[0]
+
+        # Interruptible load is added whatever the energy price
+        il_rows = np.flatnonzero(il)
+        group = np.concatenate((codes[rows], codes[il_rows]))
+        energy_price = np.concatenate((energy_price,
+                                       np.repeat(-np.inf, len(il_rows))))
+        reserve_price = np.concatenate((reserve_price, fan["Reserve Price"]
+                                        .values[il_rows].astype(float)))
+        energy_delta = np.concatenate((energy_delta, np.zeros(len(il_rows))))
+        reserve_delta = np.concatenate((reserve_delta, fan[
+            "Incremental Reserve Quantity"].values[il_rows].astype(float)))
+
+        count = len(groups)
+        self.energy_prices, energy_offsets, energy_index = _price_grid(
+                                                group, energy_price, count)
+        self.reserve_prices, reserve_offsets, reserve_index = _price_grid(
+                                                group, reserve_price, count)
+        self.energy_offsets = energy_offsets
+        self.reserve_offsets = reserve_offsets
+
+        # Each group has an energy price by reserve price table
+        widths = np.diff(reserve_offsets)
+        sizes = np.diff(energy_offsets) * widths
+        self.table_offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+        self.energy = np.zeros(energy_offsets[-1])
+        np.add.at(self.energy, energy_offsets[group] + energy_index,
+                  energy_delta)
+
+        self.reserve = np.zeros(self.table_offsets[-1])
+        np.add.at(self.reserve, self.table_offsets[group] + energy_index *
+                  widths[group] + reserve_index, reserve_delta)
+
+        for i in xrange(count):
+            energy = self.energy[energy_offsets[i]:energy_offsets[i + 1]]
+            np.cumsum(energy, out=energy)
+
+            reserve = self._table(i)
+            np.cumsum(reserve, axis=0, out=reserve)
+            np.cumsum(reserve, axis=1, out=reserve)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def select(self, **filters):
+        """ The rows of the groups table matching the filters, e.g.
+        Island_Name="NI", the index of each row is its group number. Trading
+        dates may be given in any form date_name accepts.
+        """
+        if "Trading_Date" in filters:
+            filters["Trading_Date"] = [date_name(x) for x in
+                                       _as_list(filters["Trading_Date"])]
+        return select_rows(self.groups, filters)
+
+    def dispatch(self, energy_prices, reserve_prices, groups=None):
+        """ The energy and reserve which may be dispatched for each pair of
+        energy and reserve prices in each group.
+
+        Parameters:
+        -----------
+        energy_prices: Array of energy prices
+        reserve_prices: Array of reserve prices, one for each energy price
+        groups: Optional, the group numbers to answer for, see select,
+                defaults to every group.
+
+        Returns:
+        --------
+        energy: Array of shape (groups, prices) of the energy offered at or
+                below each energy price
+        reserve: Array of shape (groups, prices) of the reserve offered at or
+                 below each reserve price while dispatching that energy
+
+        """
+        energy_prices, reserve_prices = np.broadcast_arrays(
+            np.asarray(energy_prices, dtype=float),
+            np.asarray(reserve_prices, dtype=float))
+        energy_prices = energy_prices.ravel()
+        reserve_prices = reserve_prices.ravel()
+
+        if groups is None:
+            groups = np.arange(len(self.groups))
+        groups = np.asarray(groups, dtype=int).ravel()
+
+        e, r = self.energy_offsets, self.reserve_offsets
+        energy = np.zeros((len(groups), len(energy_prices)))
+        reserve = np.zeros((len(groups), len(energy_prices)))
+        for row, i in enumerate(groups):
+            energy_grid = self.energy_prices[e[i]:e[i + 1]]
+            reserve_grid = self.reserve_prices[r[i]:r[i + 1]]
+
+            # The grids start at -inf so every price finds a step
+            ei = np.searchsorted(energy_grid, energy_prices, side="right") - 1
+            ri = np.searchsorted(reserve_grid, reserve_prices,
+                                 side="right") - 1
+
+            energy[row] = self.energy[e[i]:e[i + 1]][ei]
+            reserve[row] = self._table(i)[ei, ri]
+
+        return energy, reserve
+
+    def _table(self, i):
+        """ The reserve table of group i, a view onto the flat array """
+        return self.reserve[self.table_offsets[i]:
+                            self.table_offsets[i + 1]].reshape(
+                                self.energy_offsets[i + 1] -
+                                self.energy_offsets[i],
+                                self.reserve_offsets[i + 1] -
+                                self.reserve_offsets[i])
+
+
+def _factorize(fan, columns, rows=None):
+    """ Number the distinct combinations of the columns, optionally only
+    over some of the rows. Trading dates are named as in the fan store, e.g.
+    "20131212".
+
+    Returns:
+    --------
+    codes: The number of the combination of each row, the combinations are
+           numbered in sorted order
+    table: DataFrame of the combinations, in order of their number
+    """
+    values = [_date_names(fan[x]) if x == "Trading_Date" else
+              np.asarray(fan[x]) for x in columns]
+    if rows is not None:
+        values = [x[rows] for x in values]
+
+    count = len(values[0]) if values else 0
+    if count == 0:
+        return np.zeros(0, dtype=int), pd.DataFrame(columns=columns)
+
+    codes = np.zeros(count, dtype=np.int64)
+    for each in values:
+        part, uniques = pd.factorize(each, sort=True)
+        codes = codes * len(uniques) + part
+    codes, combinations = pd.factorize(codes, sort=True)
+
+    # The first row of each combination names it
+    order = np.argsort(codes, kind="mergesort")
+    first = order[np.searchsorted(codes[order], np.arange(len(combinations)))]
+    table = pd.DataFrame(dict((column, each[first]) for column, each in
+                              zip(columns, values)), columns=columns)
+    return codes, table
+
+
+def _price_runs(fan, mask):
+    """ The steps of every band of every station fan in the masked rows.
+
+    The energy price is ascending along each band, the band is at the last
+    row of each energy price once that price is reached. Each step is the
+    change in the reserve of the band, and for the first band of each
+    station fan the change in its energy, from the step before it.
+
+    Returns:
+    --------
+    rows: The last row of each step
+    energy_price: The energy price of each step
+    reserve_price: The reserve price of the band of each step
+    energy_delta: The change in the energy of each step
+    reserve_delta: The change in the reserve of each step
+    """
+    rows = np.flatnonzero(mask)
+    empty = np.zeros(0)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=int), empty, empty, empty, empty
+
+    prices = fan["Energy Price"].values[rows].astype(float)
+    energy = fan["Cumulative Energy Quantity"].values[rows].astype(float)
+    reserve = fan["Cumulative Reserve Quantity"].values[rows].astype(float)
+    stations = _factorize(fan, STATION_COLUMNS, rows)[0]
+
+    # Every band begins with a row of zero energy
+    starts = (energy == 0) | np.concatenate(([True], stations[1:] !=
+                                             stations[:-1]))
+    band = np.cumsum(starts) - 1
+    first_band = np.concatenate(([True], stations[starts][1:] !=
+                                 stations[starts][:-1]))[band]
+
+    ends = np.ones(len(rows), dtype=bool)
+    ends[:-1] = starts[1:] | (prices[1:] != prices[:-1])
+    steps = np.flatnonzero(ends)
+
+    # The change from the previous step of the same band
+    previous = np.concatenate(([False], band[steps][1:] ==
+                               band[steps][:-1]))
+    reserve_delta = np.diff(np.concatenate(([0.], reserve[steps])))
+    reserve_delta[~previous] = reserve[steps][~previous]
+    energy_delta = np.diff(np.concatenate(([0.], energy[steps])))
+    energy_delta[~previous] = energy[steps][~previous]
+    energy_delta[~first_band[steps]] = 0.
+
+    return (rows[steps], prices[steps],
+            fan["Reserve Price"].values[rows[steps]].astype(float),
+            energy_delta, reserve_delta)
+
+
+def _price_grid(group, prices, count):
+    """ The sorted distinct prices of each group preceded by -inf, held
+    flat with offsets, and the position of each price within the grid of
+    its group. Prices of -inf are placed at the start of the grid.
+    """
+    index = np.zeros(len(prices), dtype=int)
+    finite = np.flatnonzero(prices > -np.inf)
+
+    order = finite[np.lexsort((prices[finite], group[finite]))]
+    sorted_group, sorted_price = group[order], prices[order]
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = ((sorted_group[1:] != sorted_group[:-1]) |
+                    (sorted_price[1:] != sorted_price[:-1]))
+
+    # The distinct prices in (group, price) order, each group is preceded by
+    # its -inf so the k-th distinct price of group g is at k + g + 1
+    sizes = np.bincount(sorted_group[distinct], minlength=count) + 1
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    grid = np.empty(offsets[-1])
+    grid[offsets[:-1]] = -np.inf
+
+    rank = np.cumsum(distinct) - 1
+    position = rank + sorted_group + 1
+    grid[position[distinct]] = sorted_price[distinct]
+    index[order] = position - offsets[sorted_group]
+
+    return grid, offsets, index
@@ -0,0 +1,96 @@
+""" Destinations for generated fan data.
+
+A sink is written to one piece of a fan at a time, e.g. each trading period
+as it is generated by generate.iter_fans, and closed once the fan is
+complete. This lets fans covering long date ranges be saved without ever
+holding the whole fan in memory.
+
+Every sink has the same two methods:
+
+    sink.write(fan)  Save a DataFrame of fan data
+    sink.close()     Finish writing, no more data will be written
+
+"""
+
+from store import write_fan_store, FILE_FORMATS
+
+
+def fan_sink(fName, file_format="csv", break_tp=False):
+    """ Create the sink used by create_fan to save a fan.
+
+    Parameters:
+    -----------
+    fName: The csv file, or the directory of the fan store for binary
+           formats, to write to
+    file_format: Optional, "csv" (the default), "parquet" or "feather"
+    break_tp: Optional, write a separate csv file for each trading period
+
+    Returns:
+    --------
+    sink: A CsvSink or StoreSink
+
+    """
+    if file_format == "csv":
+        return CsvSink(fName, break_tp=break_tp)
+    return StoreSink(fName, file_format=file_format)
+
+
+class CsvSink(object):
+    """ Write fan data to a single csv file, or one csv file per trading
+    period named after the Trading_Period_ID, e.g. fan_12/12/2013_01.csv
+    for break_tp with a fName of fan.csv.
+    """
+
+    def __init__(self, fName, break_tp=False):
+        self.fName = fName
+        self.break_tp = break_tp
+        self.files = []
+
+    def write(self, fan):
+        if len(fan) == 0:
+            return
+
+        if not self.break_tp:
+            self._append(fan, self.fName)
+            return
+
+        periods = fan.groupby("Trading_Period_ID", sort=False).indices
+        for each, locations in periods.iteritems():
+            if len(locations) == 0:
+                continue
+            new_ext = '_' + str(each) + '.csv'
+            self._append(fan.iloc[locations],
+                         self.fName.replace('.csv', new_ext))
+
+    def close(self):
+        pass
+
+    def _append(self, fan, fName):
+        # The first piece written to a file replaces it and adds the header
+        if fName in self.files:
+            fan.to_csv(fName, mode="a", header=False, index=False)
+        else:
+            fan.to_csv(fName, header=True, index=False)
+            self.files.append(fName)
+
+
+class StoreSink(object):
+    """ Write fan data to a partitioned fan store, see store.write_fan_store
+    """
+
+    def __init__(self, path, file_format="parquet"):
+        if file_format not in FILE_FORMATS:
+            raise ValueError("file_format must be one of %s, you passed %s" %
+                             (sorted(FILE_FORMATS.keys()), file_format))
+        self.path = path
+        self.file_format = file_format
+        self.files = []
+
+    def write(self, fan):
+        if len(fan) == 0:
+            return
+        self.files.extend(write_fan_store(fan, self.path,
+                                          file_format=self.file_format))
+
+    def close(self):
+        pass
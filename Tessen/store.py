@@ -0,0 +1,215 @@
+""" Binary storage of generated fan data.
+
+The fans are written to a directory partitioned by trading date and trading
+period, one file per partition, e.g.
+
+    store/Trading_Date=20131212/Trading_Period=01/fan.parquet
+
+This lets a single trading period be read back without parsing the rest of
+the day. Parquet and Feather files are written with pyarrow, which is only
+required when a store is actually used.
+
+"""
+
+import os
+import glob
+import datetime
+
+import pandas as pd
+import numpy as np
+from dateutil.parser import parse
+
+
+PARTITION_COLUMNS = ["Trading_Date", "Trading_Period"]
+
+# The rows of a partition replaced by a fan merged into it, see
+# write_fan_store
+MERGE_COLUMNS = ["Node", "Reserve_Type"]
+FILE_FORMATS = {"parquet": "fan.parquet", "feather": "fan.feather"}
+
+
+def write_fan_store(fan, path, file_format="parquet", merge=True):
+    """ Write a fan to a partitioned store in a single pass over the data.
+
+    A fan may only hold some of the stations of its trading periods, e.g.
+    when create_fan was filtered to a single station. By default the fan is
+    merged into any partitions already in the store, replacing the rows of
+    each station and reserve type in the fan and keeping those of every
+    other station. A station withdrawn since the partition was written is
+    therefore kept, see incremental.update_fan_store to remove them.
+
+    Parameters:
+    -----------
+    fan: DataFrame of generated fan data, see generate.create_fan
+    path: Directory to write the store to, created if necessary
+    file_format: Either "parquet" or "feather"
+    merge: Optional, merge into the existing partitions by MERGE_COLUMNS,
+           when False each partition in the fan replaces the stored one.
+
+    Returns:
+    --------
+    files: List of the files written
+
+    """
+    _check_format(file_format)
+
+    files = []
+    partitions = fan.groupby(PARTITION_COLUMNS, sort=True).indices
+    for (date, period), locations in sorted(partitions.items()):
+        if len(locations) == 0:
+            continue
+
+        directory = partition_path(path, date, period)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fName = os.path.join(directory, FILE_FORMATS[file_format])
+        data = fan.iloc[locations]
+        if merge and os.path.exists(fName):
+            data = _merge_partition(_read_partition(fName), data)
+        _write_partition(data, fName, file_format)
+        files.append(fName)
+
+    return files
+
+
+def read_fan_store(path, filters=None, columns=None):
+    """ Read fan data from a partitioned store. Filters on the trading date
+    and trading period are pushed down to the partitions so only the
+    matching files are read, any other filters are applied afterwards.
+
+    Parameters:
+    -----------
+    path: Directory containing the store
+    filters: Optional, dictionary of column to value (or list of values)
+             filters, as used by OfferPandas efilter
+    columns: Optional, the columns to read
+
+    Returns:
+    --------
+    DataFrame: The fan data matching the filters
+
+    """
+    filters = dict(filters) if filters else {}
+
+    files = partition_files(path, dates=filters.pop("Trading_Date", None),
+                            periods=filters.pop("Trading_Period", None))
+    if len(files) == 0:
+        raise ValueError("No fan data matching %s was found in %s" % (
+                         filters, path))
+
+    fan = pd.concat([_read_partition(f, columns) for f in files],
+                    ignore_index=True)
+
+    return select_rows(fan, filters)
+
+
+def partition_files(path, dates=None, periods=None):
+    """ List the partition files within a store, optionally only those
+    belonging to particular trading dates and periods.
+    """
+    date_parts = ["*"] if dates is None else [date_name(d) for d in
+                                               _as_list(dates)]
+    period_parts = ["*"] if periods is None else [period_name(p) for p in
+                                                   _as_list(periods)]
+
+    files = []
+    for date_part in date_parts:
+        for period_part in period_parts:
+            pattern = os.path.join(path, "Trading_Date=%s" % date_part,
+                                   "Trading_Period=%s" % period_part, "fan.*")
+            files.extend(sorted(glob.glob(pattern)))
+
+    return files
+
+
+def partition_path(path, date, period):
+    """ The directory of a single trading date and period within a store
+    """
+    return os.path.join(path, "Trading_Date=%s" % date_name(date),
+                        "Trading_Period=%s" % period_name(period))
+
+
+def date_name(date):
+    """ The name of a trading date within a store, e.g. 20131212. Dates may
+    be given as dates, in the dd/mm/YYYY form of the offers or year first,
+    e.g. 2013-12-05 or 20131205.
+    """
+    if isinstance(date, np.datetime64):
+        date = pd.Timestamp(date)
+
+    if not isinstance(date, (datetime.date, datetime.datetime)):
+        text = str(date).strip()
+        date = parse(text, dayfirst=not text[:4].isdigit())
+    return date.strftime("%Y%m%d")
+
+
+def _date_names(dates):
+    """ The trading dates named as in the fan store, each distinct date is
+    only parsed once.
+    """
+    codes, uniques = pd.factorize(np.asarray(dates))
+    names = np.array([date_name(x) for x in uniques], dtype=object)
+    return names[codes].astype(str) if len(names) else np.zeros(0, dtype=str)
+
+
+def period_name(period):
+    """ The name of a trading period within a store, e.g. 01
+    """
+    return "%02d" % int(period)
+
+
+def select_rows(data, filters):
+    """ The rows of a DataFrame matching a dictionary of column to value (or
+    list of values) filters, as used by OfferPandas efilter.
+    """
+    for key, value in filters.iteritems():
+        if isinstance(value, (list, tuple, set, np.ndarray)):
+            data = data[data[key].isin(list(value))]
+        else:
+            data = data[data[key] == value]
+    return data
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        return list(value)
+    return [value]
+
+
+def _merge_partition(existing, fan):
+    """ The rows of an existing partition of the stations and reserve types
+    which are not in the fan, followed by the fan.
+    """
+    keys = [pd.MultiIndex.from_arrays([data[x].astype(str) for x in
+                                       MERGE_COLUMNS]) for data in
+            (existing, fan)]
+    kept = existing[~keys[0].isin(keys[1].unique())]
+    return pd.concat([kept, fan], ignore_index=True)
+
+
+def _check_format(file_format):
+    if file_format not in FILE_FORMATS:
+        raise ValueError("file_format must be one of %s, you passed %s" % (
+                         sorted(FILE_FORMATS.keys()), file_format))
+
+
+def _write_partition(data, fName, file_format):
+    data = data.reset_index(drop=True)
+    if file_format == "feather":
+        import pyarrow.feather as feather
+        feather.write_feather(data, fName)
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pandas(data, preserve_index=False),
+                       fName)
+
+
+def _read_partition(fName, columns=None):
+    if fName.endswith(".feather"):
+        import pyarrow.feather as feather
+        return feather.read_feather(fName, columns=columns)
+
+    import pyarrow.parquet as pq
+    return pq.read_table(fName, columns=columns).to_pandas()
@@ -2,7 +2,8 @@
 data which has already been produced.
 
 Intended to separate the two so that an interactive JS version of this plot
-could be produced at some point.
+could be produced at some point, see export.export_tiles for the data such
+a version would draw.
 
 """
 import numpy as np
@@ -10,41 +11,49 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import matplotlib.cm as cm
+from matplotlib.collections import PolyCollection
+from matplotlib.lines import Line2D
 from OfferPandas import Frame
 import simplejson as json
 import os
-import Tessen
-from collections import defaultdict
 import datetime
 
+from store import read_fan_store
+from fan_index import FanIndex
+from cache import aggregate_key
+from aggregate import reserve_contours
 
-# Apply some nicer plotting options to improve the visualisation.
-path = os.path.join(Tessen.__path__[0], "_static/plot_options.json")
-with open(path) as f:
-    mplconfig = json.load(f)
 
-for key, value in mplconfig.iteritems():
-    mpl.rcParams[key] = value
+# Some nicer plotting options to improve the visualisation, these are read
+# when first needed and only applied while a fan is being drawn.
+path = os.path.join(os.path.dirname(__file__), "_static/plot_options.json")
+mplconfig = None
 
 # Colours from Olga Prettyplotlib
 # https://github.com/olgabot/prettyplotlib/
 almost_black = "#262625"
 light_grey = np.array([float(248) / float(255)] * 3)
 
+# The most energy prices listed in the legend of a plot, beyond this the
+# legend would take longer to draw than the fan and run off the figure.
+LEGEND_PRICES = 60
 
 def plot_fan(data, filters=None, fName=None, reserve_prices=None,
              energy_prices=None, reserve_colour=cm.Blues,
              energy_colour=cm.YlOrRd, set_xlim=None, set_ylim=None,
              energy_cleared=None, reserve_cleared=None,
-             fixed_colours=False, ilmap=None, verbose=False):
+             fixed_colours=False, ilmap=None, verbose=False,
+             cache=None):
     """ Plot the Fan Curve. This is the publically exposed entry point to the
-    visualisation. Data is supplied either as a DataFrame, or alternatively
-    as a path for a csv file. This is then filtered and the resulting plot
-    created.
+    visualisation. Data is supplied either as a DataFrame, a FanIndex, or
+    alternatively as a path for a csv file or fan store directory. This is
+    then filtered and the resulting plot created.
 
     Parameters:
     -----------
-    data: Pandas DataFrame or CSV path string of generated fan data
+    data: Pandas DataFrame, FanIndex, CSV path string or fan store directory
+          of generated fan data, only the partitions matching the filters
+          are read from a fan store and a FanIndex is sliced directly.
     filters: Filters to apply to the data, optional, depends upon the data
              passed as to whether these are necessary.
     fName: Optional - Path to save the generated figure to.
@@ -62,6 +71,11 @@ def plot_fan(data, filters=None, fName=None, reserve_prices=None,
                    spacing, better for assessing differences between periods.
     ilmap: Dictionary mapping il prices to cumulative IL available.
            This must be the cumulative IL stack not the incremental stack.
+           Interruptible load offers within the fan data itself, see
+           generate.create_fan, are always included.
+    cache: Optional, AggregateCache to reuse aggregations from, e.g. when
+           re-plotting the same periods with different styling. Each plot
+           aggregates afresh by default.
 
     Returns:
     --------
@@ -76,41 +90,53 @@ def plot_fan(data, filters=None, fName=None, reserve_prices=None,
         print """ I'm beginning to plot the fan now, I estimate this will
         take me at least %s seconds""" % estimate
 
-    if not isinstance(data, pd.DataFrame):
-        try:
-            data = pd.read_csv(data)
-        except:
-            raise TypeError("""data must be either a pandas DataFrame old_price
-                a string containing the location of a csv file, data is
-                currently of type %s""" % type(date))
+    if isinstance(data, FanIndex):
+        frame = data
+        filtered = data.select(filters)
 
-    # Create the data as an OfferFrame and filter the data.
-    frame = Frame(data)
-    # Manual memory management
-    del data
-
-    if filters:
-        filtered = frame.efilter(filters)
     else:
-        filtered = frame
+        if isinstance(data, basestring) and os.path.isdir(data):
+            data = read_fan_store(data, filters=filters)
+
+        elif not isinstance(data, pd.DataFrame):
+            try:
+                data = pd.read_csv(data)
+            except:
+                raise TypeError("""data must be either a pandas DataFrame old_price
+                    a string containing the location of a csv file, data is
+                    currently of type %s""" % type(data))
+
+        # Create the data as an OfferFrame and filter the data.
+        frame = Frame(data)
+        # Manual memory management
+        del data
+
+        if filters:
+            filtered = frame.efilter(filters)
+        else:
+            filtered = frame
 
     # Check that the output won't be nonsense, e.g. multiple periods, islands
     _check_consistency(filtered)
 
     # Aggregate the data
-    aggregated_data = _aggregate(filtered, price_increments=reserve_prices)
+    aggregated_data = _aggregate(filtered, il_data=ilmap,
+                                 price_increments=reserve_prices,
+                                 cache=cache)
 
     # Generate the Plots
-    fig, axes = _generate_plot(aggregated_data, energy_prices=energy_prices,
-                               energy_colour=energy_colour,
-                               reserve_colour=reserve_colour,
-                               set_xlim=set_xlim, set_ylim=set_ylim,
-                               energy_cleared=energy_cleared,
-                               reserve_cleared=reserve_cleared,
-                               fixed_colours=fixed_colours, ilmap=ilmap)
-
-    if fName:
-        fig.savefig(fName)
+    with mpl.rc_context(rc=plot_options()):
+        fig, axes = _generate_plot(aggregated_data,
+                                   energy_prices=energy_prices,
+                                   energy_colour=energy_colour,
+                                   reserve_colour=reserve_colour,
+                                   set_xlim=set_xlim, set_ylim=set_ylim,
+                                   energy_cleared=energy_cleared,
+                                   reserve_cleared=reserve_cleared,
+                                   fixed_colours=fixed_colours)
+
+        if fName:
+            fig.savefig(fName)
 
     elapsed_time = datetime.datetime.now() - begin_time
     if verbose:
@@ -126,6 +152,22 @@ def plot_fan(data, filters=None, fName=None, reserve_prices=None,
     return fig, axes
 
 
+def plot_options():
+    """ The matplotlib rc settings used when drawing a fan, loaded from
+    _static/plot_options.json the first time they are needed.
+
+    Returns:
+    --------
+    mplconfig: Dictionary of rc parameters for use with mpl.rc_context
+
+    """
+    global mplconfig
+    if mplconfig is None:
+        with open(path) as f:
+            mplconfig = json.load(f)
+    return mplconfig
+
+
 def _check_consistency(filtered):
     """ Perform some basic checks upon the Data to provide some useful
     error messages for the users.
@@ -166,14 +208,20 @@ def _check_consistency(filtered):
     return None
 
 
-def _aggregate(filtered, il_data=None, price_increments=None):
+def _aggregate(filtered, il_data=None, price_increments=None, filters=None,
+               cache=None):
     """ Aggregate the data together once all of the filters have been applied:
     This is the entirety of the 'logic' for this module,
 
     Parameters
     ----------
-    filtered: The filtered data to be aggregated
-    il_data: Optional - Apply the IL stack to the reserve lines as well.
+    filtered: The filtered data to be aggregated, or a FanIndex which is
+              sliced using the filters
+    il_data: Optional - Dictionary of IL prices to the cumulative IL
+             available, added to the reserve lines along with any IL
+             offers in the data.
+    filters: Optional - Filters used to select from a FanIndex
+    cache: Optional - AggregateCache to look the aggregation up in first
 
     Returns:
     --------
@@ -186,85 +234,42 @@ def _aggregate(filtered, il_data=None, price_increments=None):
         to construct the shading and legend for the energy offers.
     """
 
+    if isinstance(filtered, FanIndex):
+        filtered = filtered.select(filters)
+
+    if cache is not None:
+        key = aggregate_key(filtered, price_increments, il_data=il_data)
+        aggregated_data = cache.get(key)
+        if aggregated_data is not None:
+            return aggregated_data
+
     aggregated_data = _construct_reserve_dictionary(filtered,
-                    price_increments=price_increments)
+                    price_increments=price_increments, il_data=il_data)
 
-    if il_data:
-        raise NotImplemented(""" This feature is still to be implemented """)
+    if cache is not None:
+        cache.set(key, aggregated_data)
 
     return aggregated_data
 
 
-def _construct_reserve_dictionary(data, price_increments=None):
-    """ Iterates through either all of the reserve prices or a subset there
-    of for custom views. Will call the _construct_reserve_line function
-    on each reserve price to generate the ascending reserve price
-    contours.
-
-    Parameters
-    ----------
-    data: The fan data
-    price_increments: Optional, array of floats representing prices of
-                       interest, use to specify fewer contours.
+def _construct_reserve_dictionary(data, price_increments=None, il_data=None):
+    """ Generates the ascending reserve price contours for either all of the
+    reserve prices or a subset there of for custom views, see
+    aggregate.reserve_contours.
 
     Returns:
     --------
     reserve_accumulations: Dictionary of reserve_price: x, y pairs for plots.
 
     """
-    if not price_increments:
-        price_increments = data["Reserve Price"].unique()
-
-    reserve_accumulations = {}
-
-    for rp in price_increments:
-        subset = data[data["Reserve Price"] <= rp]
-        reserve_accumulations[rp] = _construct_reserve_line(subset)
-
-    return reserve_accumulations
-
-
-def _construct_reserve_line(data):
-    """ Construct an energy and reserve line pairing and returns the values
-    These should be increased in energy price to illustrate the fan curve
-    trade off behaviour.
-
-    Parameters:
-    -----------
-    data: Data for a single reserve price.
-
-    Returns
-    -------
-    Energy Price: Array of Energy Prices values
-    Energy Line: Cumulative Array of Energy values
-    Reserve Line: Cumulative Array of Reserve values
-    """
-    aggregations = {"Incremental Reserve Quantity": np.sum,
-                    "Incremental Energy Quantity": np.max,
-                    "Energy Price": np.max}
-
-    energy_line = "Incremental Energy Quantity"
-    reserve_line = "Incremental Reserve Quantity"
-
-    group_columns = ["Node", "Cumulative Energy Quantity"]
-
-    sort_columns = ["Energy Price", "Incremental Reserve Quantity"]
-    ascending = [True, False]
-
-    agg = data.groupby(group_columns, as_index=False).aggregate(aggregations)
-    sort_data = agg.sort(columns=sort_columns, ascending=ascending)
-
-    # returns a tuple of two arrays which can be plotted
-    return (sort_data["Energy Price"].values,
-            sort_data[energy_line].cumsum().values,
-            sort_data[reserve_line].cumsum().values)
+    return reserve_contours(data, price_increments=price_increments,
+                            il_data=il_data)
 
 
 def _generate_plot(aggregated_data, reserve_colour=cm.Blues,
                    energy_colour=cm.YlOrRd, energy_prices=None,
                    set_xlim=None, set_ylim=None, energy_cleared=None,
-                   reserve_cleared=None, fixed_colours=False,
-                   ilmap=None):
+                   reserve_cleared=None, fixed_colours=False):
     """ The nitty gritty of generating the plot figure
 
     Parameters:
@@ -280,8 +285,6 @@ def _generate_plot(aggregated_data, reserve_colour=cm.Blues,
     fixed_colours: Default None, Optional Boolean, Will use a tranche based
                    colour scheme for identifying colours instead of a linear
                    spacing, better for assessing differences between periods.
-    ilmap: Dictionary mapping il prices to cumulative IL available.
-           This must be the cumulative IL stack not the incremental stack.
 
     Returns:
     --------
@@ -294,8 +297,7 @@ def _generate_plot(aggregated_data, reserve_colour=cm.Blues,
     # Plot the reserve lines:
     axes, res_legend = _plot_reserve_contours(axes, aggregated_data,
                                               cmap=reserve_colour,
-                                              fixed_colours=fixed_colours,
-                                              ilmap=ilmap)
+                                              fixed_colours=fixed_colours)
 
     # Modify the legends
     res_legend = _legend(res_legend)
@@ -360,7 +362,7 @@ def _generate_plot(aggregated_data, reserve_colour=cm.Blues,
 
 
 def _plot_reserve_contours(axes, reserve_accumulations, cmap=cm.Blues,
-                           fixed_colours=False, ilmap=None):
+                           fixed_colours=False):
     """ Non publically exposed function, this plots the reserve lines in
     ascending fashion. Iterates through each key value pairing in the
     reserve dictionary and plots them in turn.
@@ -373,8 +375,6 @@ def _plot_reserve_contours(axes, reserve_accumulations, cmap=cm.Blues,
     fixed_colours: Default None, Optional Boolean, Will use a tranche based
                    colour scheme for identifying colours instead of a linear
                    spacing, better for assessing differences between periods.
-    ilmap: Dictionary mapping il prices to cumulative IL available.
-           This must be the cumulative IL stack not the incremental stack.
 
     Returns:
     --------
@@ -383,40 +383,18 @@ def _plot_reserve_contours(axes, reserve_accumulations, cmap=cm.Blues,
     """
 
     prices = np.sort(reserve_accumulations.keys())
-    if ilmap:
-        prices = np.unique(np.sort(prices.tolist() + ilmap.keys()))
 
     if fixed_colours:
         tranches = np.array([0, 0.5, 1.0, 5, 10, 25, 50, 75, 100, 300, 500,
                              750, 1000, 2500, 5000])
-        cmapping = cmap(np.linspace(0, 1, len(tranches)))
-        col_dict = {p: c for p, c in zip(tranches, cmapping)}
-        colours = [col_dict[get_low(p, tranches)] for p in prices]
+        colours = _tranche_colours(prices, tranches, cmap)
     else:
         colours = cmap(np.linspace(0, 1, len(prices)))
 
     lines = []
-    #oldline = np.zeros()
     for price, col in zip(prices, colours):
-        # Try and get a new value, may fail due to IL keys
-        # If it fails we use the last values
-        if price in reserve_accumulations.keys():
-            eprice, eline, rline = reserve_accumulations[price]
-        else:
-            rline = oldline
-        # Add IL Values
-        if ilmap:
-            # Save the oldline in case there is a pure IL change
-            # At the next step.
-            oldline = np.array(rline.tolist())
-            # Incase there are key issues wrap it in try loop
-            # This happens when there isn't a 0 prices IL offer.
-            try:
-                iladdition = ilmap[get_low(price, np.array(ilmap.keys()))]
-            except ValueError:
-                iladdition = 0
-            rline += iladdition
-
+        # Any IL has already been added to the lines by _aggregate
+        eprice, eline, rline = reserve_accumulations[price]
         lines.append(axes.plot(eline, rline, label=price, color=col,
                                linewidth=2)[0])
 
@@ -461,67 +439,105 @@ def _plot_energy_shading(axes, all_reserve, prices=None, cmap=cm.YlOrRd,
     if fixed_colours:
         tranches = np.array([0, 10, 25, 50, 75, 100, 150, 300,
                                    500, 750, 1000, 2000, 5000, 10000])
-        cmapping = cmap(np.linspace(0, 1, len(tranches)))
-        col_dict = {p: c for p, c in zip(tranches, cmapping)}
-        colours = [col_dict[get_low(p, tranches)] for p in prices]
+        colours = _tranche_colours(prices, tranches, cmap)
     else:
         colours = cmap(np.linspace(0, 1, len(prices)))
 
-    # Iterate through the prices updating the low price each time
-    # To update the interval
-    low_price = 0
-    lines = []
-    for high_price, c in zip(prices, colours):
-        eline = all_reserve[:,1]
-        rline = _reserve_interval(all_reserve, low_price, high_price)
-        rzeros = np.zeros(len(rline))
-
-        # Set a consistent alpha value
-        alpha=0.8
-        # Plot the shading and a dummy line for the legend.
-        axes.fill_between(eline, rline, rzeros, color=c, alpha=alpha)
-        lines.append(axes.plot([0,0], [0,0], label=high_price, color=c, alpha=alpha)[0])
-        low_price = high_price
+    eline = all_reserve[:,1]
+    rline = all_reserve[:,2]
+    buckets = _price_buckets(all_reserve[:,0], prices)
+    verts, buckets = _shading_polygons(eline, rline, buckets, len(prices))
+
+    # Set a consistent alpha value
+    alpha=0.8
+    # All of the shading is a single collection whatever the number of
+    # prices, with a proxy line for each price in the legend.
+    shading = PolyCollection(verts, facecolors=colours[buckets],
+                             edgecolors=colours[buckets], alpha=alpha)
+    axes.add_collection(shading)
+    axes.autoscale_view()
+    legend_prices = _legend_prices(len(prices))
+    lines = [Line2D([0,0], [0,0], color=c, alpha=alpha) for c in
+             colours[legend_prices]]
 
     # Need a separate legend object in order to ensure we get both
     # Legends, also add a title and units
-    en_legend = axes.legend(lines, list(prices), loc='upper left',
-                            title="Energy Prices\n    [$/MWh]")
+    en_legend = axes.legend(lines, list(prices[legend_prices]),
+                            loc='upper left', title="Energy Prices\n    [$/MWh]")
 
     return axes, en_legend
 
 
-def get_low(x, array):
-    return array[x >= array].max()
+def _legend_prices(count):
+    """ The index of the prices to show in the energy legend, every price
+    unless there are more than LEGEND_PRICES in which case they are evenly
+    spaced from the cheapest to the most expensive.
+    """
+    if count <= LEGEND_PRICES:
+        return np.arange(count)
+    return np.unique(np.linspace(0, count - 1, LEGEND_PRICES).round()
+                     .astype(int))
+
+
+def _price_buckets(energy_prices, prices):
+    """ The index of the price range each point falls within, the ranges are
+    [0, prices[0]] then (prices[i-1], prices[i]]. Points outside of every
+    range are given len(prices).
+    """
+    buckets = np.searchsorted(prices, energy_prices, side="left")
+    buckets[energy_prices < 0] = len(prices)
+    return buckets
 
 
-def _reserve_interval(array, low_price, high_price):
-    """ Masks an array for the energy price contours to return the
-    regions which fall within a given price range.
-    This is used to shade the energy regions of the plot accordingly
+def _shading_polygons(eline, rline, buckets, count):
+    """ The polygons under a reserve line shaded by price. Each point closes
+    the segment which precedes it so each segment takes the price range of
+    the point at its end, consecutive segments of the same range are joined
+    into one polygon down to zero reserve.
 
     Parameters:
     -----------
-    array: A numpy array of energy price, energy line and reserve line values
-    low_price: The minimum price
-    high_price: The maximum price
+    eline: The energy line
+    rline: The reserve line
+    buckets: The price range of each point, see _price_buckets
+    count: The number of price ranges, segments outside of these are not
+           shaded
 
     Returns:
     --------
-    array: A numpy array of the same length as the reserve line. This line
-           has been masked with zeros for non added areas (e.g. depending
-            upon the energy price for those areas.)
+    verts: List of (N, 2) arrays, one per polygon
+    polygon_buckets: Array of the price range of each polygon
+
     """
-    # Quick check for a zero value which is needed to begin the low prices
-    if low_price == 0.0:
-        tlow = array[:,0] >= low_price
-    else:
-        tlow = array[:,0] > low_price
+    segments = buckets[1:]
+    if len(segments) == 0:
+        return [], np.zeros(0, dtype=int)
+
+    starts = np.flatnonzero(np.concatenate(([True],
+                                            segments[1:] != segments[:-1])))
+    stops = np.concatenate((starts[1:], [len(segments)]))
+    shaded = segments[starts] < count
+    starts, stops = starts[shaded], stops[shaded]
+
+    verts = []
+    for start, stop in zip(starts, stops):
+        x = eline[start:stop + 1]
+        y = rline[start:stop + 1]
+        verts.append(np.column_stack((np.concatenate((x, x[::-1])),
+                                      np.concatenate((y, np.zeros(len(y)))))))
+
+    return verts, segments[starts]
+
+
+def _tranche_colours(prices, tranches, cmap):
+    """ The colour of the tranche each price falls within, the tranches are
+    spaced linearly along the colour map. Prices below the first tranche
+    take its colour and prices above the last take the last colour.
+    """
+    cmapping = cmap(np.linspace(0, 1, len(tranches)))
+    index = np.searchsorted(tranches, prices, side="right") - 1
+    return cmapping[np.clip(index, 0, len(tranches) - 1)]
 
-    # note the <= vs < debate is very important here. The colours will be
-    # All wrong if you fuck with these. Don't fuck with these
-    thigh = array[:,0] <= high_price
-    return np.where(tlow & thigh, array[:,2], 0)
 
 def _legend(legend):
     """
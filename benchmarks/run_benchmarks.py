@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Benchmarks of the fan generation and visualisation hot paths.
+
+Every benchmark is driven by the offers of the sample day in sample_data,
+the larger scales repeat the day with shifted trading dates:
+
+    day     The sample day, 12/12/2013
+    week    7 copies of the sample day
+    month   30 copies of the sample day, needs several GB of memory
+
+Each benchmark runs in its own process and records the best time of its
+repeats together with the growth of the peak resident memory of that
+process while it ran. The results may be saved as baselines and later runs
+checked against them, a run fails when any benchmark is slower or uses more
+memory than its baseline allows. The committed baselines.json holds the
+results of a single reference machine, save your own before checking on a
+different one.
+
+Usage:
+------
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --save
+    python benchmarks/run_benchmarks.py --check --tolerance 0.5
+    python benchmarks/run_benchmarks.py --scales day,week,month
+
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import multiprocessing
+
+import pandas as pd
+import numpy as np
+import simplejson as json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_DATA = os.path.join(ROOT, "sample_data")
+ENERGY_FILE = os.path.join(SAMPLE_DATA, "offers20131212.csv")
+RESERVE_FILE = os.path.join(SAMPLE_DATA, "generatorreserves20131212.csv")
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "baselines.json")
+
+# The number of copies of the sample day in each scale
+SCALES = {"day": 1, "week": 7, "month": 30}
+DEFAULT_SCALES = ["day", "week"]
+
+# Candidate representations of a date within a Trading_Period_ID
+DATE_FORMATS = ["%d/%m/%Y", "%Y%m%d", "%Y-%m-%d", "%d-%m-%Y"]
+
+
+def load_sample(days=1):
+    """ Load the energy and PLSR reserve offers of the sample day, repeated
+    for the number of days with the trading dates shifted a day at a time.
+
+    Returns:
+    --------
+    energy, reserve: OfferFrames of the offers
+    """
+    from OfferPandas import Frame, load_offerframe
+
+    energy = load_offerframe(ENERGY_FILE)
+    reserve = load_offerframe(RESERVE_FILE)
+    reserve = reserve[reserve["Product_Type"] == "PLSR"]
+
+    if days > 1:
+        energy = pd.concat([shift_days(energy, x) for x in range(days)],
+                           ignore_index=True)
+        reserve = pd.concat([shift_days(reserve, x) for x in range(days)],
+                            ignore_index=True)
+
+    return Frame(energy), Frame(reserve)
+
+
+def shift_days(frame, days):
+    """ Copy of the offers with the Trading_Date, and the date within the
+    Trading_Period_ID, moved forward by a number of days.
+    """
+    frame = frame.copy()
+    if days == 0:
+        return frame
+
+    dates = pd.to_datetime(frame["Trading_Date"], dayfirst=True)
+    shifted = pd.Series(dates.values + np.timedelta64(days, "D"),
+                        index=frame.index)
+
+    # Only the distinct trading periods need their identifier rewritten
+    pairs = pd.DataFrame({"tpid": frame["Trading_Period_ID"].astype(str),
+                          "old": dates, "new": shifted}).drop_duplicates(
+                          "tpid")
+    names = {}
+    for tpid, old, new in pairs[["tpid", "old", "new"]].values.tolist():
+        names[tpid] = "%s_%s" % (tpid, days)
+        for date_format in DATE_FORMATS:
+            old_name = pd.Timestamp(old).strftime(date_format)
+            if old_name in tpid:
+                names[tpid] = tpid.replace(old_name, pd.Timestamp(
+                                           new).strftime(date_format))
+                break
+
+    frame["Trading_Period_ID"] = frame["Trading_Period_ID"].astype(str).map(
+                                                                    names)
+    if np.issubdtype(frame["Trading_Date"].dtype, np.datetime64):
+        frame["Trading_Date"] = shifted
+    else:
+        frame["Trading_Date"] = shifted.dt.strftime("%d/%m/%Y")
+
+    return frame
+
+
+def setup_energy_stack(days):
+    """ The price and quantity pairs of every station and trading period """
+    from Tessen.generate import incremental_energy_stack
+
+    energy, reserve = load_sample(days)
+    energy = energy[energy["Quantity"] > 0]
+    groups = energy.groupby(["Node", "Trading_Period_ID"], sort=False)
+    pairs = [x[["Price", "Quantity"]].values for key, x in groups]
+
+    def run():
+        for each in pairs:
+            incremental_energy_stack(each)
+    return run
+
+
+def setup_station_fan(days):
+    """ The offers of every station in the first trading period of each day
+    """
+    from Tessen.generate import station_fan
+
+    energy, reserve = _first_periods(*load_sample(days))
+    reserve_groups = reserve.groupby(["Node", "Trading_Period_ID",
+                                      "Reserve_Type"], sort=False).indices
+    empty = reserve.iloc[:0]
+
+    offers = []
+    for (node, tpid), locations in energy.groupby(
+            ["Node", "Trading_Period_ID"], sort=False).indices.iteritems():
+        for reserve_type in ("FIR", "SIR"):
+            reserve_locations = reserve_groups.get((node, tpid, reserve_type))
+            offers.append((energy.iloc[locations], reserve_type,
+                           empty if reserve_locations is None else
+                           reserve.iloc[reserve_locations]))
+
+    def run():
+        for single_energy, reserve_type, single_reserve in offers:
+            station_fan(single_energy, single_reserve,
+                        assumed_reserve=reserve_type)
+    return run
+
+
+def setup_create_fan(days):
+    """ All of the offers of the scale """
+    from Tessen.generate import _create_fan
+
+    energy, reserve = load_sample(days)
+
+    def run():
+        _create_fan(energy, reserve)
+    return run
+
+
+def setup_reserve_dictionary(days):
+    """ Every trading period, reserve type and island slice of the fan of
+    the first day
+    """
+    from Tessen.generate import _create_fan
+    from Tessen.fan_index import FanIndex
+    from Tessen.visualise import _construct_reserve_dictionary
+
+    energy, reserve = load_sample(1)
+    index = FanIndex(_create_fan(energy, reserve))
+    slices = [index.get(*key) for key in index.keys()]
+
+    def run():
+        for data in slices:
+            _construct_reserve_dictionary(data)
+    return run
+
+
+def setup_plot_fan(days):
+    """ The fan of the first trading period of each day, both reserve types
+    and islands, plotted without the aggregation cache
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from Tessen.generate import _create_fan
+    from Tessen.fan_index import FanIndex
+    from Tessen.visualise import plot_fan
+
+    energy, reserve = _first_periods(*load_sample(days))
+    index = FanIndex(_create_fan(energy, reserve))
+    keys = list(index.keys())
+
+    def run():
+        for date, period, reserve_type, island in keys:
+            fig, axes = plot_fan(index, filters={
+                "Trading_Date": date, "Trading_Period": period,
+                "Reserve_Type": reserve_type, "Island_Name": island},
+                cache=None)
+            plt.close(fig)
+    return run
+
+
+def setup_bulk_run(days):
+    """ The bulk mode from the offer files of each day, through a parquet
+    fan store, to the plot of the FIR fan of every trading period
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from Tessen.bulk_operation import bulk_run
+
+    path = tempfile.mkdtemp()
+    dates = []
+    for day in range(days):
+        for name in ("offers", "generatorreserves"):
+            offers = pd.read_csv(os.path.join(SAMPLE_DATA, "%s20131212.csv" %
+                                              name), dtype=str)
+            date = pd.Timestamp("2013-12-12") + pd.Timedelta(days=day)
+            offers["Trading_Date"] = date.strftime("%d/%m/%Y")
+            directory = os.path.join(path, name)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            offers.to_csv(os.path.join(directory, "%s%s.csv" % (
+                          name, date.strftime("%Y%m%d"))), index=False)
+        dates.append(date.strftime("%d/%m/%Y"))
+
+    def run():
+        output = tempfile.mkdtemp(dir=path)
+        try:
+            bulk_run(dates, output, os.path.join(output, "fan.csv"),
+                     os.path.join(path, "offers"),
+                     os.path.join(path, "generatorreserves"),
+                     fan_store=os.path.join(output, "store"))
+        finally:
+            shutil.rmtree(output)
+    run.cleanup = lambda: shutil.rmtree(path)
+    return run
+
+
+def _first_periods(energy, reserve):
+    """ The offers of the first trading period of each day """
+    first = energy.drop_duplicates("Trading_Date")["Trading_Period_ID"]
+    return (energy[energy["Trading_Period_ID"].isin(first)],
+            reserve[reserve["Trading_Period_ID"].isin(first)])
+
+
+# Name, setup function, the scales it is run at and the number of repeats
+BENCHMARKS = [
+    ("incremental_energy_stack", setup_energy_stack, ["day", "week"], 3),
+    ("station_fan", setup_station_fan, ["day", "week"], 3),
+    ("_create_fan", setup_create_fan, ["day", "week", "month"], 1),
+    ("_construct_reserve_dictionary", setup_reserve_dictionary, ["day"], 3),
+    ("plot_fan", setup_plot_fan, ["day"], 3),
+    ("bulk_run", setup_bulk_run, ["day"], 1),
+]
+
+
+def run_benchmark(case):
+    """ Set up and time a single benchmark, run in a fresh process so that
+    the memory of one benchmark does not hide that of another.
+
+    Returns:
+    --------
+    result: Dictionary of the best "seconds" of the repeats and the growth in
+            the peak resident memory, "memory_mb", while they ran
+    """
+    name, scale, repeat = case
+    setup = dict((x[0], x[1]) for x in BENCHMARKS)[name]
+    run = setup(SCALES[scale])
+
+    _reset_peak_memory()
+    before, peak = _memory_usage()
+    times = []
+    try:
+        for x in range(repeat):
+            begin = time.time()
+            run()
+            times.append(time.time() - begin)
+    finally:
+        # Any files the setup left behind
+        if hasattr(run, "cleanup"):
+            run.cleanup()
+
+    current, peak = _memory_usage()
+    return {"seconds": min(times), "memory_mb": max(peak - before, 0.)}
+
+
+def _reset_peak_memory():
+    """ Reset the peak resident memory of this process so the memory used
+    while setting up a benchmark is not counted, only possible on Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        pass
+
+
+def _memory_usage():
+    """ The current and peak resident memory of this process in MB, where
+    the current memory is unavailable the peak is returned for both.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return (float(status["VmRSS"].split()[0]) / 1024.,
+                float(status["VmHWM"].split()[0]) / 1024.)
+    except (IOError, OSError, KeyError):
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    if sys.platform == "darwin":
+        peak /= 1024. ** 2
+    else:
+        peak /= 1024.
+    return peak, peak
+
+
+def run_benchmarks(scales=None, names=None):
+    """ Run each benchmark at each of the scales
+
+    Parameters:
+    -----------
+    scales: Optional, list of the scales to run, defaults to DEFAULT_SCALES
+    names: Optional, list of the benchmarks to run, defaults to all of them
+
+    Returns:
+    --------
+    results: Dictionary of "name[scale]" to its result, see run_benchmark
+    """
+    scales = scales or DEFAULT_SCALES
+    cases = [(name, scale, repeat) for name, setup, sizes, repeat in
+             BENCHMARKS for scale in sizes if scale in scales and
+             (not names or name in names)]
+
+    results = {}
+    for case in cases:
+        pool = multiprocessing.Pool(1, maxtasksperchild=1)
+        try:
+            result = pool.apply(run_benchmark, (case,))
+        finally:
+            pool.close()
+            pool.join()
+
+        key = "%s[%s]" % case[:2]
+        results[key] = result
+        print "%-40s %10.3f s %10.1f MB" % (key, result["seconds"],
+                                           result["memory_mb"])
+        sys.stdout.flush()
+
+    return results
+
+
+def check_results(results, baselines, tolerance=0.25, memory_tolerance=0.25):
+    """ Compare results against their baselines
+
+    Parameters:
+    -----------
+    results: Dictionary of benchmark results, see run_benchmarks
+    baselines: Dictionary of saved results
+    tolerance: Optional, the fraction by which a benchmark may be slower
+    memory_tolerance: Optional, the fraction by which a benchmark may use
+                      more memory, differences of less than 1 MB are ignored
+
+    Returns:
+    --------
+    failures: List of messages describing each regression
+    """
+    failures = []
+    for key in sorted(results):
+        if key not in baselines:
+            continue
+        result, baseline = results[key], baselines[key]
+
+        allowed = baseline["seconds"] * (1. + tolerance)
+        if result["seconds"] > allowed:
+            failures.append("%s took %.3f s, the baseline allows %.3f s" % (
+                            key, result["seconds"], allowed))
+
+        allowed = max(baseline["memory_mb"] * (1. + memory_tolerance),
+                      baseline["memory_mb"] + 1.)
+        if result["memory_mb"] > allowed:
+            failures.append("%s used %.1f MB, the baseline allows %.1f MB" % (
+                            key, result["memory_mb"], allowed))
+
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scales", default=",".join(DEFAULT_SCALES),
+                        help="Comma separated scales to run, from %s" %
+                        ", ".join(sorted(SCALES, key=SCALES.get)))
+    parser.add_argument("--benchmarks", default="",
+                        help="Comma separated benchmarks to run, all of them "
+                        "by default")
+    parser.add_argument("--baselines", default=BASELINE_FILE,
+                        help="The baseline file")
+    parser.add_argument("--save", action="store_true",
+                        help="Save the results as the new baselines")
+    parser.add_argument("--check", action="store_true",
+                        help="Fail if the results regress from the baselines")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Fraction by which a benchmark may be slower")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25,
+                        help="Fraction by which a benchmark may use more "
+                        "memory")
+    args = parser.parse_args(argv)
+
+    scales = [x for x in args.scales.split(",") if x]
+    unknown = [x for x in scales if x not in SCALES]
+    if unknown:
+        parser.error("Unknown scales %s" % ", ".join(unknown))
+    names = [x for x in args.benchmarks.split(",") if x]
+
+    results = run_benchmarks(scales=scales, names=names)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+        print "Saved the baselines to %s" % args.baselines
+
+    if args.check:
+        if not baselines:
+            print "There are no baselines in %s to check against" % (
+                args.baselines)
+            return 1
+
+        missing = sorted(set(results) - set(baselines))
+        if missing:
+            print "No baselines for %s" % ", ".join(missing)
+
+        failures = check_results(results, baselines, args.tolerance,
+                                 args.memory_tolerance)
+        for failure in failures:
+            print "REGRESSION: %s" % failure
+        if failures:
+            return 1
+        print "No regressions against the baselines"
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Tessen.generate import _create_fan
+from Tessen.fan_index import FanIndex
+
+from tests.test_fan import offers
+
+try:
+    from Tessen import bulk_operation
+    from Tessen.bulk_operation import (load_offers, offer_lines,
+                                       build_offer_index, render_fans,
+                                       energy_headers)
+except ImportError:
+    bulk_operation = None
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENERGY_FILE = os.path.join(ROOT, "sample_data", "offers20131212.csv")
+
+
+def offer_file(path, days=("12/12/2013", "13/12/2013"), rows=20):
+    """ A raw energy offer file of the first rows of the sample day repeated
+    for each of the days, with a header row repeated part way through as
+    when daily files are joined.
+    """
+    with open(ENERGY_FILE) as f:
+        lines = f.read().splitlines(True)
+    header, lines = lines[0], lines[1:rows + 1]
+
+    fName = os.path.join(path, "offers201312.csv")
+    with open(fName, "w") as f:
+        for i, day in enumerate(days):
+            f.write(header if i == 0 else "\n" + header)
+            f.writelines(x.replace(",12/12/2013,", ",%s," % day) for x in
+                         lines)
+    return fName
+
+
+@unittest.skipIf(bulk_operation is None, "OfferPandas is required")
+class TestOfferLines(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.fName = offer_file(self.path)
+        self.column = energy_headers.index("Trading_Date")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def dates(self, lines):
+        return [x.split(",")[self.column] for x in lines]
+
+    def test_all_lines(self):
+        lines = list(offer_lines(self.fName, self.column))
+
+        self.assertEqual(len(lines), 40)
+        self.assertEqual(sorted(set(self.dates(lines))),
+                         ["12/12/2013", "13/12/2013"])
+
+    def test_date_filter(self):
+        for index in (False, True):
+            lines = list(offer_lines(self.fName, self.column,
+                                     dates=set(["20131213"]), index=index))
+
+            self.assertEqual(self.dates(lines), ["13/12/2013"] * 20)
+
+        self.assertEqual(list(offer_lines(self.fName, self.column,
+                                          dates=set(["20131214"]),
+                                          index=True)), [])
+
+    def test_index_sidecar(self):
+        offsets = build_offer_index(self.fName, self.column)
+
+        self.assertTrue(os.path.exists(self.fName + ".index.json"))
+        self.assertEqual(sorted(offsets), ["20131212", "20131213"])
+        with open(self.fName, "rb") as f:
+            for start, stop in offsets["20131212"]:
+                f.seek(start)
+                self.assertEqual(set(self.dates(f.read(stop - start)
+                                                .splitlines())),
+                                 set(["12/12/2013"]))
+
+    def test_stale_index(self):
+        build_offer_index(self.fName, self.column)
+        offer_file(self.path, days=("12/12/2013", "13/12/2013",
+                                    "14/12/2013"))
+
+        lines = list(offer_lines(self.fName, self.column,
+                                 dates=set(["20131214"]), index=True))
+        self.assertEqual(self.dates(lines), ["14/12/2013"] * 20)
+
+    def test_stale_index_same_size(self):
+        build_offer_index(self.fName, self.column)
+        status = os.stat(self.fName)
+        # The same number of bytes with the days swapped over
+        offer_file(self.path, days=("13/12/2013", "12/12/2013"))
+        os.utime(self.fName, (status.st_atime, status.st_mtime + 10))
+
+        offsets = build_offer_index(self.fName, self.column)
+        self.assertTrue(offsets["20131213"][0][0] <
+                        offsets["20131212"][0][0])
+
+    def test_load_offers(self):
+        everything = load_offers([self.fName], energy_headers)
+        expected = everything[everything["Trading_Date"].astype(str) ==
+                              "13/12/2013"]
+
+        for index in (False, True):
+            offers = load_offers([self.fName], energy_headers,
+                                 dates=["13/12/2013"], index=index)
+
+            self.assertEqual(len(offers), len(expected))
+            self.assertEqual(set(offers["Trading_Date"].astype(str)),
+                             set(["13/12/2013"]))
+
+
+@unittest.skipIf(bulk_operation is None, "OfferPandas is required")
+class TestRenderFans(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        index = FanIndex(_create_fan(*offers(periods=(1, 2))))
+        self.jobs = []
+        for period in (1, 2):
+            filters = {"Trading_Date": "12/12/2013", "Trading_Period": period,
+                       "Reserve_Type": "FIR", "Island_Name": "NI"}
+            fName = os.path.join(self.path, "fancurve%02d.png" % period)
+            self.jobs.append((index.select(filters), filters, fName))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_render(self):
+        import matplotlib.pyplot as plt
+
+        for workers in (1, 2):
+            for data, filters, fName in self.jobs:
+                if os.path.exists(fName):
+                    os.remove(fName)
+            backend = plt.get_backend()
+
+            files = render_fans(self.jobs, workers=workers)
+
+            self.assertEqual(files, [x[2] for x in self.jobs])
+            self.assertTrue(all(os.path.getsize(x) > 0 for x in files))
+            self.assertEqual(plt.get_backend(), backend)
+            self.assertEqual(plt.get_fignums(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
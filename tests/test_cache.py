@@ -0,0 +1,97 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+import numpy as np
+
+from Tessen.cache import AggregateCache, aggregate_key
+
+from tests.test_plot import random_fan
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+KEY_SCRIPT = """
+from Tessen.cache import aggregate_key
+from tests.test_plot import random_fan
+print(aggregate_key(random_fan(), [2.5, 5.], {1.: 3.}))
+"""
+
+
+class TestAggregateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_least_recently_used_eviction(self):
+        cache = AggregateCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("a" in cache and "c" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_disk_round_trip(self):
+        value = {5.: (np.array([0., 10.]), np.array([0., 50.]),
+                      np.array([0., 20.]))}
+        AggregateCache(maxsize=1, directory=self.path).set("key", value)
+
+        cache = AggregateCache(maxsize=1, directory=self.path)
+        self.assertTrue("key" in cache)
+        for actual, expected in zip(cache.get("key")[5.], value[5.]):
+            np.testing.assert_array_equal(actual, expected)
+
+        # Clearing the memory keeps the entries on disk
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertTrue(cache.get("key") is not None)
+        self.assertEqual(cache.hits, 2)
+
+
+class TestAggregateKey(unittest.TestCase):
+
+    def setUp(self):
+        self.data = random_fan()
+
+    def test_same_contents(self):
+        copy = self.data.copy()
+        copy.index = copy.index + 100
+        copy["Node"] = copy["Node"].astype("category")
+
+        self.assertEqual(aggregate_key(self.data), aggregate_key(copy))
+
+    def test_changed_contents(self):
+        key = aggregate_key(self.data, [2.5, 5.])
+        changed = self.data.copy()
+        changed.loc[0, "Reserve Price"] += 0.5
+
+        self.assertNotEqual(aggregate_key(changed, [2.5, 5.]), key)
+        self.assertNotEqual(aggregate_key(self.data, [2.5]), key)
+        self.assertNotEqual(aggregate_key(self.data), key)
+        self.assertNotEqual(aggregate_key(self.data, [2.5, 5.], {1.: 3.}),
+                            key)
+
+    def test_stable_between_sessions(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [ROOT] + [x for x in [env.get("PYTHONPATH")] if x])
+        output = subprocess.check_output([sys.executable, "-c", KEY_SCRIPT],
+                                         env=env, cwd=ROOT)
+
+        self.assertEqual(output.decode().strip(), aggregate_key(
+            self.data, [2.5, 5.], {1.: 3.}))
+
+
+if __name__ == '__main__':
+    unittest.main()
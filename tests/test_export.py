@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from Tessen.aggregate import AggregateCurves, CURVE_COLUMNS
+from Tessen.export import (export_tiles, read_manifest, read_tile,
+                           encode_line, decode_line, shading_runs)
+
+
+def curves():
+    """ Two reserve contours of a single trading period """
+    table = pd.DataFrame([["20131212", 1, "FIR", "NI", 5.],
+                          ["20131212", 1, "FIR", "NI", 0.]],
+                         columns=CURVE_COLUMNS)
+    energy_price = np.array([0., 10., 10., 20.] * 2)
+    energy = np.array([0., 50., 100., 150.] * 2)
+    reserve = np.array([0., 10., 20., 25., 0., 0., 0., 0.])
+    return AggregateCurves(table, np.array([0, 4, 8]), energy_price, energy,
+                           reserve)
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        values = [0.126, 10.5, 10.5, 1234.56]
+        deltas = encode_line(values)
+
+        self.assertEqual(deltas, [13, 1037, 0, 122406])
+        np.testing.assert_allclose(decode_line(deltas),
+                                   [0.13, 10.5, 10.5, 1234.56])
+
+    def test_shading_runs(self):
+        self.assertEqual(shading_runs([0., 10., 10., 20.]),
+                         [[0, 2, 10.], [2, 3, 20.]])
+        self.assertEqual(shading_runs([5.]), [])
+
+
+class TestExportTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_export(self):
+        files = export_tiles(curves(), self.path)
+        periods = read_tile(files[0])
+
+        contours = periods[(1, "FIR", "NI")]["contours"]
+        self.assertEqual(sorted(contours), [0., 5.])
+        np.testing.assert_allclose(contours[5.][2], [0., 10., 20., 25.])
+        self.assertEqual(periods[(1, "FIR", "NI")]["shading"],
+                         [(0, 2, 10.), (2, 3, 20.)])
+
+        manifest = read_manifest(self.path)
+        self.assertEqual(manifest["tiles"]["20131212"]["periods"], [1])
+        self.assertTrue(os.path.exists(os.path.join(
+            self.path, manifest["tiles"]["20131212"]["file"])))
+
+
+if __name__ == '__main__':
+    unittest.main()
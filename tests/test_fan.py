@@ -1,9 +1,497 @@
+import os
+import datetime
+import shutil
+import tempfile
 import unittest
 
-import ..Tessen.fan as fan
+import numpy as np
+import pandas as pd
 
-class TestFeasibleBathtubCreation(unittest.TestCase)
+from Tessen.generate import (incremental_energy_stack, energy_stacks,
+                             _create_fan, iter_fans, _fan_parts, FanMemo, station_fan,
+                             station_fan_arrays, reserve_fan_arrays,
+                             feasible_reserve_region, feasible_reserve_regions,
+                             FAN_COLUMNS, fan_columns)
+from Tessen.sinks import CsvSink
+from Tessen.incremental import update_fan_store, read_fingerprints
+from Tessen.store import (read_fan_store, write_fan_store, partition_files,
+                          date_name)
+from Tessen.aggregate import reserve_contours
 
-    def testbathtubcreation():
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
-        mapping = fan.create_feasible(100, 10, 20)
+
+def offers(periods=(1, 2)):
+    """ Energy and reserve offers of two stations, the same in every trading
+    period.
+    """
+    energy, reserve = [], []
+    for period in periods:
+        metadata = {"Trading_Date": "12/12/2013", "Trading_Period": period,
+                    "Trading_Period_ID": "12/12/2013_%02d" % period,
+                    "Company": "GENCO", "Island_Name": "NI",
+                    "Last_Amended_Date": "11/12/2013 12:00:00"}
+        for node, max_output in (("STA0", 120.), ("STB0", 60.)):
+            for band, (price, quantity) in enumerate([(0., 40.), (50., 30.),
+                                                      (120., 50.)]):
+                energy.append(dict(metadata, Node=node, Band=band + 1,
+                                   Max_Output=max_output, Price=price,
+                                   Quantity=quantity))
+            for reserve_type in ("FIR", "SIR"):
+                for band, (price, quantity, percent) in enumerate(
+                        [(1., 10., 20.), (5., 15., 50.)]):
+                    reserve.append(dict(metadata, Node=node, Band=band + 1,
+                                        Reserve_Type=reserve_type,
+                                        Product_Type="PLSR", Price=price,
+                                        Quantity=quantity, Percent=percent))
+
+    return pd.DataFrame(energy), pd.DataFrame(reserve)
+
+
+def fan_rows(fan):
+    """ The rows of a fan as strings, sorted so the order of the rows does
+    not matter.
+    """
+    columns = ["Trading_Period", "Node", "Reserve_Type"] + FAN_COLUMNS
+    return sorted(zip(*[fan[x].astype(str) for x in columns]))
+
+
+class TestIncrementalEnergyStack(unittest.TestCase):
+
+    def setUp(self):
+        self.pairs = np.array([[0., 2.5], [50., 1.], [120., 0.]])
+
+    def test_stack_increments(self):
+        stack = incremental_energy_stack(self.pairs)
+
+        self.assertEqual(stack.shape, (5, 4))
+        np.testing.assert_array_equal(stack[0], np.zeros(4))
+        np.testing.assert_allclose(stack[:, 0], [0., 0., 0., 0., 50.])
+        np.testing.assert_allclose(stack[:, 2], [0., 1., 1., 0.5, 1.])
+        np.testing.assert_allclose(stack[:, 3], [0., 1., 2., 2.5, 3.5])
+
+    def test_compact_stack(self):
+        stack = incremental_energy_stack(self.pairs, compact=True)
+
+        np.testing.assert_allclose(stack[:, 2], [0., 2.5, 1.])
+        np.testing.assert_allclose(stack[:, 3], [0., 2.5, 3.5])
+
+    def test_stacks_match_single_stations(self):
+        other = np.array([[10., 3.]])
+        stack, offsets = energy_stacks(np.vstack([self.pairs, other]), [3, 1])
+
+        np.testing.assert_allclose(stack[offsets[0]:offsets[1]],
+                                   incremental_energy_stack(self.pairs))
+        np.testing.assert_allclose(stack[offsets[1]:offsets[2]],
+                                   incremental_energy_stack(other))
+
+    def test_stacks_do_not_depend_on_position(self):
+        other = np.array([[10., 0.1], [20., 0.7]])
+        stack, offsets = energy_stacks(np.vstack([other, self.pairs]), [2, 3],
+                                       resolution=0.3)
+
+        np.testing.assert_array_equal(stack[offsets[1]:offsets[2]],
+                                      incremental_energy_stack(
+                                          self.pairs, resolution=0.3))
+
+    def test_invalid_resolution(self):
+        self.assertRaises(ValueError, incremental_energy_stack, self.pairs,
+                          resolution=0)
+
+
+class TestCreateFan(unittest.TestCase):
+
+    def test_matches_station_fans(self):
+        energy, reserve = offers(periods=(1,))
+
+        # The FIR and SIR fans of a station share a single energy stack
+        for compact in (False, True):
+            fan = _create_fan(energy, reserve, compact=compact)
+            for node in ("STA0", "STB0"):
+                for reserve_type in ("FIR", "SIR"):
+                    expected = station_fan(
+                        energy[energy["Node"] == node],
+                        reserve[(reserve["Node"] == node) &
+                                (reserve["Reserve_Type"] == reserve_type)],
+                        assumed_reserve=reserve_type, compact=compact)
+                    actual = fan[(fan["Node"] == node) &
+                                 (fan["Reserve_Type"] == reserve_type)]
+
+                    np.testing.assert_array_equal(actual[FAN_COLUMNS].values,
+                                                  expected[FAN_COLUMNS].values)
+                    self.assertEqual(list(actual["Product_Type"]),
+                                     list(expected["Product_Type"]))
+
+
+class TestParallelFans(unittest.TestCase):
+
+    def setUp(self):
+        self.energy, self.reserve = offers(periods=(1, 2, 3, 4, 5))
+        # Different offers in each period so no period repeats another
+        self.energy["Price"] += self.energy["Trading_Period"]
+        self.expected = _create_fan(self.energy, self.reserve)
+
+    def assertSameFan(self, fan):
+        fan = fan.reset_index(drop=True)
+        self.assertEqual(list(fan.columns), list(self.expected.columns))
+        for column in fan.columns:
+            self.assertEqual(list(fan[column].astype(str)),
+                             list(self.expected[column].astype(str)), column)
+
+    def test_workers_match_serial(self):
+        self.assertSameFan(_create_fan(self.energy, self.reserve, workers=2))
+
+    def test_streamed_matches_batch(self):
+        for workers in (1, 2):
+            fans = list(iter_fans(self.energy, self.reserve, workers=workers))
+
+            self.assertEqual(len(fans), 5)
+            self.assertSameFan(pd.concat(fans, ignore_index=True))
+
+    def test_streamed_il_columns(self):
+        # Interruptible load in a single period, with a column of its own
+        il = pd.DataFrame({"Trading_Date": "12/12/2013", "Trading_Period": 2,
+                           "Trading_Period_ID": "12/12/2013_02",
+                           "Node": "ILD0", "Island_Name": "NI",
+                           "Reserve_Type": ["FIR", "FIR"],
+                           "Price": [5., 2.], "Quantity": [3., 4.],
+                           "Site": "ILD"})
+        columns = fan_columns(self.energy, il)
+        self.assertTrue("Site" in columns)
+
+        fans = list(iter_fans(self.energy, self.reserve, il=il))
+        for fan in fans:
+            self.assertEqual(list(fan.columns), columns)
+
+        path = tempfile.mkdtemp()
+        try:
+            fName = os.path.join(path, "fan.csv")
+            sink = CsvSink(fName)
+            for fan in fans:
+                sink.write(fan)
+            sink.close()
+
+            written = pd.read_csv(fName)
+            self.assertEqual(list(written.columns), columns)
+            self.assertEqual(len(written), sum(len(x) for x in fans))
+            il_rows = written[written["Product_Type"] == "IL"]
+            self.assertEqual(sorted(il_rows["Reserve Price"]), [2., 5.])
+            self.assertEqual(set(il_rows["Site"]), set(["ILD"]))
+            self.assertTrue(written["Site"][written["Product_Type"] !=
+                                            "IL"].isnull().all())
+        finally:
+            shutil.rmtree(path)
+
+
+class TestCompactFan(unittest.TestCase):
+
+    def test_converges_to_fine_fans(self):
+        energy, reserve = offers(periods=(1,))
+        compact = _create_fan(energy, reserve, compact=True)
+
+        for resolution in (1., 0.1):
+            fine = _create_fan(energy, reserve, resolution=resolution)
+            self.assertLess(len(compact), len(fine))
+
+            for reserve_type in ("FIR", "SIR"):
+                compact_contours = reserve_contours(
+                    compact[compact["Reserve_Type"] == reserve_type])
+                fine_contours = reserve_contours(
+                    fine[fine["Reserve_Type"] == reserve_type])
+                self.assertEqual(sorted(compact_contours),
+                                 sorted(fine_contours))
+
+                # Every point of a fine fan lies on the compact fan, which
+                # is a straight line between its breakpoints
+                for price, (_, energy_line, reserve_line) in \
+                        fine_contours.iteritems():
+                    compact_energy, compact_reserve = (
+                        compact_contours[price][1:])
+                    np.testing.assert_allclose(
+                        np.interp(energy_line,
+                                  np.concatenate(([0.], compact_energy)),
+                                  np.concatenate(([0.], compact_reserve))),
+                        reserve_line, atol=1e-9)
+                    np.testing.assert_allclose(
+                        [energy_line[-1], reserve_line[-1]],
+                        [compact_energy[-1], compact_reserve[-1]], atol=1e-9)
+
+    def test_within_error_bound(self):
+        # Band edges and reserve breakpoints which fall between increments
+        energy = pd.DataFrame({"Price": [0., 50., 120.],
+                               "Quantity": [37.3, 21.7, 44.9],
+                               "Max_Output": 103.9})
+        reserve = pd.DataFrame({"Price": [1., 5.], "Quantity": [11.3, 17.9],
+                                "Percent": [23., 61.],
+                                "Product_Type": "PLSR",
+                                "Reserve_Type": "FIR"})
+        compact, bands = station_fan_arrays(energy, reserve, "FIR",
+                                            compact=True)
+        percents = bands[2]
+
+        for resolution in (5., 1., 0.3):
+            fine = station_fan_arrays(energy, reserve, "FIR",
+                                      resolution=resolution)[0]
+            for exact, band, percent in zip(
+                    np.split(compact, len(percents)),
+                    np.split(fine, len(percents)), percents):
+                # The fine fan is a straight line between its increments
+                error = np.interp(exact[:, 3], band[:, 3], band[:, 7]) - \
+                    exact[:, 7]
+                bound = resolution * (1 + percent / 100.) / 4
+                self.assertLessEqual(np.abs(error).max(), bound + 1e-9)
+
+
+class TestReserveBands(unittest.TestCase):
+
+    def setUp(self):
+        self.stack = incremental_energy_stack(
+            np.array([[0., 37.5], [50., 30.], [120., 52.5]]), resolution=2.5)
+        self.capacity = 110.
+
+    def reserve_offers(self, prices):
+        count = len(prices)
+        return [np.array(prices), np.array([10., 15., 20.][:count]),
+                np.array([20., 50., 0.][:count]),
+                np.array(["PLSR", "PLSR", "TWDSR"][:count], dtype=object),
+                np.array(["FIR"] * count, dtype=object)]
+
+    def test_zero_price_band_is_kept(self):
+        stack, bands = reserve_fan_arrays(self.stack, self.capacity,
+                                          self.reserve_offers([0., 5.]),
+                                          assumed_reserve="FIR")
+
+        self.assertEqual(len(bands[0]), 2)
+        self.assertEqual(len(stack), 2 * len(self.stack))
+        np.testing.assert_array_equal(stack[:len(self.stack), 4], 0.)
+        self.assertTrue((stack[:len(self.stack), 7] > 0).any())
+
+    def test_energy_only_band_added(self):
+        # The offers are indexed from zero, only a zero price counts
+        energy = pd.DataFrame({"Price": [0., 50., 120.],
+                               "Quantity": [37.5, 30., 52.5],
+                               "Max_Output": self.capacity})
+        for prices in ([5., 1.], [5., 1., 0.5]):
+            offers = self.reserve_offers(prices)
+            reserve = pd.DataFrame(dict(zip(["Price", "Quantity", "Percent",
+                                             "Product_Type", "Reserve_Type"],
+                                            offers)))
+            stack, bands = station_fan_arrays(energy, reserve, "FIR",
+                                              resolution=2.5)
+
+            self.assertEqual(len(bands[0]), len(prices) + 1)
+            self.assertEqual(bands[0][0], "FIR")
+            self.assertEqual(bands[1][0], "PLSR")
+            energy_only = stack[:len(self.stack)]
+            np.testing.assert_array_equal(energy_only[:, 4:], 0.)
+            np.testing.assert_array_equal(energy_only[:, :4], self.stack)
+
+    def test_broadcast_matches_single_band(self):
+        prices = np.array([0., 5., 9.])
+        quantities = np.array([10., 15., 20.])
+        percents = np.array([20., 50., 1000000.])
+        regions = feasible_reserve_regions(self.stack, prices, quantities,
+                                           percents, self.capacity)
+
+        self.assertEqual(regions.shape, (3, len(self.stack), 8))
+        used = np.cumsum(quantities) - quantities
+        for i in xrange(len(prices)):
+            single = feasible_reserve_region(
+                self.stack, prices[i], quantities[i], percents[i],
+                self.capacity, self.capacity - used[i], "PLSR")
+            np.testing.assert_array_equal(regions[i], single)
+
+
+class TestFanMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.energy, self.reserve = offers()
+        self.memo = FanMemo()
+
+    def test_repeated_offers_hit(self):
+        _fan_parts(self.energy, self.reserve, memo=self.memo)
+
+        # Both stations and reserve types repeat in the second period
+        self.assertEqual((self.memo.misses, self.memo.hits), (4, 4))
+
+    def test_rebid_misses(self):
+        rebid = (self.energy["Node"] == "STA0") & (
+            self.energy["Trading_Period"] == 2)
+        self.energy.loc[rebid, "Price"] += 5.
+        _fan_parts(self.energy, self.reserve, memo=self.memo)
+
+        self.assertEqual((self.memo.misses, self.memo.hits), (6, 2))
+
+    def test_settings_miss(self):
+        _fan_parts(self.energy, self.reserve, memo=self.memo)
+        _fan_parts(self.energy, self.reserve, resolution=0.5, memo=self.memo)
+        _fan_parts(self.energy, self.reserve, compact=True, memo=self.memo)
+
+        self.assertEqual(len(self.memo), 12)
+
+
+@unittest.skipIf(pyarrow is None, "pyarrow is required for a fan store")
+class TestUpdateFanStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.energy, self.reserve = offers()
+        update_fan_store(self.energy, self.reserve, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def nodes(self, period):
+        if not partition_files(self.path, periods=period):
+            return []
+        fan = read_fan_store(self.path, filters={"Trading_Period": period})
+        return sorted(set(fan["Node"].astype(str)))
+
+    def withdraw(self, nodes, period):
+        energy = self.energy.copy()
+        energy.loc[(energy["Node"].isin(nodes)) &
+                   (energy["Trading_Period"] == period), "Quantity"] = 0.
+        return energy
+
+    def stored(self):
+        return fan_rows(read_fan_store(self.path))
+
+    def expected(self, energy, reserve):
+        return fan_rows(_create_fan(energy, reserve))
+
+    def test_unchanged(self):
+        before = self.stored()
+        fan = update_fan_store(self.energy, self.reserve, self.path)
+
+        self.assertEqual(len(fan), 0)
+        self.assertEqual(self.stored(), before)
+
+    def test_amended_station(self):
+        energy = self.energy.copy()
+        amended = ((energy["Node"] == "STA0") &
+                   (energy["Trading_Period"] == 1) & (energy["Band"] == 2))
+        energy.loc[amended, "Price"] = 70.
+        energy.loc[amended, "Last_Amended_Date"] = "12/12/2013 06:00:00"
+
+        fan = update_fan_store(energy, self.reserve, self.path)
+
+        self.assertEqual(set(fan["Node"].astype(str)), set(["STA0"]))
+        self.assertEqual(set(fan["Trading_Period"]), set([1]))
+        self.assertEqual(self.stored(), self.expected(energy, self.reserve))
+
+    def test_removed_station(self):
+        # The station's offers are gone from the period, not just zeroed
+        keep = lambda x: ~((x["Node"] == "STA0") & (x["Trading_Period"] == 1))
+        energy = self.energy[keep(self.energy)]
+        reserve = self.reserve[keep(self.reserve)]
+
+        update_fan_store(energy, reserve, self.path)
+
+        self.assertEqual(self.nodes(1), ["STB0"])
+        self.assertEqual(self.nodes(2), ["STA0", "STB0"])
+        self.assertEqual(self.stored(), self.expected(energy, reserve))
+        self.assertEqual(sorted(read_fingerprints(self.path)[
+            "12/12/2013_01"]), ["STB0"])
+
+    def test_withdrawn_station(self):
+        fan = update_fan_store(self.withdraw(["STA0"], 1), self.reserve,
+                               self.path)
+
+        self.assertEqual(len(fan), 0)
+        self.assertEqual(self.nodes(1), ["STB0"])
+        self.assertEqual(self.nodes(2), ["STA0", "STB0"])
+
+    def test_withdrawn_period(self):
+        update_fan_store(self.withdraw(["STA0", "STB0"], 1), self.reserve,
+                         self.path)
+
+        self.assertEqual(self.nodes(1), [])
+        self.assertEqual(self.nodes(2), ["STA0", "STB0"])
+
+    def test_changed_settings(self):
+        self.assertEqual(len(update_fan_store(self.energy, self.reserve,
+                                              self.path)), 0)
+
+        fan = update_fan_store(self.energy, self.reserve, self.path,
+                               compact=True)
+        stored = read_fan_store(self.path)
+        expected = _create_fan(self.energy, self.reserve, compact=True)
+        self.assertEqual(len(fan), len(expected))
+        self.assertEqual(len(stored), len(expected))
+
+
+class TestFanStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.fan = _create_fan(*offers(periods=(1, 2, 3)))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assertSameFan(self, fan, expected):
+        columns = sorted(expected.columns)
+        self.assertEqual(sorted(fan.columns), columns)
+        self.assertEqual(len(fan), len(expected))
+        for column in columns:
+            self.assertEqual(list(fan[column].astype(str)),
+                             list(expected[column].astype(str)), column)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required for a fan store")
+    def test_round_trip(self):
+        for file_format in ("parquet", "feather"):
+            path = os.path.join(self.path, file_format)
+            files = write_fan_store(self.fan, path, file_format=file_format)
+
+            self.assertEqual(len(files), 3)
+            self.assertSameFan(read_fan_store(path), self.fan)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required for a fan store")
+    def test_partition_selection(self):
+        write_fan_store(self.fan, self.path)
+        self.assertEqual(len(partition_files(self.path, periods=[1, 3])), 2)
+
+        selected = read_fan_store(self.path, filters={
+            "Trading_Date": "2013-12-12", "Trading_Period": 2,
+            "Reserve_Type": "FIR"})
+        expected = self.fan[(self.fan["Trading_Period"] == 2) &
+                            (self.fan["Reserve_Type"] == "FIR")]
+        self.assertSameFan(selected.reset_index(drop=True),
+                           expected.reset_index(drop=True))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required for a fan store")
+    def test_merge_partial_fan(self):
+        write_fan_store(self.fan, self.path)
+        energy, reserve = offers(periods=(2,))
+        energy.loc[energy["Band"] == 1, "Price"] = 10.
+        station = _create_fan(energy[energy["Node"] == "STA0"],
+                              reserve[reserve["Node"] == "STA0"])
+        write_fan_store(station, self.path)
+
+        stored = read_fan_store(self.path)
+        others = self.fan[(self.fan["Trading_Period"] != 2) |
+                          (self.fan["Node"] != "STA0")]
+        self.assertEqual(fan_rows(stored),
+                         fan_rows(pd.concat([others, station])))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required for a fan store")
+    def test_replace_partitions(self):
+        write_fan_store(self.fan, self.path)
+        station = self.fan[(self.fan["Trading_Period"] == 2) &
+                           (self.fan["Node"] == "STA0")]
+        write_fan_store(station, self.path, merge=False)
+
+        stored = read_fan_store(self.path, filters={"Trading_Period": 2})
+        self.assertEqual(fan_rows(stored), fan_rows(station))
+
+    def test_date_names(self):
+        for date in ("05/12/2013", "2013-12-05", "20131205",
+                     datetime.date(2013, 12, 5)):
+            self.assertEqual(date_name(date), "20131205")
+
+
+if __name__ == '__main__':
+    unittest.main()
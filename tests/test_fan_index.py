@@ -0,0 +1,104 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from Tessen.fan_index import FanIndex, _take_slices
+
+
+def shuffled_fan(seed=0, rows=400):
+    """ Fan rows of two days, a few periods, both reserve types and islands
+    in a random order, each row numbered so selections can be compared.
+    """
+    rs = np.random.RandomState(seed)
+    return pd.DataFrame({
+        "Row": np.arange(rows),
+        "Trading_Date": np.array(["12/12/2013", "13/12/2013"])[
+            rs.randint(0, 2, rows)],
+        "Trading_Period": rs.randint(1, 5, rows),
+        "Reserve_Type": np.array(["FIR", "SIR"])[rs.randint(0, 2, rows)],
+        "Island_Name": np.array(["NI", "SI"])[rs.randint(0, 2, rows)],
+        "Node": np.array(["STA0", "STB0", "STC0"])[rs.randint(0, 3, rows)],
+        "Reserve Price": rs.randint(0, 5, rows) * 2.5})
+
+
+class TestFanIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.fan = shuffled_fan()
+        self.index = FanIndex(self.fan)
+
+    def assertSelects(self, filters, mask):
+        selected = self.index.select(filters)
+        self.assertEqual(sorted(selected["Row"]),
+                         sorted(self.fan["Row"][mask]))
+
+    def test_single_combination(self):
+        fan = self.fan
+        self.assertSelects({"Trading_Date": "12/12/2013",
+                            "Trading_Period": 2, "Reserve_Type": "FIR",
+                            "Island_Name": "SI"},
+                           (fan["Trading_Date"] == "12/12/2013") &
+                           (fan["Trading_Period"] == 2) &
+                           (fan["Reserve_Type"] == "FIR") &
+                           (fan["Island_Name"] == "SI"))
+
+    def test_partial_filters(self):
+        fan = self.fan
+        self.assertSelects({"Trading_Period": 3}, fan["Trading_Period"] == 3)
+        self.assertSelects({}, np.ones(len(fan), dtype=bool))
+
+    def test_list_filters(self):
+        fan = self.fan
+        self.assertSelects({"Trading_Period": [1, 3],
+                            "Island_Name": ["NI"], "Reserve_Type": "SIR"},
+                           fan["Trading_Period"].isin([1, 3]) &
+                           (fan["Island_Name"] == "NI") &
+                           (fan["Reserve_Type"] == "SIR"))
+
+    def test_date_names(self):
+        fan = self.fan
+        self.assertSelects({"Trading_Date": ["20131213"]},
+                           fan["Trading_Date"] == "13/12/2013")
+
+    def test_missing_keys(self):
+        fan = self.fan
+        self.assertSelects({"Trading_Date": "12/12/2013",
+                            "Trading_Period": 9, "Reserve_Type": "FIR",
+                            "Island_Name": "NI"},
+                           np.zeros(len(fan), dtype=bool))
+        self.assertSelects({"Island_Name": ["NZ"]},
+                           np.zeros(len(fan), dtype=bool))
+        self.assertEqual(len(self.index.get("14/12/2013", 1, "FIR", "NI")), 0)
+
+    def test_other_columns(self):
+        fan = self.fan
+        self.assertSelects({"Trading_Period": 1, "Node": ["STA0", "STC0"],
+                            "Reserve Price": 5.},
+                           (fan["Trading_Period"] == 1) &
+                           fan["Node"].isin(["STA0", "STC0"]) &
+                           (fan["Reserve Price"] == 5.))
+
+    def test_keys_are_contiguous(self):
+        keys = self.index.keys()
+
+        self.assertEqual(len(keys), len(self.fan.groupby(
+            ["Trading_Date", "Trading_Period", "Reserve_Type",
+             "Island_Name"])))
+        self.assertEqual(sum(len(self.index.get(*key)) for key in keys),
+                         len(self.fan))
+        self.assertTrue(keys[0] in self.index)
+
+
+class TestTakeSlices(unittest.TestCase):
+
+    def test_merges_adjacent_blocks(self):
+        fan = pd.DataFrame({"Row": np.arange(10)})
+        taken = _take_slices(fan, [slice(0, 2), slice(2, 5), slice(7, 9)])
+
+        self.assertEqual(list(taken["Row"]), [0, 1, 2, 3, 4, 7, 8])
+        self.assertEqual(len(_take_slices(fan, [])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,2 +1,53 @@
+import os
+import sys
+import subprocess
 import unittest
 
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules which should only be loaded once they are needed, plotting
+# and reading offers
+DEFERRED_MODULES = ["matplotlib.pyplot", "OfferPandas"]
+
+# Seconds allowed for importing Tessen once pandas and numpy are loaded, it
+# takes a few hundredths of a second so this only catches a heavy import
+# creeping back in
+IMPORT_BUDGET = 1.0
+
+IMPORT_SCRIPT = """
+import sys
+import time
+
+import numpy
+import pandas
+
+begin = time.time()
+import Tessen
+Tessen.create_fan
+print(time.time() - begin)
+print(" ".join(sorted(x for x in %r if x in sys.modules)))
+""" % DEFERRED_MODULES
+
+
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [ROOT] + [x for x in [env.get("PYTHONPATH")] if x])
+        output = subprocess.check_output([sys.executable, "-c",
+                                          IMPORT_SCRIPT], env=env)
+        lines = output.decode().splitlines()
+        self.elapsed = float(lines[0])
+        self.loaded = lines[1].split() if len(lines) > 1 else []
+
+    def test_import_defers_modules(self):
+        self.assertEqual(self.loaded, [])
+
+    def test_import_time(self):
+        self.assertLess(self.elapsed, IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
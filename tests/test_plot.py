@@ -0,0 +1,316 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from Tessen.aggregate import (reserve_contours, reserve_contour_deltas,
+                              il_stack, aggregate_fans, breakpoints,
+                              AggregateCurves, MARKET_NAME)
+from Tessen.visualise import (_price_buckets, _shading_polygons,
+                              _tranche_colours)
+
+
+def random_fan(seed=0, increments=60, rows=200):
+    """ Reserve offered on increments of a few stations at a few energy
+    prices, with distinct reserve per MW so the contours have one order.
+    """
+    rs = np.random.RandomState(seed)
+    group = rs.randint(0, increments, rows)
+    return pd.DataFrame({
+        "Node": np.array(["STA0", "STB0", "STC0"])[group % 3],
+        "Cumulative Energy Quantity": (group // 3).astype(float),
+        "Incremental Energy Quantity": 1. + group % 4,
+        "Energy Price": (group * 7 % 5) * 10.,
+        "Reserve Price": rs.randint(0, 8, rows) * 2.5,
+        "Incremental Reserve Quantity": rs.rand(rows)})
+
+
+def contour_reference(data, price):
+    """ The contour at a reserve price, aggregating from scratch """
+    offered = data[data["Reserve Price"] <= price]
+    increments = offered.groupby(["Node", "Cumulative Energy Quantity"]).agg(
+        {"Energy Price": "max", "Incremental Energy Quantity": "max",
+         "Incremental Reserve Quantity": "sum"})
+    slope = (increments["Incremental Reserve Quantity"] /
+             increments["Incremental Energy Quantity"])
+    order = np.lexsort((-slope.values, increments["Energy Price"].values))
+    increments = increments.iloc[order]
+    return (increments["Energy Price"].values,
+            increments["Incremental Energy Quantity"].values.cumsum(),
+            increments["Incremental Reserve Quantity"].values.cumsum())
+
+
+class TestReserveContours(unittest.TestCase):
+
+    def test_matches_reference(self):
+        self.check_reference(random_fan())
+
+    def test_negative_energy_prices(self):
+        data = random_fan()
+        data["Energy Price"] -= 20.
+        self.check_reference(data)
+
+    def check_reference(self, data):
+        contours = reserve_contours(data)
+
+        self.assertEqual(sorted(contours),
+                         sorted(data["Reserve Price"].unique()))
+        for price, contour in contours.iteritems():
+            for actual, expected in zip(contour,
+                                        contour_reference(data, price)):
+                np.testing.assert_allclose(actual, expected)
+
+
+class TestReserveContourDeltas(unittest.TestCase):
+
+    def setUp(self):
+        self.data = random_fan(seed=1, increments=90, rows=400)
+        self.prices = np.unique(self.data["Reserve Price"])
+        self.deltas = reserve_contour_deltas(self.data, self.prices)
+
+    def test_contours_match_reference(self):
+        self.assertEqual(len(self.deltas), len(self.prices))
+        for price, contour in zip(self.prices, self.deltas.contours()):
+            for actual, expected in zip(contour,
+                                        contour_reference(self.data, price)):
+                np.testing.assert_allclose(actual, expected)
+
+    def test_only_touched_blocks_change(self):
+        low = -np.inf
+        for price, (changed, offsets, energy, reserve) in zip(
+                self.prices, self.deltas.deltas):
+            offered = self.data[(self.data["Reserve Price"] > low) &
+                                (self.data["Reserve Price"] <= price)]
+            touched = np.unique(offered.groupby(
+                ["Node", "Cumulative Energy Quantity"])["Energy Price"].max())
+            np.testing.assert_array_equal(
+                self.deltas.block_prices[changed], touched)
+            self.assertEqual(offsets[-1], len(energy))
+            low = price
+
+    def test_subset_of_prices(self):
+        prices = [2.5, 10.]
+        contours = reserve_contours(self.data, prices)
+
+        for price in prices:
+            for actual, expected in zip(contours[price],
+                                        contour_reference(self.data, price)):
+                np.testing.assert_allclose(actual, expected)
+
+
+class TestILStack(unittest.TestCase):
+
+    def setUp(self):
+        self.data = pd.DataFrame({
+            "Product_Type": ["PLSR", "IL", "IL", "IL"],
+            "Reserve Price": [1., 2., 5., 2.],
+            "Incremental Reserve Quantity": [50., 3., 4., 1.]})
+
+    def test_offers(self):
+        prices, cumulative = il_stack(self.data)
+
+        np.testing.assert_array_equal(prices, [2., 5.])
+        np.testing.assert_allclose(cumulative, [4., 8.])
+
+    def test_merged_with_il_data(self):
+        # il_data is cumulative, 10 MW at $2 and a further 5 MW at $8
+        prices, cumulative = il_stack(self.data, {8.: 15., 2.: 10.})
+
+        np.testing.assert_array_equal(prices, [2., 5., 8.])
+        np.testing.assert_allclose(cumulative, [14., 18., 23.])
+
+    def test_il_data_only(self):
+        prices, cumulative = il_stack(self.data[["Reserve Price"]],
+                                      {3.: 6.})
+
+        np.testing.assert_array_equal(prices, [3.])
+        np.testing.assert_allclose(cumulative, [6.])
+
+
+def periods_fan():
+    """ Random fans of two trading periods, both reserve types and islands,
+    with interruptible load in some of them.
+    """
+    parts = []
+    seed = 0
+    for date in ["12/12/2013", "13/12/2013"]:
+        for period in [1, 2]:
+            for reserve_type in ["FIR", "SIR"]:
+                for island in ["NI", "SI"]:
+                    part = random_fan(seed=seed, increments=30, rows=80)
+                    part["Node"] = part["Node"].str.replace("0", island)
+                    part["Product_Type"] = "PLSR"
+                    if seed % 3 == 0:
+                        part = pd.concat([part, pd.DataFrame({
+                            "Node": ["ILD" + island] * 2,
+                            "Product_Type": ["IL", "IL"],
+                            "Cumulative Energy Quantity": [0., 0.],
+                            "Incremental Energy Quantity": [0., 0.],
+                            "Energy Price": [0., 0.],
+                            "Reserve Price": [5., 20.],
+                            "Incremental Reserve Quantity": [3., 4.]})],
+                            ignore_index=True)
+                    part["Trading_Date"] = date
+                    part["Trading_Period"] = period
+                    part["Reserve_Type"] = reserve_type
+                    part["Island_Name"] = island
+                    parts.append(part)
+                    seed += 1
+
+    # Shuffled, the slices needn't be contiguous
+    fan = pd.concat(parts, ignore_index=True)
+    return fan.iloc[np.random.RandomState(0).permutation(len(fan))]
+
+
+class TestAggregateFans(unittest.TestCase):
+
+    def setUp(self):
+        self.fan = periods_fan()
+        self.curves = aggregate_fans(self.fan, compact=False)
+
+    def slices(self):
+        for (date, period, reserve_type), data in self.fan.groupby(
+                ["Trading_Date", "Trading_Period", "Reserve_Type"]):
+            for island, part in data.groupby("Island_Name"):
+                yield date, period, reserve_type, island, part
+            yield date, period, reserve_type, MARKET_NAME, data
+
+    def test_matches_reserve_contours(self):
+        count = 0
+        for date, period, reserve_type, island, data in self.slices():
+            expected = reserve_contours(data)
+            actual = self.curves.contours(date, period, reserve_type, island)
+            count += len(expected)
+
+            self.assertEqual(sorted(actual), sorted(expected))
+            for price in expected:
+                for x, y in zip(actual[price], expected[price]):
+                    np.testing.assert_allclose(x, y, atol=1e-9)
+        self.assertEqual(len(self.curves), count)
+
+    def test_curve_order(self):
+        table = self.curves.curves
+        self.assertEqual(list(table["Trading_Date"].unique()),
+                         ["20131212", "20131213"])
+        self.assertEqual(list(table["Island_Name"].unique()),
+                         ["NI", "SI", MARKET_NAME])
+        self.assertEqual(table.values.tolist(), table.sort_values(
+            ["Trading_Date", "Trading_Period", "Reserve_Type"]).values
+            .tolist())
+
+    def test_price_increments(self):
+        curves = aggregate_fans(self.fan, price_increments=[2.5, 10.],
+                                market=False, compact=False)
+
+        self.assertEqual(len(curves), 2 * 2 * 2 * 2 * 2)
+        for date, period, reserve_type, island, data in self.slices():
+            if island == MARKET_NAME:
+                continue
+            expected = reserve_contours(data, [2.5, 10.])
+            actual = curves.contours(date, period, reserve_type, island)
+            for price in expected:
+                for x, y in zip(actual[price], expected[price]):
+                    np.testing.assert_allclose(x, y, atol=1e-9)
+
+    def test_compact(self):
+        compact = aggregate_fans(self.fan)
+
+        self.assertEqual(compact.curves.values.tolist(),
+                         self.curves.curves.values.tolist())
+        for i in xrange(len(self.curves)):
+            full = self.curves.curve(i)
+            keep = breakpoints(*full)
+            for x, y in zip(compact.curve(i), full):
+                np.testing.assert_array_equal(x, y[keep])
+
+    def test_date_filters(self):
+        expected = self.curves.select(Trading_Date="20131213")
+
+        self.assertTrue(len(expected))
+        self.assertEqual(list(self.curves.select(
+            Trading_Date="13/12/2013").index), list(expected.index))
+        self.assertEqual(list(self.curves.select(
+            Trading_Date=["13/12/2013"]).index), list(expected.index))
+
+
+class TestAggregateCurvesFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_save_load(self):
+        curves = aggregate_fans(periods_fan())
+        fName = os.path.join(self.path, "curves.npz")
+        curves.save(fName)
+        loaded = AggregateCurves.load(fName)
+
+        self.assertEqual(loaded.curves.values.tolist(),
+                         curves.curves.values.tolist())
+        self.assertEqual(list(loaded.curves.dtypes), list(curves.curves.dtypes))
+        for name in ["offsets", "energy_price", "energy", "reserve"]:
+            np.testing.assert_array_equal(getattr(loaded, name),
+                                          getattr(curves, name))
+
+
+def polygon_area(verts):
+    x, y = verts[:, 0], verts[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+
+
+class TestEnergyShading(unittest.TestCase):
+
+    def setUp(self):
+        # A contour ascends in energy price
+        self.energy_price = np.array([0., 0., 10., 10., 10., 25., 60., 60.])
+        self.eline = np.array([0., 20., 35., 50., 80., 90., 120., 150.])
+        self.rline = np.array([0., 10., 18., 30., 30., 12., 40., 5.])
+
+    def test_polygons_match_interval_fill(self):
+        prices = np.unique(self.energy_price)
+        buckets = _price_buckets(self.energy_price, prices)
+        verts, polygon_buckets = _shading_polygons(self.eline, self.rline,
+                                                   buckets, len(prices))
+
+        low = -np.inf
+        for i, high in enumerate(prices):
+            # Each interval also takes the point before it, which opens the
+            # first segment of the interval
+            interval = (self.energy_price > low) & (self.energy_price <= high)
+            interval[:-1] |= interval[1:]
+            expected = np.trapz(self.rline[interval], self.eline[interval])
+
+            area = sum(polygon_area(x) for x, bucket in
+                       zip(verts, polygon_buckets) if bucket == i)
+            self.assertAlmostEqual(area, expected)
+            low = high
+
+    def test_prices_outside_of_the_ranges(self):
+        prices = np.array([10., 25.])
+        buckets = _price_buckets(self.energy_price, prices)
+        verts, polygon_buckets = _shading_polygons(self.eline, self.rline,
+                                                   buckets, len(prices))
+
+        self.assertEqual(list(buckets), [0, 0, 0, 0, 0, 1, 2, 2])
+        self.assertEqual(list(polygon_buckets), [0, 1])
+
+
+class TestTrancheColours(unittest.TestCase):
+
+    def test_prices_outside_of_the_tranches(self):
+        # The colour map returns the position along it as the colour
+        colours = _tranche_colours([-5., 0., 10., 15., 30., 100.],
+                                   [0., 10., 20., 30.],
+                                   lambda x: np.asarray(x)[:, np.newaxis])
+
+        np.testing.assert_allclose(colours[:, 0],
+                                   [0., 0., 1 / 3., 1 / 3., 1., 1.])
+
+
+if __name__ == '__main__':
+    unittest.main()
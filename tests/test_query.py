@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from Tessen.query import DispatchQuery
+
+
+def station_fan():
+    """ A station with an energy only band and a band of reserve at $5, and
+    3 MW of interruptible load at $2
+    """
+    energy_price = [0., 10., 20.] * 2 + [0.]
+    cumulative_energy = [0., 50., 100.] * 2 + [0.]
+    reserve_price = [0.] * 3 + [5.] * 3 + [2.]
+    cumulative_reserve = [0., 0., 0., 0., 10., 5., 3.]
+    incremental_reserve = [0., 0., 0., 0., 10., -5., 3.]
+    node = ["STA0"] * 6 + ["ILD0"]
+    product_type = ["PLSR"] * 6 + ["IL"]
+
+    return pd.DataFrame({"Trading_Date": "12/12/2013", "Trading_Period": 1,
+                         "Trading_Period_ID": "12/12/2013_01",
+                         "Reserve_Type": "FIR", "Island_Name": "NI",
+                         "Node": node, "Product_Type": product_type,
+                         "Energy Price": energy_price,
+                         "Cumulative Energy Quantity": cumulative_energy,
+                         "Reserve Price": reserve_price,
+                         "Cumulative Reserve Quantity": cumulative_reserve,
+                         "Incremental Reserve Quantity": incremental_reserve})
+
+
+class TestDispatchQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.query = DispatchQuery(station_fan())
+
+    def test_dispatch(self):
+        energy, reserve = self.query.dispatch([5., 10., 10., 25., 25.],
+                                              [10., 10., 4., 1., 5.])
+
+        np.testing.assert_allclose(energy, [[0., 50., 50., 100., 100.]])
+        np.testing.assert_allclose(reserve, [[3., 13., 3., 0., 8.]])
+
+    def test_station_groups(self):
+        query = DispatchQuery(station_fan(), by=["Reserve_Type", "Node"])
+        energy, reserve = query.dispatch(25., 5.)
+
+        self.assertEqual(list(query.groups["Node"]), ["ILD0", "STA0"])
+        np.testing.assert_allclose(energy, [[0.], [100.]])
+        np.testing.assert_allclose(reserve, [[3.], [5.]])
+
+    def test_date_key(self):
+        other = station_fan()
+        other["Trading_Date"] = "2013-12-12"
+        other["Node"] = ["STB0"] * 6 + ["ILE0"]
+        fan = pd.concat([station_fan(), other], ignore_index=True)
+        query = DispatchQuery(fan)
+        energy, reserve = query.dispatch(25., 5.)
+
+        # Both spellings of the date are the same trading date
+        self.assertEqual(list(query.groups["Trading_Date"]), ["20131212"])
+        self.assertEqual(list(query.select(Trading_Date="12/12/2013").index),
+                         [0])
+        np.testing.assert_allclose(energy, [[200.]])
+        np.testing.assert_allclose(reserve, [[16.]])
+
+    def test_reserve_types_are_not_added(self):
+        self.assertRaises(ValueError, DispatchQuery, station_fan(),
+                          by=["Island_Name"])
+
+
+if __name__ == '__main__':
+    unittest.main()